@@ -0,0 +1,118 @@
+"""
+Time to check an event's records, serial loop vs. the asyncio pipeline.
+
+Uses local stand-ins: an S3 which takes a fixed time per request, an SNS
+which takes a fixed time per publish, and an ``osslsigncode`` which takes a
+fixed time per file. Every record is notified (as with ``VERBOSE``), so all
+three stages have work to overlap. Run from the top of the repository:
+
+    PYTHONPATH=src python benchmarks/async_pipeline.py [records]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("XRAY_DISABLE", "yes")
+
+from fx_sig_verify import aio  # noqa: E402
+from fx_sig_verify import event_decoder  # noqa: E402
+from fx_sig_verify import validate_moz_signature as vms  # noqa: E402
+from fx_sig_verify.verifier import Verifier  # noqa: E402
+
+SAMPLE = os.path.join(os.path.dirname(__file__), "..", "tests", "data", "32bit.exe")
+S3_LATENCY = 0.05
+SNS_LATENCY = 0.05
+VERIFY_TIME = 0.1
+
+
+class Body:
+    def __init__(self, data):
+        self.data = data
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = len(self.data)
+        chunk, self.data = self.data[:size], self.data[size:]
+        return chunk
+
+
+class StandInS3:
+    """Just enough of get_object, serving the same object for every key."""
+
+    def __init__(self, data):
+        self.data = data
+
+    def get_object(self, Bucket, Key, Range=None, IfMatch=None):
+        time.sleep(S3_LATENCY)
+        size = len(self.data)
+        start, end = 0, size - 1
+        result = {"ETag": '"stand-in"'}
+        if Range:
+            first, last = Range[len("bytes=") :].split("-")
+            start, end = int(first), min(int(last), size - 1)
+            result["ContentRange"] = f"bytes {start}-{end}/{size}"
+        result["ContentLength"] = end - start + 1
+        result["Body"] = Body(self.data[start : end + 1])
+        return result
+
+
+class StandInSNS:
+    def publish(self, **kwargs):
+        time.sleep(SNS_LATENCY)
+        return {"MessageId": "stand-in"}
+
+
+def install_osslsigncode(directory):
+    script = os.path.join(directory, "osslsigncode")
+    with open(script, "w") as f:
+        f.write(f"#!/bin/sh\nexec sleep {VERIFY_TIME}\n")
+    os.chmod(script, 0o755)
+    os.environ["PATH"] = directory + os.pathsep + os.environ["PATH"]
+
+
+def records(count):
+    return [
+        event_decoder.from_s3_event_record(
+            {
+                "s3": {
+                    "bucket": {"name": "bucket"},
+                    "object": {"key": f"firefox-{i}.exe"},
+                }
+            }
+        )
+        for i in range(count)
+    ]
+
+
+def main(count=20):
+    with open(SAMPLE, "rb") as f:
+        data = f.read()
+    verifier = Verifier(
+        production_criteria=False,
+        verbose=1,
+        clients={"s3": StandInS3(data), "sns": StandInSNS()},
+        topic_arn="arn:aws:sns:us-east-1:123456789012:stand-in",
+    )
+    print(
+        f"{count} records, S3 {S3_LATENCY * 1000:.0f} ms/request,"
+        f" SNS {SNS_LATENCY * 1000:.0f} ms/publish,"
+        f" osslsigncode {VERIFY_TIME * 1000:.0f} ms\n"
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        install_osslsigncode(directory)
+        start = time.perf_counter()
+        serial = vms.process_records(records(count), max_workers=1, verifier=verifier)
+        serial_time = time.perf_counter() - start
+        start = time.perf_counter()
+        piped = aio.run(aio.process_records(records(count), verifier))
+        piped_time = time.perf_counter() - start
+    for artifacts in (serial, piped):
+        assert all(a.get_status() == "pass" for a in artifacts)
+    print(f"{'serial':>10} {serial_time:>7.2f}s")
+    print(f"{'pipelined':>10} {piped_time:>7.2f}s {serial_time / piped_time:>6.1f}x")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:2]))
@@ -0,0 +1,59 @@
+"""
+Per-record cost of creating AWS clients, before & after the shared registry.
+
+Runs against moto, so it measures client setup (credential resolution,
+service model loading, endpoint construction) rather than the network. Run
+from the top of the repository:
+
+    PYTHONPATH=src python benchmarks/client_overhead.py [records]
+"""
+
+import os
+import sys
+import time
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("XRAY_DISABLE", "yes")
+
+import boto3  # noqa: E402
+from moto import mock_s3, mock_sns  # noqa: E402
+
+from fx_sig_verify import aws_clients  # noqa: E402
+
+BUCKET = "benchmark-bucket"
+KEY = "firefox.exe"
+
+
+def one_record(get_client):
+    # what a record costs: a HEAD on S3 and a publish to SNS
+    get_client("s3").head_object(Bucket=BUCKET, Key=KEY)
+    get_client("sns").list_topics()
+
+
+def fresh_client(service_name):
+    return boto3.client(service_name)
+
+
+def timed(records, get_client):
+    start = time.perf_counter()
+    for _ in range(records):
+        one_record(get_client)
+    return (time.perf_counter() - start) / records
+
+
+@mock_s3
+@mock_sns
+def main(records=200):
+    boto3.client("s3").create_bucket(Bucket=BUCKET)
+    boto3.client("s3").put_object(Bucket=BUCKET, Key=KEY, Body=b"MZ" * 512)
+    aws_clients.reset_clients()
+    before = timed(records, fresh_client)
+    after = timed(records, aws_clients.client)
+    print(f"records:             {records}")
+    print(f"new clients/record:  {before * 1000:8.2f} ms per record")
+    print(f"shared clients:      {after * 1000:8.2f} ms per record")
+    print(f"speedup:             {before / after:8.1f}x")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:2]))
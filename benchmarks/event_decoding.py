@@ -0,0 +1,108 @@
+"""
+Time to decode large events, recursive unpacking vs. the iterative decoder.
+
+The "recursive" column is the unpacking used before ``event_decoder`` (plus
+the per record key decoding ``lambda_handler`` then did): it recursed into
+each SNS message, and re-serialized the whole event into the error message
+if anything was wrong. Run from the top of the repository:
+
+    PYTHONPATH=src python benchmarks/event_decoding.py [records]
+"""
+
+import json
+import sys
+import time
+import urllib.parse
+
+from fx_sig_verify.event_decoder import EventDecoder
+
+
+def recursive_unpack(events):
+    try:
+        for event in events["Records"]:
+            if "s3" in event:
+                yield event
+            elif "Sns" in event:
+                yield from recursive_unpack(json.loads(event["Sns"]["Message"]))
+            else:
+                raise KeyError(f"unknown event type '{json.dumps(event)}'")
+    except Exception:
+        raise ValueError(f"Invalid AWS Event '{json.dumps(events)}'")
+
+
+def recursive_normalized(events):
+    # what lambda_handler then did with each record
+    for record in recursive_unpack(events):
+        s3_object = record["s3"]["object"]
+        yield (
+            record["s3"]["bucket"]["name"],
+            urllib.parse.unquote_plus(s3_object["key"]),
+            s3_object.get("eTag"),
+            s3_object.get("size"),
+        )
+
+
+def s3_records(count):
+    return [
+        {
+            "eventSource": "aws:s3",
+            "s3": {
+                "bucket": {"name": "net-mozaws-prod-delivery-firefox"},
+                "object": {
+                    "key": f"pub/firefox/nightly/latest/firefox-{i}.win64.installer.exe",
+                    "size": 56789012,
+                    "eTag": f"{i:032x}",
+                    "sequencer": f"{i:018X}",
+                },
+            },
+        }
+        for i in range(count)
+    ]
+
+
+def events(count):
+    records = s3_records(count)
+    plain = {"Records": records}
+    # SNS messages of 10 records each
+    sns = {
+        "Records": [
+            {"Sns": {"Message": json.dumps({"Records": records[i : i + 10]})}}
+            for i in range(0, count, 10)
+        ]
+    }
+    bad = {"Records": records + [{"unexpected": True}]}
+    return [("S3", plain), ("SNS", sns), ("S3 + 1 bad", bad)]
+
+
+def timed(function, event, repeat=5):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        try:
+            count = sum(1 for _ in function(event))
+        except ValueError as e:
+            count = f"error ({len(str(e)) // 1024} KiB)"
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, count
+
+
+def decoded(event):
+    return EventDecoder().records(event)
+
+
+def main(count=5000):
+    print(
+        f"{'event':>12} {'recursive':>10} {'records':>16} {'decoder':>10} {'records':>8}"
+    )
+    for name, event in events(count):
+        old, old_count = timed(recursive_normalized, event)
+        new, new_count = timed(decoded, event)
+        print(
+            f"{name:>12} {old * 1000:>8.1f}ms {str(old_count):>16}"
+            f" {new * 1000:>8.1f}ms {new_count:>8}"
+        )
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:2]))
@@ -0,0 +1,86 @@
+"""
+Time to retrieve an object, single stream vs. concurrent ranged GETs.
+
+Uses a local stand-in for S3 which serves each response at a fixed per
+connection rate (S3 throughput is limited per connection, not per client),
+so the effect of concurrency is visible without the network. Run from the
+top of the repository:
+
+    PYTHONPATH=src python benchmarks/parallel_download.py [MiB/s per stream]
+"""
+
+import os
+import sys
+import time
+
+os.environ.setdefault("XRAY_DISABLE", "yes")
+
+from fx_sig_verify import aws_clients  # noqa: E402
+from fx_sig_verify import validate_moz_signature as vms  # noqa: E402
+
+MiB = 1024 * 1024
+SIZES_MB = (4, 16, 64, 128)
+
+
+class ThrottledBody:
+    def __init__(self, data, rate):
+        self.data = memoryview(data)
+        self.rate = rate
+        self.pos = 0
+
+    def read(self, size):
+        chunk = self.data[self.pos : self.pos + size]
+        self.pos += len(chunk)
+        time.sleep(len(chunk) / self.rate)
+        return bytes(chunk)
+
+
+class StandInS3:
+    """Just enough of get_object, serving one in-memory object."""
+
+    def __init__(self, data, rate):
+        self.data = data
+        self.rate = rate
+
+    def get_object(self, Bucket, Key, Range=None, IfMatch=None):
+        size = len(self.data)
+        start, end = 0, size - 1
+        result = {"ETag": '"stand-in"'}
+        if Range:
+            first, last = Range[len("bytes=") :].split("-")
+            start, end = int(first), min(int(last), size - 1)
+            result["ContentRange"] = f"bytes {start}-{end}/{size}"
+        result["ContentLength"] = end - start + 1
+        result["Body"] = ThrottledBody(self.data[start : end + 1], self.rate)
+        return result
+
+
+def fetch_time(data, rate, part_size):
+    aws_clients.set_client("s3", StandInS3(data, rate))
+    vms.DOWNLOAD_PART_SIZE = part_size
+    artifact = vms.MozSignedObjectViaLambda("bucket", "firefox.exe")
+    start = time.perf_counter()
+    with artifact.get_flo() as flo:
+        elapsed = time.perf_counter() - start
+        assert vms.MozSignedObject.file_size(flo) == len(data)
+    return elapsed, artifact.download_parts
+
+
+def main(rate_mb=50):
+    rate = rate_mb * MiB
+    part_size = vms.DOWNLOAD_PART_SIZE
+    print(f"{rate_mb} MiB/s per stream, {part_size // MiB} MiB parts,")
+    print(f"up to {vms.download_concurrency()} parts at once\n")
+    print(f"{'size':>8} {'single':>9} {'parts':>6} {'parallel':>9} {'speedup':>8}")
+    for size_mb in SIZES_MB:
+        data = os.urandom(size_mb * MiB)
+        single, _ = fetch_time(data, rate, len(data) + 1)
+        parallel, parts = fetch_time(data, rate, part_size)
+        print(
+            f"{size_mb:>5} MiB {single:>8.2f}s {parts:>6} {parallel:>8.2f}s"
+            f" {single / parallel:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:2]))
@@ -0,0 +1,44 @@
+"""
+Per-call cost of each tracing backend.
+
+The X-Ray backend is measured without a trace id, as in an unsampled
+invocation. Run from the top of the repository:
+
+    PYTHONPATH=src python benchmarks/tracing_overhead.py [calls]
+"""
+
+import sys
+import time
+
+from fx_sig_verify import tracing
+
+CALLS = 200000
+
+
+def stage(x):
+    return x
+
+
+def per_call(func, calls):
+    start = time.perf_counter()
+    for i in range(calls):
+        func(i)
+    return (time.perf_counter() - start) / calls
+
+
+def main(calls=CALLS):
+    baseline = per_call(stage, calls)
+    print(f"{'backend':>8} {'ns/call':>9} {'overhead':>9}")
+    for tracer in (
+        tracing.NoopTracer(),
+        tracing.XRayTracer(),
+        tracing.RecordingTracer(),
+    ):
+        seconds = per_call(tracer.traced()(stage), calls)
+        print(
+            f"{tracer.name:>8} {seconds * 1e9:>9.0f} {(seconds - baseline) * 1e9:>9.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:2]))
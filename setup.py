@@ -64,10 +64,14 @@ setup(
         #   'rst': ['docutils>=0.11'],
         #   ':python_version=="2.6"': ['argparse'],
         "cli": [],
+        # vectorized PE checksum, faster JSON logging
+        "fast": ["numpy", "orjson"],
     },
     entry_points={
         "console_scripts": [
             "fx-sig-verify = fx_sig_verify.cli:main [cli]",
+            "fx-sig-verify-backfill = fx_sig_verify.backfill:main [cli]",
+            "fx-sig-verify-leases = fx_sig_verify.leases:main [cli]",
             ("print-pe-certs =" " fx_sig_verify.verify_sigs.print_pe_certs:main [cli]"),
             "analyze_cloudwatch = analyze_cloudwatch:main [cli]",
         ],
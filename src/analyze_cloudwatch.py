@@ -17,6 +17,10 @@ CONFIGURED_MAX_RUN_TIME_MS = 60 * 1000
 JSON_STARTER = "{"
 REPORT_STARTER = "REPORT"
 ANY_STARTER = ""
+# structured log records (fx_sig_verify.structured_log) and metrics
+# (fx_sig_verify.metrics) start with these. They're not responses, so are
+# skipped without parsing.
+NON_RESPONSE_STARTERS = ('{"level":', '{"_aws":')
 
 # timestamp is optional (wasn't in original logs)
 # and may or may not have ANSI colorizing
@@ -54,10 +58,19 @@ JSON_OUTPUT = """
 {other:10,d} other failures
        ---
 {fail:8,d} total failed
+{deferred:8,d} deferred, out of time
 --------
 {total:8,d} processed
 ========
 """.strip()
+# per stage timings, from each result's "timings" (or, in older logs,
+# "s3wait")
+STAGES = ("wait", "download", "write", "parse", "verify", "notify")
+STAGE_HEADER = "{:>10} {:>8} {:>9} {:>9} {:>9} {:>9}".format(
+    "stage", "records", "p50 ms", "p90 ms", "p99 ms", "max ms"
+)
+STAGE_LINE = "{:>10} {:>8,d} {:>9,.1f} {:>9,.1f} {:>9,.1f} {:>9,.1f}"
+
 #  need the keys, as when rendered, no default values
 JSON_OUTPUT_KEYS = (
     "pass",
@@ -70,6 +83,7 @@ JSON_OUTPUT_KEYS = (
     "S3UnquoteSuccess",
     "other",
     "fail",
+    "deferred",
     "total",
 )
 
@@ -103,6 +117,8 @@ class JsonSummerizer(Summerizer):
         # always remove timestamp (if present)
         match = self.json_pattern.match(line)
         json_text = match.group("json")
+        if json_text.startswith(NON_RESPONSE_STARTERS):
+            return
         if self.summarize:
             datum = json.loads(json_text)
             self.data.append(datum)
@@ -116,6 +132,7 @@ class JsonSummerizer(Summerizer):
             for k in JSON_OUTPUT_KEYS:
                 self.counts[k] += 0
             print(JSON_OUTPUT.format(**self.counts))
+            self.print_stage_timings()
         else:
             for r in self.req_ids:
                 print(
@@ -144,9 +161,15 @@ class JsonSummerizer(Summerizer):
 
         counts = collections.Counter()
         counts["total"] = 0
+        self.timings = collections.defaultdict(list)
         for record in self.data:
             counts["total"] += len(record["results"])
             for check in record["results"]:
+                self.add_timings(check)
+                if check["status"] == "deferred":
+                    # neither passed nor failed (yet)
+                    counts["deferred"] += 1
+                    continue
                 incr(counts, check["status"] == "pass", "pass", "fail")
                 try:
                     reasons = check["results"]
@@ -188,6 +211,39 @@ class JsonSummerizer(Summerizer):
         counts["other"] = counts["fail"] - known_fails
         self.counts = counts
 
+    def add_timings(self, check):
+        timings = check.get("timings")
+        if timings is None and "s3wait" in check:
+            # older logs only have the time waiting on S3 (in seconds)
+            timings = {"wait": check["s3wait"] * 1000}
+        for stage, ms in (timings or {}).items():
+            self.timings[stage].append(ms)
+
+    def print_stage_timings(self):
+        if not self.timings:
+            return
+        print()
+        print(STAGE_HEADER)
+        for stage in STAGES:
+            values = sorted(self.timings.get(stage, []))
+            if values:
+                print(
+                    STAGE_LINE.format(
+                        stage,
+                        len(values),
+                        percentile(values, 50),
+                        percentile(values, 90),
+                        percentile(values, 99),
+                        values[-1],
+                    )
+                )
+
+
+def percentile(values, pcnt):
+    """Nearest rank percentile of the sorted `values`."""
+    rank = max(1, int(math.ceil(pcnt / 100 * len(values))))
+    return values[rank - 1]
+
 
 class MetricSummerizer(Summerizer):
     """Accumulate Metrics from the 'REPORT' text line."""
@@ -341,9 +397,13 @@ class ExtractSummarizer(Summerizer):
         """
         try:
             match = self.json_pattern.search(line)
-            datum = json.loads(match.group("json_string"))
+            json_string = match.group("json_string")
+            if json_string.startswith(NON_RESPONSE_STARTERS):
+                # not tied to a request
+                return None, json_string
+            datum = json.loads(json_string)
             req_id = datum["request_id"]
-        except (ValueError, AttributeError):
+        except (ValueError, AttributeError, KeyError):
             datum = line.strip()
             match = self.req_id_pattern.search(datum)
             if match:
@@ -0,0 +1,264 @@
+"""
+asyncio API, and pipelined processing of an event's records.
+
+``AsyncVerifier`` has coroutine versions of the ``verifier.Verifier``
+methods. ``osslsigncode`` is run with ``asyncio.create_subprocess_exec``,
+and the S3 & SNS calls (boto3 is blocking) are made in worker threads, so
+the event loop is free while they wait::
+
+    verifier = AsyncVerifier(Verifier(production_criteria=False))
+    artifacts = await asyncio.gather(*map(verifier.verify_path, paths))
+
+``process_records()`` checks a Lambda event's records as a three stage
+pipeline: while record N is verified, record N+1 is downloaded and record
+N-1's notification is sent. Only a record or two is held between stages,
+so memory stays bounded however many records there are. Use it by
+configuring ``fx_sig_verify.aio.lambda_handler`` as the Lambda handler.
+"""
+
+import asyncio
+import subprocess  # nosec  bandit complains otherwise
+
+from fx_sig_verify import profiling
+from fx_sig_verify import validate_moz_signature
+from fx_sig_verify.validate_moz_signature import (
+    RECORD_MIN_TIME,
+    DeadlineExceeded,
+    MozSignedObjectViaLambda,
+    SigVerifyException,
+    SigVerifyNoSignature,
+    VerifierUnavailable,
+    artifact_to_check_via_s3,
+    debug,
+    record_size,
+    show_verifier_output,
+    verifier_command,
+    warning,
+)
+from fx_sig_verify.verifier import MozSignedFile, Verifier
+
+
+class AsyncVerifier:
+    """Coroutine versions of the `verifier` methods.
+
+    Args:
+        verifier (verifier.Verifier): the configuration, default a
+            ``Verifier()``
+    """
+
+    def __init__(self, verifier=None):
+        self.verifier = Verifier() if verifier is None else verifier
+
+    async def verify_path(self, path):
+        """Verify the local file at `path`.
+
+        :returns: the checked artifact
+        """
+        artifact = MozSignedFile(path, verifier=self.verifier)
+        await check(artifact)
+        return artifact
+
+    async def verify_s3(self, bucket, key, etag=None, size=None):
+        """Verify the S3 object `key` in `bucket`.
+
+        :returns MozSignedObjectViaLambda: the checked artifact
+        """
+        artifact = MozSignedObjectViaLambda(
+            bucket, key, etag=etag, size=size, verifier=self.verifier
+        )
+        await check(artifact, screen=True)
+        return artifact
+
+
+async def in_thread(func, *args):
+    """``func(*args)`` in a worker thread, profiled if we are."""
+
+    def call():
+        with profiling.profiled_thread():
+            return func(*args)
+
+    return await asyncio.get_event_loop().run_in_executor(None, call)
+
+
+async def check(artifact, screen=False):
+    """Check `artifact`, setting its status."""
+    objf = await in_thread(prepare, artifact, screen)
+    await verify(artifact, objf)
+
+
+def prepare(artifact, screen=False):
+    """Everything before ``osslsigncode``: the verdict cache, download, and
+    in process checks. Blocks, so run in a thread.
+
+    :param screen: skip objects ``should_validate()`` rejects
+    :returns: the open file to verify, None if the check is already over
+    """
+    try:
+        if screen and not artifact.should_validate():
+            finish(artifact, True)
+            return None
+        cached = artifact.lookup_verdict()
+        if cached is not None:
+            finish(artifact, cached)
+            return None
+        objf = artifact.fetch()
+        try:
+            artifact.check_in_process(objf)
+        except BaseException:
+            objf.close()
+            raise
+        return objf
+    except Exception as e:
+        failed(artifact, e)
+        return None
+
+
+async def verify(artifact, objf):
+    """Have ``osslsigncode`` verify `objf`, a file from ``prepare()``, and
+    close it."""
+    if objf is None:
+        return
+    try:
+        with objf:
+            await run_verifier(artifact, objf)
+    except Exception as e:
+        failed(artifact, e)
+        return
+    artifact.store_verdict(True)
+    finish(artifact, True)
+
+
+async def run_verifier(artifact, objf):
+    """``MozSignedObject.run_verifier()``, without blocking."""
+    timeout = artifact.checked_verifier_timeout()
+    with artifact.verifier_input(objf) as (fname, pass_fds):
+        results = None
+        try:
+            with artifact.timed("verify"):
+                command = verifier_command(fname)
+                process = await asyncio.create_subprocess_exec(
+                    *command,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                    pass_fds=pass_fds,
+                )
+                try:
+                    stdout, stderr = await asyncio.wait_for(
+                        process.communicate(), timeout
+                    )
+                except asyncio.TimeoutError:
+                    process.kill()
+                    await process.wait()
+                    # not the file's fault, so don't record a verdict
+                    raise DeadlineExceeded(f"osslsigncode took over {timeout:.1f}s")
+            results = subprocess.CompletedProcess(
+                command,
+                process.returncode,
+                stdout.decode(errors="replace"),
+                stderr.decode(errors="replace"),
+            )
+            artifact.check_verifier_results(objf, results)
+        except DeadlineExceeded:
+            raise
+        except OSError as e:
+            raise VerifierUnavailable(f"couldn't run osslsigncode: {e!r}")
+        except Exception as e:
+            warning("osslsigncode exception %r", e)
+            show_verifier_output(results)
+            raise SigVerifyNoSignature
+
+
+def failed(artifact, e):
+    """Record why `e` ended the check of `artifact`."""
+    if isinstance(e, DeadlineExceeded):
+        artifact.defer(str(e))
+        return
+    if isinstance(e, SigVerifyException):
+        artifact.record_failure(e)
+    else:
+        artifact.add_failure(e)
+    finish(artifact, False)
+
+
+def finish(artifact, valid):
+    artifact.set_status("pass" if valid else "fail", only_if_unset=True)
+
+
+def report(artifact):
+    """Send `artifact`'s notification, as ``check_record()`` would."""
+    try:
+        artifact.report_validity()
+    except Exception as e:
+        artifact.add_error(f"app failure 2: {str(e)}")
+
+
+async def process_records(records, verifier):
+    """Check & report on S3 event records, as a pipeline.
+
+    Records are downloaded, verified, and notified in that order, one at a
+    time per stage, smallest first, and none started too close to the
+    deadline.
+
+    :param verifier: the ``verifier.Verifier`` to check them with
+    :returns list: the artifacts, in the same order as `records`
+    """
+    order = sorted(range(len(records)), key=lambda i: record_size(records[i]))
+    artifacts = [None] * len(records)
+    downloaded = asyncio.Queue(maxsize=1)
+    verified = asyncio.Queue(maxsize=1)
+
+    async def download():
+        for i in order:
+            artifact = artifact_to_check_via_s3(records[i], verifier)
+            artifacts[i] = artifact
+            time_left = artifact.time_left()
+            if time_left is not None and time_left < RECORD_MIN_TIME:
+                artifact.defer("not started, too close to the deadline")
+                objf = None
+            else:
+                objf = await in_thread(prepare, artifact, True)
+            await downloaded.put((artifact, objf))
+        await downloaded.put(None)
+
+    async def verify_all():
+        while True:
+            item = await downloaded.get()
+            if item is None:
+                break
+            await verify(*item)
+            await verified.put(item[0])
+        await verified.put(None)
+
+    async def notify():
+        while True:
+            artifact = await verified.get()
+            if artifact is None:
+                break
+            debug("%s: %s", artifact.artifact_name, artifact.get_status())
+            if not artifact.deferred:
+                # we'll report on it when it's finished
+                await in_thread(report, artifact)
+
+    await asyncio.gather(download(), verify_all(), notify())
+    return artifacts
+
+
+def run(main):
+    """Run the coroutine `main` to completion, in a new event loop.
+
+    For Python 3.6, which has no ``asyncio.run()``.
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        # which also attaches the child watcher subprocesses need
+        asyncio.set_event_loop(loop)
+        return loop.run_until_complete(main)
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+def lambda_handler(event, context):
+    """``validate_moz_signature.lambda_handler``, with the records
+    processed by ``process_records()``."""
+    return validate_moz_signature.lambda_handler(event, context, pipelined=True)
@@ -0,0 +1,159 @@
+"""
+Buffers to hold an artifact while it is verified.
+
+``osslsigncode`` needs a path to open, which is the only reason we ever
+wrote artifacts to ``/tmp``. An ``ArtifactBuffer`` holds the bytes in an
+anonymous memory file (``memfd_create``) when the platform supports it, and
+hands the child process a ``/proc/self/fd/N`` path. ``os.memfd_create``
+only arrived in Python 3.8, so on older interpreters we call the C
+library's ``memfd_create`` (glibc 2.27 and later) through ``ctypes``.
+Where that isn't possible we fall back to ``/dev/shm`` -- which Lambda
+doesn't have -- and finally to a regular temporary file.
+
+Memory backed buffers count against the Lambda memory limit, so artifacts
+larger than the caller's ``max_memory`` always go to disk.
+"""
+
+import ctypes
+import os
+import tempfile
+
+MEMFD = "memfd"
+SHM = "shm"
+TMP = "tmp"
+MEMORY_BACKENDS = (MEMFD, SHM)
+ALL_BACKENDS = MEMORY_BACKENDS + (TMP,)
+
+SHM_DIR = "/dev/shm"  # nosec -- only used for our own private files
+
+# Allow forcing a backend (e.g. if memfd misbehaves somewhere)
+BACKEND_ENV = "ARTIFACT_BUFFER"
+
+MFD_CLOEXEC = getattr(os, "MFD_CLOEXEC", 1)
+
+
+def _libc_memfd_create():
+    """The C library's memfd_create, or None if it doesn't have one."""
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        function = libc.memfd_create
+    except (OSError, AttributeError):
+        return None
+    function.argtypes = (ctypes.c_char_p, ctypes.c_uint)
+    function.restype = ctypes.c_int
+
+    def memfd_create(name, flags=MFD_CLOEXEC):
+        fd = function(os.fsencode(name), flags)
+        if fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        return fd
+
+    return memfd_create
+
+
+memfd_create = getattr(os, "memfd_create", None) or _libc_memfd_create()
+
+
+def memfd_supported():
+    return memfd_create is not None and os.path.isdir("/proc/self/fd")
+
+
+def shm_supported():
+    return os.path.isdir(SHM_DIR) and os.access(SHM_DIR, os.W_OK)
+
+
+def preferred_backends():
+    """Backends to try, in order of preference."""
+    forced = os.environ.get(BACKEND_ENV, "").strip().lower()
+    if forced in ALL_BACKENDS:
+        return [forced, TMP] if forced != TMP else [TMP]
+    backends = []
+    if memfd_supported():
+        backends.append(MEMFD)
+    if shm_supported():
+        backends.append(SHM)
+    backends.append(TMP)
+    return backends
+
+
+class ArtifactBuffer:
+    """A seekable binary file that a verifier subprocess can open by path.
+
+    Behaves as the underlying file object for reading & writing. Pass
+    ``verifier_path`` to the subprocess on its command line, and
+    ``pass_fds`` to ``subprocess.run()`` so the descriptor survives the
+    exec.
+
+    Args:
+        original_name (str): name human will recognize
+    """
+
+    def __init__(
+        self, backend, fileobj, verifier_path, pass_fds=(), original_name=None
+    ):
+        self.backend = backend
+        self.verifier_path = verifier_path
+        self.pass_fds = tuple(pass_fds)
+        self.original_name = original_name or "no-name-supplied"
+        self._file = fileobj
+
+    @classmethod
+    def create(cls, size_hint=None, max_memory=None, original_name=None, backends=None):
+        """Create an empty buffer on the best available backend.
+
+        :param size_hint: expected size in bytes, if known
+        :param max_memory: largest size to hold in memory, None for no limit
+        :param original_name: name for messages
+        :param backends: override of ``preferred_backends()``
+        """
+        if backends is None:
+            backends = preferred_backends()
+        too_big = (
+            size_hint is not None and max_memory is not None and size_hint > max_memory
+        )
+        last_error = None
+        for backend in backends:
+            if too_big and backend in MEMORY_BACKENDS:
+                continue
+            try:
+                return getattr(cls, "_create_" + backend)(original_name)
+            except OSError as e:
+                # e.g. memfd_create blocked by seccomp, /dev/shm full
+                last_error = e
+        if last_error:
+            raise last_error
+        return cls._create_tmp(original_name)
+
+    @classmethod
+    def _create_memfd(cls, original_name):
+        fd = memfd_create("fx-sig-verify", MFD_CLOEXEC)
+        fileobj = os.fdopen(fd, "w+b")
+        return cls(MEMFD, fileobj, f"/proc/self/fd/{fd}", (fd,), original_name)
+
+    @classmethod
+    def _create_shm(cls, original_name):
+        fileobj = tempfile.NamedTemporaryFile(mode="w+b", dir=SHM_DIR)
+        return cls(SHM, fileobj, fileobj.name, (), original_name)
+
+    @classmethod
+    def _create_tmp(cls, original_name):
+        fileobj = tempfile.NamedTemporaryFile(mode="w+b")
+        return cls(TMP, fileobj, fileobj.name, (), original_name)
+
+    @property
+    def in_memory(self):
+        return self.backend in MEMORY_BACKENDS
+
+    def __getattr__(self, name):
+        # act as the file object for everything else
+        return getattr(self._file, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._file.close()
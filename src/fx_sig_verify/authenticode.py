@@ -0,0 +1,342 @@
+"""
+In-process access to the Authenticode signature embedded in a PE file.
+
+Only the small amount of PE and ASN.1 structure needed to locate the
+certificate table and read the signer's serial number is decoded here. The
+cryptographic verification of the signature is still left to
+``osslsigncode``; this module lets us reject unsigned files, and files
+signed by someone other than Mozilla, without forking a process.
+
+References:
+    - https://docs.microsoft.com/en-us/windows/win32/debug/pe-format
+    - http://download.microsoft.com/download/9/c/5/9c5b2167-8017-4bae-9fde-d599bac8184a/Authenticode_PE.docx
+"""
+
+from collections import namedtuple
+import struct
+
+# Offsets & magic values from the PE/COFF specification
+DOS_MAGIC = b"MZ"
+PE_MAGIC = b"PE\0\0"
+PE_OFFSET_POINTER = 0x3C
+COFF_HEADER_SIZE = 20
+PE32_MAGIC = 0x10B
+PE32_PLUS_MAGIC = 0x20B
+CHECKSUM_OFFSET = 64  # from start of optional header, same for both formats
+SIZE_OF_HEADERS_OFFSET = 60
+SECURITY_DIRECTORY_INDEX = 4
+DATA_DIRECTORY_ENTRY_SIZE = 8
+# (offset of NumberOfRvaAndSizes, offset of first data directory)
+DATA_DIRECTORY_LAYOUT = {
+    PE32_MAGIC: (92, 96),
+    PE32_PLUS_MAGIC: (108, 112),
+}
+
+# How much of the file start we need to read to be confident we have all the
+# headers of any normal executable. Used when only part of a file is
+# available (e.g. a ranged GET from S3).
+HEADER_PROBE_SIZE = 4096
+
+WIN_CERT_HEADER_SIZE = 8
+WIN_CERT_TYPE_PKCS_SIGNED_DATA = 0x0002
+
+# ASN.1 DER tags we care about
+_TAG_INTEGER = 0x02
+_TAG_OCTET_STRING = 0x04
+_TAG_OID = 0x06
+_TAG_SEQUENCE = 0x30
+_TAG_SET = 0x31
+_TAG_CONTEXT_0 = 0xA0
+_TAG_CONTEXT_1 = 0xA1
+# 1.2.840.113549.1.7.2
+OID_SIGNED_DATA = bytes.fromhex("2a864886f70d010702")
+# 1.3.6.1.4.1.311.2.1.4
+OID_SPC_INDIRECT_DATA = bytes.fromhex("2b060104018237020104")
+# digest algorithm OIDs, by hashlib name
+DIGEST_ALGORITHM_OIDS = {
+    bytes.fromhex("2a864886f70d0205"): "md5",
+    bytes.fromhex("2b0e03021a"): "sha1",
+    bytes.fromhex("608648016503040201"): "sha256",
+    bytes.fromhex("608648016503040202"): "sha384",
+    bytes.fromhex("608648016503040203"): "sha512",
+}
+
+PEHeader = namedtuple(
+    "PEHeader",
+    [
+        "pe_offset",
+        "magic",
+        "size_of_headers",
+        "checksum_offset",  # file offset of the CheckSum field
+        "checksum",
+        "security_dir_offset",  # file offset of the security data directory
+        "cert_table_offset",
+        "cert_table_size",
+    ],
+)
+
+
+class AuthenticodeFormatError(ValueError):
+    """The data is not a PE file, or its signature structure is malformed."""
+
+    pass
+
+
+class NotPEFileError(AuthenticodeFormatError):
+    """The data does not start with the DOS & PE signatures."""
+
+    pass
+
+
+def parse_pe_header(data):
+    """Decode the PE headers needed to find the certificate table.
+
+    :param data: bytes-like object holding (at least) the start of the file,
+        through the end of the optional header's data directories.
+    :returns PEHeader: offsets and values of interest
+    :raises AuthenticodeFormatError: if ``data`` is not the start of a PE file
+    """
+    data = memoryview(data)
+    if bytes(data[:2]) != DOS_MAGIC:
+        raise NotPEFileError("missing 'MZ' signature")
+    if len(data) < PE_OFFSET_POINTER + 4:
+        raise NotPEFileError("truncated DOS header")
+    (pe_offset,) = struct.unpack_from("<I", data, PE_OFFSET_POINTER)
+    if bytes(data[pe_offset : pe_offset + 4]) != PE_MAGIC:
+        raise NotPEFileError("missing 'PE\\0\\0' signature")
+    opt_offset = pe_offset + len(PE_MAGIC) + COFF_HEADER_SIZE
+    try:
+        (magic,) = struct.unpack_from("<H", data, opt_offset)
+        if magic not in DATA_DIRECTORY_LAYOUT:
+            raise AuthenticodeFormatError(f"unknown optional header magic {magic:#x}")
+        count_offset, dirs_offset = DATA_DIRECTORY_LAYOUT[magic]
+        (size_of_headers,) = struct.unpack_from(
+            "<I", data, opt_offset + SIZE_OF_HEADERS_OFFSET
+        )
+        (checksum,) = struct.unpack_from("<I", data, opt_offset + CHECKSUM_OFFSET)
+        (dir_count,) = struct.unpack_from("<I", data, opt_offset + count_offset)
+        security_dir_offset = (
+            opt_offset
+            + dirs_offset
+            + SECURITY_DIRECTORY_INDEX * DATA_DIRECTORY_ENTRY_SIZE
+        )
+        if dir_count > SECURITY_DIRECTORY_INDEX:
+            cert_table_offset, cert_table_size = struct.unpack_from(
+                "<II", data, security_dir_offset
+            )
+        else:
+            cert_table_offset = cert_table_size = 0
+    except struct.error:
+        raise AuthenticodeFormatError("truncated PE optional header")
+    return PEHeader(
+        pe_offset,
+        magic,
+        size_of_headers,
+        opt_offset + CHECKSUM_OFFSET,
+        checksum,
+        security_dir_offset,
+        cert_table_offset,
+        cert_table_size,
+    )
+
+
+def iter_win_certificates(cert_table):
+    """Yield each ``(revision, cert_type, certificate)`` in a certificate table.
+
+    :param cert_table: bytes of the attribute certificate table
+    """
+    cert_table = memoryview(cert_table)
+    offset = 0
+    while offset + WIN_CERT_HEADER_SIZE <= len(cert_table):
+        length, revision, cert_type = struct.unpack_from("<IHH", cert_table, offset)
+        if length < WIN_CERT_HEADER_SIZE or offset + length > len(cert_table):
+            raise AuthenticodeFormatError(f"bad WIN_CERTIFICATE length {length}")
+        start = offset + WIN_CERT_HEADER_SIZE
+        yield revision, cert_type, cert_table[start : offset + length]
+        # entries are quadword aligned
+        offset += (length + 7) & ~7
+
+
+def _der_header(data, offset, end):
+    """Decode the tag & length at ``offset``.
+
+    :returns (tag, content_start, content_end):
+    """
+    if offset + 2 > end:
+        raise AuthenticodeFormatError("truncated ASN.1 data")
+    tag = data[offset]
+    length = data[offset + 1]
+    offset += 2
+    if length & 0x80:
+        num_octets = length & 0x7F
+        if num_octets == 0 or num_octets > 4 or offset + num_octets > end:
+            # indefinite lengths are not allowed in DER
+            raise AuthenticodeFormatError("unsupported ASN.1 length")
+        length = int.from_bytes(data[offset : offset + num_octets], "big")
+        offset += num_octets
+    if offset + length > end:
+        raise AuthenticodeFormatError("truncated ASN.1 data")
+    return tag, offset, offset + length
+
+
+def _der_children(data, start, end):
+    """Yield ``(tag, content_start, content_end)`` for each element in a
+    constructed value."""
+    offset = start
+    while offset < end:
+        tag, content_start, content_end = _der_header(data, offset, end)
+        yield tag, content_start, content_end
+        offset = content_end
+
+
+def _der_expect(data, offset, end, tag):
+    actual, start, stop = _der_header(data, offset, end)
+    if actual != tag:
+        raise AuthenticodeFormatError(
+            f"expected ASN.1 tag {tag:#x}, found {actual:#x} at {offset}"
+        )
+    return start, stop
+
+
+def signed_data_elements(pkcs7):
+    """Split a PKCS#7 ContentInfo into the elements of its SignedData.
+
+    :param pkcs7: DER encoded ContentInfo, as found in a WIN_CERTIFICATE
+    :returns dict: maps element name to ``(tag, start, end)`` within ``pkcs7``
+    """
+    pkcs7 = memoryview(pkcs7)
+    start, end = _der_expect(pkcs7, 0, len(pkcs7), _TAG_SEQUENCE)
+    oid_start, oid_end = _der_expect(pkcs7, start, end, _TAG_OID)
+    if bytes(pkcs7[oid_start:oid_end]) != OID_SIGNED_DATA:
+        raise AuthenticodeFormatError("PKCS#7 content is not SignedData")
+    explicit_start, explicit_end = _der_expect(pkcs7, oid_end, end, _TAG_CONTEXT_0)
+    sd_start, sd_end = _der_expect(pkcs7, explicit_start, explicit_end, _TAG_SEQUENCE)
+    elements = {}
+    names = iter(("version", "digest_algorithms", "content_info"))
+    for tag, child_start, child_end in _der_children(pkcs7, sd_start, sd_end):
+        if tag == _TAG_CONTEXT_0:
+            name = "certificates"
+        elif tag == _TAG_CONTEXT_1:
+            name = "crls"
+        elif tag == _TAG_SET and "content_info" in elements:
+            name = "signer_infos"
+        else:
+            name = next(names, None)
+            if name is None:
+                raise AuthenticodeFormatError("unexpected SignedData element")
+        elements[name] = (tag, child_start, child_end)
+    if "signer_infos" not in elements:
+        raise AuthenticodeFormatError("SignedData has no signerInfos")
+    return elements
+
+
+def signer_serials(pkcs7):
+    """Return the certificate serial number of each signer.
+
+    The serial is taken from the ``issuerAndSerialNumber`` of each
+    ``SignerInfo``, which identifies the certificate used to sign.
+
+    :param pkcs7: DER encoded ContentInfo, as found in a WIN_CERTIFICATE
+    :returns list: of serial numbers as ``int``
+    """
+    pkcs7 = memoryview(pkcs7)
+    _, start, end = signed_data_elements(pkcs7)["signer_infos"]
+    serials = []
+    for tag, info_start, info_end in _der_children(pkcs7, start, end):
+        if tag != _TAG_SEQUENCE:
+            raise AuthenticodeFormatError("malformed SignerInfo")
+        children = _der_children(pkcs7, info_start, info_end)
+        next(children)  # version
+        tag, sid_start, sid_end = next(children)
+        if tag != _TAG_SEQUENCE:
+            # subjectKeyIdentifier isn't used for Authenticode
+            raise AuthenticodeFormatError("SignerInfo without issuerAndSerialNumber")
+        sid = _der_children(pkcs7, sid_start, sid_end)
+        next(sid)  # issuer
+        tag, serial_start, serial_end = next(sid)
+        if tag != _TAG_INTEGER:
+            raise AuthenticodeFormatError("malformed serial number")
+        serials.append(
+            int.from_bytes(pkcs7[serial_start:serial_end], "big", signed=True)
+        )
+    return serials
+
+
+def indirect_data_digest(pkcs7):
+    """Return the image digest the signer vouched for.
+
+    Authenticode signs an ``SpcIndirectDataContent``, which carries the
+    digest of the PE image (see ``pe_digest``).
+
+    :param pkcs7: DER encoded ContentInfo, as found in a WIN_CERTIFICATE
+    :returns (algorithm, digest): hashlib name of the algorithm, and the
+        digest bytes
+    """
+    pkcs7 = memoryview(pkcs7)
+    _, start, end = signed_data_elements(pkcs7)["content_info"]
+    oid_start, oid_end = _der_expect(pkcs7, start, end, _TAG_OID)
+    if bytes(pkcs7[oid_start:oid_end]) != OID_SPC_INDIRECT_DATA:
+        raise AuthenticodeFormatError("signed content is not SpcIndirectDataContent")
+    explicit_start, explicit_end = _der_expect(pkcs7, oid_end, end, _TAG_CONTEXT_0)
+    spc_start, spc_end = _der_expect(pkcs7, explicit_start, explicit_end, _TAG_SEQUENCE)
+    children = _der_children(pkcs7, spc_start, spc_end)
+    next(children)  # SpcAttributeTypeAndOptionalValue
+    tag, info_start, info_end = next(children, (None, 0, 0))
+    if tag != _TAG_SEQUENCE:
+        raise AuthenticodeFormatError("malformed DigestInfo")
+    alg_start, alg_end = _der_expect(pkcs7, info_start, info_end, _TAG_SEQUENCE)
+    alg_oid_start, alg_oid_end = _der_expect(pkcs7, alg_start, alg_end, _TAG_OID)
+    oid = bytes(pkcs7[alg_oid_start:alg_oid_end])
+    if oid not in DIGEST_ALGORITHM_OIDS:
+        raise AuthenticodeFormatError(f"unknown digest algorithm {oid.hex()}")
+    digest_start, digest_end = _der_expect(pkcs7, alg_end, info_end, _TAG_OCTET_STRING)
+    return DIGEST_ALGORITHM_OIDS[oid], bytes(pkcs7[digest_start:digest_end])
+
+
+def pkcs7_signatures(cert_table):
+    """Return the PKCS#7 blobs contained in a certificate table."""
+    return [
+        cert
+        for _, cert_type, cert in iter_win_certificates(cert_table)
+        if cert_type == WIN_CERT_TYPE_PKCS_SIGNED_DATA
+    ]
+
+
+def read_header(flo):
+    """Read & decode the PE headers from the start of a seekable file."""
+    flo.seek(0, 0)
+    return parse_pe_header(flo.read(HEADER_PROBE_SIZE))
+
+
+def read_cert_table(flo, header):
+    """Read the certificate table described by ``header`` from ``flo``.
+
+    :returns bytes: the table, or ``b""`` if the file is not signed
+    """
+    if not header.cert_table_offset or not header.cert_table_size:
+        return b""
+    flo.seek(header.cert_table_offset, 0)
+    table = flo.read(header.cert_table_size)
+    if len(table) != header.cert_table_size:
+        raise AuthenticodeFormatError("certificate table extends past end of file")
+    return table
+
+
+def get_signer_serial(flo):
+    """Return the serial number of the certificate used to sign ``flo``.
+
+    Only the headers and the certificate table are read, so this is cheap
+    even for large files.
+
+    :param flo: seekable binary file like object
+    :returns int: serial number of the (first) signer, or None if the file
+        carries no Authenticode signature.
+    :raises AuthenticodeFormatError: if the file is not a PE file, or the
+        signature is malformed.
+    """
+    header = read_header(flo)
+    for pkcs7 in pkcs7_signatures(read_cert_table(flo, header)):
+        serials = signer_serials(pkcs7)
+        if serials:
+            return serials[0]
+    return None
@@ -0,0 +1,100 @@
+"""
+Shared, pooled AWS clients.
+
+Creating a boto3 client resolves credentials, loads the service model, and
+builds an endpoint -- and its first request pays for a TLS handshake. We
+used to do that for every artifact. Clients are now created once per
+service, kept at module level so they survive across records and warm
+Lambda invocations, and shared by all worker threads (botocore clients are
+thread safe once created; creating them is not, hence the lock).
+
+Connection pool size, retries, and TCP keep-alive can be tuned from the
+environment:
+
+    ``CLIENT_POOL_SIZE``
+        connections kept per client (default 32)
+    ``AWS_MAX_ATTEMPTS``, ``AWS_RETRY_MODE``
+        botocore's usual retry settings (default 3 attempts, "standard");
+        the mode only where botocore has retry modes
+    ``CLIENT_TCP_KEEPALIVE``
+        set to 0 to disable TCP keep-alive, where botocore supports it
+"""
+
+import os
+import threading
+
+from botocore.config import Config
+from fleece import boto3
+
+try:
+    # retry modes are in botocore 1.15 and later
+    import botocore.retries  # noqa: F401
+
+    RETRY_MODES = True
+except ImportError:
+    RETRY_MODES = False
+
+DEFAULT_POOL_SIZE = 32
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_RETRY_MODE = "standard"
+
+_clients = {}
+_session = None
+_lock = threading.Lock()
+
+
+def _int_from_env(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def client_config():
+    """The botocore ``Config`` used for all our clients."""
+    pool_size = max(1, _int_from_env("CLIENT_POOL_SIZE", DEFAULT_POOL_SIZE))
+    retries = {"max_attempts": _int_from_env("AWS_MAX_ATTEMPTS", DEFAULT_MAX_ATTEMPTS)}
+    if RETRY_MODES:
+        retries["mode"] = os.environ.get("AWS_RETRY_MODE") or DEFAULT_RETRY_MODE
+    options = {}
+    if "tcp_keepalive" in Config.OPTION_DEFAULTS:
+        # not in the botocore releases for Python 3.6
+        keepalive = os.environ.get("CLIENT_TCP_KEEPALIVE", "1") not in ("", "0")
+        options["tcp_keepalive"] = keepalive
+    return Config(
+        max_pool_connections=pool_size,
+        retries=retries,
+        connect_timeout=boto3.DEFAULT_CONNECT_TIMEOUT or boto3.DEFAULT_TIMEOUT or 60,
+        read_timeout=boto3.DEFAULT_READ_TIMEOUT or boto3.DEFAULT_TIMEOUT or 60,
+        **options,
+    )
+
+
+def client(service_name):
+    """Return the shared client for `service_name`, creating it if needed."""
+    found = _clients.get(service_name)
+    if found is not None:
+        return found
+    global _session
+    with _lock:
+        if service_name not in _clients:
+            if _session is None:
+                _session = boto3.session.Session()
+            _clients[service_name] = _session.client(
+                service_name, config=client_config()
+            )
+        return _clients[service_name]
+
+
+def set_client(service_name, client):
+    """Use `client` for `service_name` from now on (e.g. a local stand-in)."""
+    with _lock:
+        _clients[service_name] = client
+
+
+def reset_clients():
+    """Forget all clients, e.g. after the credentials or settings change."""
+    global _session
+    with _lock:
+        _clients.clear()
+        _session = None
@@ -0,0 +1,367 @@
+"""
+Re-verify everything under an S3 prefix, e.g. after a certificate rotation.
+
+The bucket is listed lazily, a page at a time, and each key the
+production filters (``should_validate()``) accept is verified by
+``MozSignedObjectViaLambda.process_one_s3_file``, ``--workers`` at a time.
+No notifications are sent: results are output as JSON lines (failures
+only, unless ``--all``), then a line of totals.
+
+With ``--checkpoint FILE``, progress is appended to FILE as it's made, so
+an interrupted run can be resumed by running the same command again. The
+checkpoint is JSON lines:
+
+    ``{"bucket": ..., "prefix": ..., "trust": ...}``
+        the header; a checkpoint is only resumed for the same bucket,
+        prefix, and trusted certificates
+    ``{"key": ..., "verdict": ..., "results": [...]}``
+        a key's verdict ("retry" for S3 errors and timeouts, which are
+        verified again on resumption), with the reasons if it didn't pass
+    ``{"last_key": ...}``
+        every key up to this one has a verdict (or was excluded), so
+        listing resumes after it
+
+::
+
+    fx-sig-verify-backfill --checkpoint releases.ckpt \\
+        net-mozaws-prod-delivery-firefox pub/firefox/releases/
+"""
+
+import argparse
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import json
+import os
+import sys
+import time
+
+from fx_sig_verify import structured_log
+from fx_sig_verify import verdict_cache
+from fx_sig_verify.validate_moz_signature import MozSignedObjectViaLambda
+from fx_sig_verify.verifier import Verifier
+
+DEFAULT_WORKERS = 8
+# the watermark is written after this many keys are finished
+CHECKPOINT_EVERY = 100
+RETRY = "retry"
+
+
+class CheckpointMismatch(ValueError):
+    """The checkpoint is of a different backfill."""
+
+    pass
+
+
+class Checkpoint:
+    """The progress of a backfill, kept in the file at `path`.
+
+    Args:
+        path (str): the checkpoint file, created if it doesn't exist
+        header (dict): identifies the backfill
+    """
+
+    def __init__(self, path, header):
+        self.path = path
+        self.last_key = None
+        self.verdicts = {}
+        end = 0
+        if os.path.exists(path):
+            end = self.load(header)
+        self.file = open(path, "r+" if end else "w")
+        if end:
+            # drop any record cut short, rather than append to it
+            self.file.truncate(end)
+            self.file.seek(0, 2)
+        else:
+            self.write(header)
+
+    def load(self, header):
+        """Read the checkpoint.
+
+        :returns int: the offset of the end of the last whole record
+        """
+        with open(self.path, "rb") as f:
+            data = f.read()
+        end = data.rfind(b"\n") + 1
+        # anything after the last newline was cut short by the interruption
+        for number, line in enumerate(data[:end].decode().splitlines()):
+            record = json.loads(line)
+            if number == 0:
+                if record != header:
+                    raise CheckpointMismatch(
+                        f"{self.path} is for {record}, not {header}"
+                    )
+            elif "last_key" in record:
+                self.last_key = record["last_key"]
+            else:
+                self.verdicts[record["key"]] = record["verdict"]
+        return end
+
+    def write(self, record):
+        self.file.write(json.dumps(record) + "\n")
+
+    def record(self, key, verdict, results=()):
+        self.verdicts[key] = verdict
+        record = {"key": key, "verdict": verdict}
+        if verdict != "pass":
+            record["results"] = list(results)
+        self.write(record)
+
+    def advance(self, last_key):
+        self.last_key = last_key
+        self.write({"last_key": last_key})
+        self.file.flush()
+
+    def retries(self):
+        """Keys which are to be verified again."""
+        return sorted(key for key, verdict in self.verdicts.items() if verdict == RETRY)
+
+    def close(self):
+        self.file.close()
+
+
+def list_objects(client, bucket, prefix, start_after=None):
+    """Yield the objects under `prefix`, in key order, a page at a time.
+
+    :param start_after: only list the keys after this one
+    """
+    kwargs = {"Bucket": bucket, "Prefix": prefix}
+    if start_after:
+        kwargs["StartAfter"] = start_after
+    for page in client.get_paginator("list_objects_v2").paginate(**kwargs):
+        yield from page.get("Contents", [])
+
+
+class Backfill:
+    """Verify the objects under `prefix` in `bucket`.
+
+    Args:
+        verifier (verifier.Verifier): to check them with; its production
+            criteria choose the objects
+        checkpoint (Checkpoint): to record progress in, and resume from
+        workers (int): objects to verify at once
+        max_objects (int): stop after verifying this many
+        last_key (str): stop after this key
+        on_result: called with the summary of each verified object
+    """
+
+    def __init__(
+        self,
+        bucket,
+        prefix,
+        verifier,
+        checkpoint=None,
+        workers=DEFAULT_WORKERS,
+        max_objects=None,
+        last_key=None,
+        on_result=None,
+    ):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.verifier = verifier
+        self.checkpoint = checkpoint
+        self.workers = workers
+        self.max_objects = max_objects
+        self.last_key = last_key
+        self.on_result = on_result
+        self.totals = Counter()
+
+    def retries(self):
+        """The keys the checkpoint says to verify again."""
+        if self.checkpoint is None:
+            return []
+        return self.checkpoint.retries()
+
+    def objects(self):
+        """The objects to consider: any to retry, then the listing."""
+        start_after = None
+        done = {}
+        if self.checkpoint is not None:
+            start_after = self.checkpoint.last_key
+            done = self.checkpoint.verdicts
+        for key in self.retries():
+            yield {"Key": key}
+        client = self.verifier.client("s3")
+        for obj in list_objects(client, self.bucket, self.prefix, start_after):
+            if self.last_key is not None and obj["Key"] > self.last_key:
+                break
+            if obj["Key"] in done:
+                # finished after the last watermark, or retried above
+                if done[obj["Key"]] != RETRY:
+                    self.totals["resumed"] += 1
+                continue
+            yield obj
+
+    def artifact(self, obj):
+        return MozSignedObjectViaLambda(
+            self.bucket,
+            obj["Key"],
+            etag=obj.get("ETag"),
+            size=obj.get("Size"),
+            verifier=self.verifier,
+        )
+
+    @staticmethod
+    def verify(artifact):
+        artifact.process_one_s3_file()
+        return artifact
+
+    def finished(self, artifact):
+        summary = artifact.summary()
+        verdict = RETRY if artifact.needs_retry else summary["verdict"]
+        self.totals[verdict] += 1
+        if self.checkpoint is not None:
+            self.checkpoint.record(artifact.key_name, verdict, summary["results"])
+        if self.on_result is not None:
+            self.on_result(summary)
+
+    def run(self):
+        """Verify the objects, until done or `max_objects` are.
+
+        :returns Counter: the number of objects per verdict, "excluded"
+            and "resumed" (already verified)
+        """
+        start = time.perf_counter()
+        # keys in listing order, with whether they're finished, to know
+        # how far the checkpoint can be advanced. Retried keys can be
+        # anywhere in the listing, so they're left out: their verdicts are
+        # in the checkpoint either way.
+        retried = set(self.retries())
+        order = deque()
+        finished = set()
+        pending = set()
+        since_checkpoint = 0
+        started = 0
+
+        def collect(done):
+            nonlocal since_checkpoint
+            for future in done:
+                pending.discard(future)
+                artifact = future.result()
+                self.finished(artifact)
+                finished.add(artifact.key_name)
+                since_checkpoint += 1
+            if since_checkpoint >= CHECKPOINT_EVERY:
+                self.advance(order, finished)
+                since_checkpoint = 0
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            try:
+                for obj in self.objects():
+                    if self.max_objects is not None and started >= self.max_objects:
+                        break
+                    artifact = self.artifact(obj)
+                    if artifact.key_name not in retried:
+                        order.append(artifact.key_name)
+                    if not artifact.should_validate():
+                        # decided without a GET
+                        self.totals["excluded"] += 1
+                        finished.add(artifact.key_name)
+                        continue
+                    started += 1
+                    pending.add(pool.submit(self.verify, artifact))
+                    if len(pending) >= 2 * self.workers:
+                        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        collect(done)
+                while pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+            finally:
+                for future in pending:
+                    future.cancel()
+                self.advance(order, finished)
+        self.totals["seconds"] = round(time.perf_counter() - start, 3)
+        return self.totals
+
+    def advance(self, order, finished):
+        """Move the checkpoint past the keys finished so far, in order."""
+        last_key = None
+        while order and order[0] in finished:
+            last_key = order.popleft()
+        if self.checkpoint is not None and last_key is not None:
+            self.checkpoint.advance(last_key)
+
+
+def parse_args(cmd_line=None):
+    parser = argparse.ArgumentParser(
+        description="Verify the executables under an S3 prefix."
+    )
+    parser.add_argument("bucket")
+    parser.add_argument("prefix", nargs="?", default="")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        metavar="N",
+        help=f"objects to verify at once (default {DEFAULT_WORKERS})",
+    )
+    parser.add_argument(
+        "--checkpoint", metavar="FILE", help="record progress in, and resume from, FILE"
+    )
+    parser.add_argument(
+        "--cache", metavar="URL", help="verdict cache, e.g. dynamodb://table"
+    )
+    parser.add_argument(
+        "--max-objects", type=int, metavar="N", help="stop after verifying N objects"
+    )
+    parser.add_argument(
+        "--all", action="store_true", help="output passes too, not just failures"
+    )
+    args = parser.parse_args(cmd_line)
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    return args
+
+
+def main(cmd_line=None):
+    """Run a backfill from the command line.
+
+    :returns result_code: 0 if every object verified passed
+    """
+    args = parse_args(cmd_line)
+    verifier = Verifier(verdict_cache=args.cache)
+    # stdout is for the results
+    structured_log.stream = sys.stderr
+
+    def output(summary):
+        if args.all or summary["verdict"] != "pass":
+            print(json.dumps(summary), flush=True)
+
+    checkpoint = None
+    if args.checkpoint:
+        header = {
+            "bucket": args.bucket,
+            "prefix": args.prefix,
+            "trust": verdict_cache.trust_fingerprint(verifier.valid_certs),
+        }
+        try:
+            checkpoint = Checkpoint(args.checkpoint, header)
+        except CheckpointMismatch as e:
+            print(f"fx-sig-verify-backfill: {e}", file=sys.stderr)
+            raise SystemExit(2)
+    backfill = Backfill(
+        args.bucket,
+        args.prefix,
+        verifier,
+        checkpoint=checkpoint,
+        workers=args.workers,
+        max_objects=args.max_objects,
+        on_result=output,
+    )
+    try:
+        totals = backfill.run()
+    finally:
+        structured_log.stream = None
+        if checkpoint is not None:
+            checkpoint.close()
+    print(json.dumps({"totals": totals}))
+    failed = sum(
+        count
+        for verdict, count in totals.items()
+        if verdict not in ("pass", "excluded", "resumed", "seconds")
+    )
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,72 +1,36 @@
 """
 Module that contains the command line app.
 
-Assumed to be called with one command line argument -- the file to be checked.
-When called from the command line, the SigVerifyTooBig exception is not raised.
+Called with the files to be checked: paths, globs, or ``@file`` naming a file
+which lists paths, one per line. When called from the command line, the
+SigVerifyTooBig exception is not raised.
 
 
 Layout based on https://github.com/ionelmc/cookiecutter-pylibrary
 """
 
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+import contextlib
+import glob
+import itertools
+import json
+import os
 import subprocess
 import sys
+import time
 # set up path for everything else
 import fx_sig_verify
+from fx_sig_verify import manifest
+from fx_sig_verify import profiling
+from fx_sig_verify import structured_log
 from fx_sig_verify.validate_moz_signature import (MozSignedObject,
-                                                  SigVerifyException)
-
-
-class MozSignedObjectViaCLI(MozSignedObject):
-    def __init__(self, fname=None, *args, **kwargs):
-        super(type(self), self).__init__(*args, **kwargs)
-        self.artifact_name = fname
-        self.url = "file://{}".format(fname)
-
-    def get_location(self):
-        "For S3, we need the bucket & key names"
-        return self.bucket, self.key
-
-    def report_validity(self, valid):
-        """
-        For invoked cli functions, we have 2 report channels:
-            1. print to stdout
-            2. exit code
-
-        The severity of any failure controls the what & where.
-        Any filtering or special casing should probably be applied in this
-        function. (E.g. excluding any artifacts from rules.)
-        """
-        if self.verbose:
-            print(self.format_message())
-
-    def summary(self):
-        json_info = {
-            'bucket': self.bucket_name,
-            'key': self.key_name,
-            'status': self.get_status(),
-            'results': self.errors + self.messages,
-        }
-        return json_info
-
-    def get_flo(self):
-        flo = open(self.artifact_name, 'rb')
-        return flo
-
-    def process_one_local_file(self):
-        if self.verbose:
-            print('Processing {}'.format(self.artifact_name))
-        try:
-            valid_sig = self.check_exe()
-        except Exception as e:
-            valid_sig = False
-            if isinstance(e, SigVerifyException):
-                self.add_error("Exception {}".format(type(e).__name__))
-            else:
-                self.add_error("failed to process local file {} '{}'"
-                               .format(self.artifact_name, repr(e)))
-        self.set_status("pass" if valid_sig else "fail")
-        return valid_sig
+                                                  production_exclusion)
+from fx_sig_verify.verifier import MozSignedFile, Verifier
+
+
+# the name it had when it lived here
+MozSignedObjectViaCLI = MozSignedFile
 
 
 def parse_args(cmd_line=None):
@@ -74,34 +38,213 @@ def parse_args(cmd_line=None):
     parser.add_argument('--version', action='version',
                         version="%(prog)s " + fx_sig_verify.__version__,
                         help='print version and exit')
-    parser.add_argument('suspect', help='file to check for validity',
-                        nargs=1)
+    parser.add_argument('--cache', metavar='FILE',
+                        help='SQLite file to remember verdicts in')
+    parser.add_argument('--profile', nargs='?', const='cpu',
+                        choices=sorted(profiling.KINDS),
+                        help='profile the run (default: cpu)')
+    parser.add_argument('--profile-output', metavar='DIR',
+                        help='save the profile in DIR, rather than '
+                             'printing it')
+    parser.add_argument('--jobs', '-j', type=int, metavar='N',
+                        help='check N files at once, in worker processes '
+                             '(only this process is profiled). Default 1, '
+                             'or the number of CPUs for a directory or '
+                             'manifest')
+    parser.add_argument('--json', action='store_true',
+                        help='output a line of JSON per file, and one of '
+                             'totals')
+    parser.add_argument('suspect', nargs='+',
+                        help='files to check for validity: paths, globs, '
+                             '@FILE to read paths from FILE, directories, '
+                             'or SHA256SUMS/SHA512SUMS manifests')
     args = parser.parse_args(cmd_line)
+    if args.jobs is not None and args.jobs < 1:
+        parser.error('--jobs must be at least 1')
     return args
 
 
+def expand_suspects(suspects, digests=None):
+    """The paths named by `suspects`, in order.
+
+    Globs are expanded (a glob matching nothing is kept, to be reported as
+    missing), and each ``@FILE`` is replaced by the paths listed in FILE,
+    one per line. Directories and manifests (see ``manifest``) are replaced
+    by the files in them which are checked in production.
+
+    :param digests: dict to add the manifest digest of each path to, as
+        (algorithm, hexdigest)
+    :raises ValueError: for a malformed manifest
+    """
+    paths = []
+    for suspect in suspects:
+        if suspect.startswith('@'):
+            with open(suspect[1:]) as f:
+                listed = [line.strip() for line in f]
+            paths.extend(expand_suspects(
+                [line for line in listed if line and not line.startswith('@')],
+                digests))
+        elif os.path.isdir(suspect):
+            paths.extend(production_files(suspect))
+        elif manifest.is_manifest(suspect):
+            for path, algorithm, digest in manifest.read_manifest(suspect):
+                paths.append(path)
+                if digests is not None:
+                    digests[path] = (algorithm, digest)
+        elif glob.has_magic(suspect):
+            paths.extend(sorted(glob.glob(suspect, recursive=True))
+                         or [suspect])
+        else:
+            paths.append(suspect)
+    return paths
+
+
+def production_files(directory):
+    """The files under `directory` the production filters accept, sorted."""
+    paths = []
+    for parent, dirs, files in os.walk(directory):
+        dirs.sort()
+        paths.extend(os.path.join(parent, name) for name in sorted(files)
+                     if production_exclusion(name) is None)
+    return paths
+
+
+def fans_out(suspects):
+    """True if `suspects` name enough files to keep every CPU busy."""
+    return any(os.path.isdir(suspect) or manifest.is_manifest(suspect)
+               for suspect in suspects)
+
+
+# this process's Verifier, and the settings it has, see configure(); a
+# forked worker inherits them, but not the right to use the cache's connection
+_verifier = None
+_settings = None
+
+
+def configure(cache=None, verbose=True):
+    """Apply the command line's settings to this process (the main one, or
+    a worker)."""
+    global _verifier, _settings
+    # when quiet, stdout is for the JSON results alone
+    structured_log.stream = None if verbose else sys.stderr
+    MozSignedObject.set_verbose(verbose)
+    if not verbose:
+        # not even from VERBOSE
+        MozSignedObject.verbose = 0
+    MozSignedObject.set_production_criteria(False)
+    MozSignedObject.set_verdict_cache(
+        "sqlite://" + cache if cache else None)
+    _verifier = Verifier.from_class_settings(MozSignedObject)
+    _settings = (os.getpid(), cache, verbose)
+
+
+def check_file(path, digest=None, settings=None):
+    """Verify the file at `path`.
+
+    :param digest: (algorithm, hexdigest) it should have
+    :param settings: (cache, verbose) to configure() this process with,
+        if it isn't already (a worker's first file)
+    :returns (dict, str): its summary & message, which (unlike the
+        artifact) can be returned from a worker process
+    """
+    if settings is not None and (os.getpid(),) + tuple(settings) != _settings:
+        configure(*settings)
+    artifact = _verifier.verify_path(path, digest)
+    return artifact.summary(), artifact.format_message()
+
+
+class Totals:
+    """Running totals of the files checked."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.files = 0
+        self.passed = 0
+        self.cached = 0
+        self.timings = {}
+
+    def add(self, summary):
+        self.files += 1
+        self.passed += summary['status'] == 'pass'
+        self.cached += bool(summary['cached'])
+        for stage, ms in summary['timings'].items():
+            self.timings[stage] = round(self.timings.get(stage, 0) + ms, 1)
+
+    @property
+    def failed(self):
+        return self.files - self.passed
+
+    def as_dict(self):
+        return {
+            'files': self.files,
+            'passed': self.passed,
+            'failed': self.failed,
+            'cached': self.cached,
+            'seconds': round(time.perf_counter() - self.start, 3),
+            'timings': self.timings,
+        }
+
+    def format_message(self):
+        totals = self.as_dict()
+        stages = ', '.join('{} {:.1f} ms'.format(stage, ms)
+                           for stage, ms in sorted(self.timings.items()))
+        return ('{files} files: {passed} passed, {failed} failed in '
+                '{seconds:.2f}s'.format(**totals)
+                + (' ({})'.format(stages) if stages else ''))
+
+
 def main(cmd_line=None):
     """
-    Check if the file specified on the command line is a valid Mozilla
-    executable for Windows
+    Check if the files specified on the command line are valid Mozilla
+    executables for Windows
 
-    :param filename: path to ``exe`` file
+    :param cmd_line: the arguments, default ``sys.argv[1:]``
     :returns result_code: 0 if no failure, per unix conventions
     """
-    MozSignedObject.set_verbose(True)
-    MozSignedObject.set_production_criteria(False)
-    found_bad_file = False
     args = parse_args(cmd_line=cmd_line)
-    for arg in args.suspect:
-        artifact = MozSignedObjectViaCLI(arg)
-        try:
-            valid = artifact.process_one_local_file()
-        except SigVerifyException:
-            valid = False
-        artifact.report_validity(valid)
-        if not valid:
-            found_bad_file = True
-    raise SystemExit(1 if found_bad_file else 0)
+    digests = {}
+    try:
+        paths = expand_suspects(args.suspect, digests)
+    except (OSError, ValueError) as e:
+        print('fx-sig-verify: {}'.format(e), file=sys.stderr)
+        raise SystemExit(2)
+    # JSON lines are the only output wanted on stdout
+    verbose = not args.json
+    settings = (args.cache, verbose)
+    configure(*settings)
+    results_of = map
+    jobs = args.jobs
+    if jobs is None:
+        jobs = (os.cpu_count() or 1) if fans_out(args.suspect) else 1
+    totals = Totals()
+    try:
+        with contextlib.ExitStack() as stack:
+            if args.profile:
+                cpu, memory = profiling.KINDS[args.profile]
+                stack.enter_context(profiling.Profiler(
+                    os.getpid(), cpu=cpu, memory=memory,
+                    output=args.profile_output))
+            if jobs > 1 and len(paths) > 1:
+                # workers configure themselves, from the settings passed
+                # with each file
+                pool = stack.enter_context(
+                    ProcessPoolExecutor(max_workers=jobs))
+                results_of = pool.map
+            for summary, message in results_of(
+                    check_file, paths, [digests.get(p) for p in paths],
+                    itertools.repeat(settings)):
+                totals.add(summary)
+                if args.json:
+                    print(json.dumps(summary), flush=True)
+                else:
+                    print(message, flush=True)
+    finally:
+        structured_log.stream = None
+    if args.json:
+        print(json.dumps({'totals': totals.as_dict()}))
+    elif totals.files > 1:
+        print(totals.format_message(), file=sys.stderr)
+    raise SystemExit(1 if totals.failed else 0)
 
 if __name__ == "__main__":
     main(sys.argv[1:])
@@ -0,0 +1,214 @@
+"""
+Decode the events which name S3 objects to check.
+
+Uploads reach us wrapped in various envelopes, possibly nested:
+
+    - S3 notifications (``{"Records": [{"s3": ...}]}``)
+    - SNS notifications, with the S3 notification as the ``Message`` string
+    - SQS messages, with either of the above as the ``body`` string
+    - EventBridge "Object Created" events from S3
+
+``EventDecoder`` walks them iteratively (no recursion, however deep the
+nesting), and yields an ``S3Record`` per object. A sub-record which can't
+be decoded is noted in ``errors``, with a bounded description, and the rest
+of the event is still decoded.
+"""
+
+from collections import namedtuple
+import json
+import urllib.parse
+
+# Limits on what we keep about bad sub-records
+MAX_ERROR_TEXT = 256
+MAX_ERRORS = 100
+
+S3Record = namedtuple(
+    "S3Record",
+    [
+        "bucket",
+        "key",  # the object's real key (S3 notifications escape it)
+        "etag",
+        "size",
+        "sequencer",
+        "source",  # outermost envelope: "s3", "sns", "sqs", or "eventbridge"
+        "message_id",  # of the SQS message holding the record, if any
+        "raw",  # the S3 notification record, None for EventBridge
+    ],
+)
+
+DecodeError = namedtuple("DecodeError", ["path", "message_id", "error"])
+
+
+def short_text(value, limit=MAX_ERROR_TEXT):
+    text = value if isinstance(value, str) else repr(value)
+    return text if len(text) <= limit else text[: limit - 3] + "..."
+
+
+# skips the argument handling of S3Record(), for the per record hot path
+_new_record = tuple.__new__
+
+
+def from_s3_event_record(record, source="s3", message_id=None):
+    """Make an ``S3Record`` from a record of an S3 notification."""
+    s3 = record["s3"]
+    s3_object = s3["object"]
+    key = s3_object["key"]
+    if "%" in key or "+" in key:
+        # issue #14 - the below decode majik is from AWS sample code.
+        key = urllib.parse.unquote_plus(key)
+    return _new_record(
+        S3Record,
+        (
+            s3["bucket"]["name"],
+            key,
+            s3_object.get("eTag"),
+            s3_object.get("size"),
+            s3_object.get("sequencer"),
+            source,
+            message_id,
+            record,
+        ),
+    )
+
+
+def from_eventbridge(event, message_id=None):
+    """Make an ``S3Record`` from an EventBridge "Object Created" event."""
+    detail = event["detail"]
+    s3_object = detail["object"]
+    return S3Record(
+        detail["bucket"]["name"],
+        # EventBridge doesn't escape the key
+        s3_object["key"],
+        s3_object.get("etag"),
+        s3_object.get("size"),
+        s3_object.get("sequencer"),
+        "eventbridge",
+        message_id,
+        None,
+    )
+
+
+def to_s3_event_record(record):
+    """The S3 notification record for an ``S3Record``, e.g. to requeue it."""
+    if record.raw is not None:
+        return record.raw
+    s3_object = {"key": urllib.parse.quote_plus(record.key)}
+    for name, value in (
+        ("eTag", record.etag),
+        ("size", record.size),
+        ("sequencer", record.sequencer),
+    ):
+        if value is not None:
+            s3_object[name] = value
+    return {
+        "eventSource": "aws:s3",
+        "eventName": "ObjectCreated:Put",
+        "s3": {"bucket": {"name": record.bucket}, "object": s3_object},
+    }
+
+
+class EventDecoder:
+    """Decode events into ``S3Record``s, noting bad sub-records.
+
+    Args:
+        max_errors (int): most ``DecodeError``s to keep; any more are
+            only counted
+    """
+
+    def __init__(self, max_errors=MAX_ERRORS):
+        self.max_errors = max_errors
+        self.errors = []
+        self.error_count = 0
+        self.sns_unpacked = False
+
+    def error(self, path, message_id, error):
+        self.error_count += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append(
+                DecodeError(short_text(path), message_id, short_text(error))
+            )
+
+    def records(self, event):
+        """Yield an ``S3Record`` for each object in `event`, in order."""
+        # A stack of frames, one per list being walked:
+        #   [items, next index, (parent frame, index in parent, label),
+        #    outermost source, SQS message id]
+        # Paths are only built when there's an error to report.
+        stack = [[[event], 0, None, None, None]]
+        while stack:
+            frame = stack[-1]
+            items, i = frame[0], frame[1]
+            if i >= len(items):
+                stack.pop()
+                continue
+            frame[1] = i + 1
+            item, source, message_id = items[i], frame[3], frame[4]
+            try:
+                if isinstance(item, dict) and "s3" in item:
+                    # by far the most common case
+                    yield from_s3_event_record(item, source or "s3", message_id)
+                    continue
+                if isinstance(item, str):
+                    # envelopes hold their contents as JSON text
+                    item = json.loads(item)
+                if not isinstance(item, dict):
+                    raise ValueError(f"expected an object, not {type(item).__name__}")
+                if "Records" in item:
+                    children = item["Records"]
+                    if not isinstance(children, list):
+                        raise ValueError("'Records' is not a list")
+                    stack.append(
+                        [children, 0, (frame, i, "Records"), source, message_id]
+                    )
+                elif "s3" in item:
+                    yield from_s3_event_record(item, source or "s3", message_id)
+                elif "Sns" in item:
+                    self.sns_unpacked = True
+                    message = item["Sns"]["Message"]
+                    stack.append(
+                        [[message], 0, (frame, i, "Sns"), source or "sns", message_id]
+                    )
+                elif item.get("Type") == "Notification" and "Message" in item:
+                    # SNS notification delivered to SQS without raw delivery
+                    self.sns_unpacked = True
+                    stack.append(
+                        [
+                            [item["Message"]],
+                            0,
+                            (frame, i, "Message"),
+                            source,
+                            message_id,
+                        ]
+                    )
+                elif "body" in item and item.get("eventSource", "aws:sqs") == "aws:sqs":
+                    message_id = item.get("messageId")
+                    stack.append(
+                        [
+                            [item["body"]],
+                            0,
+                            (frame, i, "body"),
+                            source or "sqs",
+                            message_id,
+                        ]
+                    )
+                elif item.get("source") == "aws.s3" and "detail" in item:
+                    if item.get("detail-type") == "Object Created":
+                        yield from_eventbridge(item, message_id)
+                elif item.get("Event") == "s3:TestEvent":
+                    # sent when notifications are configured
+                    continue
+                else:
+                    raise ValueError(f"unknown event type, keys {sorted(item)[:10]}")
+            except (KeyError, TypeError, ValueError) as e:
+                self.error(path_of(frame, i), message_id, f"{type(e).__name__}: {e}")
+
+
+def path_of(frame, index):
+    """Describe where item `index` of `frame` is, e.g. ``event.Records[3].Sns``."""
+    parts = []
+    while frame[2] is not None:
+        parent, parent_index, label = frame[2]
+        parts.append(f".{label}[{index}]" if label == "Records" else f".{label}")
+        frame, index = parent, parent_index
+    parts.append("event")
+    return "".join(reversed(parts))
@@ -0,0 +1,114 @@
+"""
+Drop repeated S3 event records.
+
+S3 delivers notifications at least once, and SNS & SQS can each add more
+copies, so the same upload may arrive several times -- in one batch, or in
+consecutive invocations. A record is identified by bucket, key, and the
+``sequencer`` S3 assigns to each change of the object (or its ETag, for
+events without one). Records with neither are never dropped.
+
+Repeats within an invocation are always dropped. Records which were
+processed to the end (no S3 error, and not deferred) are also remembered,
+in an LRU which lives as long as the Lambda container, so later copies are
+dropped too.
+``DEDUP_MAX_ENTRIES`` bounds its size (default 10000, 0 disables it).
+"""
+
+from collections import OrderedDict
+import os
+import threading
+
+from fx_sig_verify.event_decoder import S3Record, from_s3_event_record
+
+DEFAULT_MAX_ENTRIES = 10000
+
+
+def record_key(record):
+    """What identifies the change an S3 event record describes, or None.
+
+    :param record: an ``event_decoder.S3Record``, or a record of an S3
+        notification
+    """
+    if not isinstance(record, S3Record):
+        try:
+            record = from_s3_event_record(record)
+        except (KeyError, TypeError):
+            return None
+    version = record.sequencer or record.etag
+    if not version:
+        return None
+    return (record.bucket, record.key, version)
+
+
+class RecentRecords:
+    """Bounded, thread safe, least recently used set of record keys."""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self._lock:
+            if key not in self._keys:
+                return False
+            self._keys.move_to_end(key)
+            return True
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, key):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._keys[key] = True
+            self._keys.move_to_end(key)
+            while len(self._keys) > self.max_entries:
+                self._keys.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._keys.clear()
+
+
+def max_entries_from_environment():
+    try:
+        return int(os.environ.get("DEDUP_MAX_ENTRIES", DEFAULT_MAX_ENTRIES))
+    except ValueError:
+        return DEFAULT_MAX_ENTRIES
+
+
+# shared by all invocations in this container
+recent_records = RecentRecords(max_entries_from_environment())
+
+
+class DuplicateFilter:
+    """Filter the records of one invocation.
+
+    Args:
+        recent (RecentRecords): records seen by earlier invocations
+    """
+
+    def __init__(self, recent=None):
+        self.recent = recent_records if recent is None else recent
+        self.dropped = 0
+        self._batch = set()
+
+    def is_new(self, record):
+        """False if `record` repeats one already seen."""
+        key = record_key(record)
+        if key is None:
+            return True
+        if key in self._batch or key in self.recent:
+            self.dropped += 1
+            return False
+        self._batch.add(key)
+        return True
+
+    def remember(self, records, artifacts):
+        """Note the records processed, except those to be retried."""
+        for record, artifact in zip(records, artifacts):
+            key = record_key(record)
+            if key is not None and not artifact.needs_retry:
+                self.recent.add(key)
@@ -0,0 +1,659 @@
+"""
+Backfill a bucket on many machines, by leasing key ranges from a queue.
+
+A coordinator lists the bucket once and shards the keys into leases of
+(up to) ``--keys-per-lease`` consecutive keys, each published as a message
+on a queue. Any number of workers, on any number of machines, then:
+
+    - claim a lease, by receiving its message, for ``--lease-seconds``
+    - extend it, every half lease, while verifying its keys with
+      ``backfill.Backfill``
+    - complete it, by deleting the message, once every key has a verdict
+
+Each key's verdict goes to a results store shared by the workers. A lease
+which isn't completed -- the worker died, or there were S3 errors --
+becomes visible again when it times out, and is claimed by another
+worker, which verifies just the keys without a final verdict. After
+``--max-claims``, a lease is completed regardless, leaving its keys
+marked "retry" in the results. If its keys couldn't even be listed (e.g.
+the bucket is gone), its last key is marked "retry" for the lot, with the
+error.
+
+Queues and results stores are given as URLs:
+
+    ``https://sqs.<region>.amazonaws.com/<account>/<name>``
+        an SQS queue
+    ``sqlite:///path/to/file``
+        a stand-in for SQS, or a results store, in a local file shared
+        by the worker processes on one machine
+    ``dynamodb://table``
+        a results store; the table needs a string hash key named
+        ``bucket`` and a string range key named ``key``
+
+::
+
+    BUCKET=net-mozaws-prod-delivery-firefox
+    fx-sig-verify-leases shard $QUEUE $BUCKET pub/firefox/releases/
+    fx-sig-verify-leases work --processes 4 $QUEUE dynamodb://backfill-results
+    fx-sig-verify-leases report dynamodb://backfill-results $BUCKET
+"""
+
+import argparse
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+import json
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+
+from fx_sig_verify import aws_clients
+from fx_sig_verify import structured_log
+from fx_sig_verify.backfill import DEFAULT_WORKERS, RETRY, Backfill, list_objects
+from fx_sig_verify.validate_moz_signature import info, warning
+from fx_sig_verify.verifier import Verifier
+
+DEFAULT_KEYS_PER_LEASE = 1000
+DEFAULT_LEASE_SECONDS = 300
+# SQS long polling maximum
+DEFAULT_WAIT_SECONDS = 20
+DEFAULT_MAX_CLAIMS = 3
+# how often the SQLite stand-in looks for a visible lease
+POLL_SECONDS = 0.1
+# SQS batch maximum
+BATCH_SIZE = 10
+
+
+class LeaseLost(Exception):
+    """The lease timed out, and may have been claimed by another worker."""
+
+    pass
+
+
+def shard(client, bucket, prefix, keys_per_lease=DEFAULT_KEYS_PER_LEASE):
+    """Yield leases covering the keys under `prefix`.
+
+    A lease is the keys after ``start_after`` (None for the first) up to
+    and including ``last_key``.
+    """
+    lease = {"bucket": bucket, "prefix": prefix, "number": 0, "start_after": None}
+    count = 0
+    key = None
+    for obj in list_objects(client, bucket, prefix):
+        key = obj["Key"]
+        count += 1
+        if count == keys_per_lease:
+            yield dict(lease, last_key=key)
+            lease = dict(lease, number=lease["number"] + 1, start_after=key)
+            count = 0
+    if count:
+        yield dict(lease, last_key=key)
+
+
+class SQSLeaseQueue:
+    """Leases as messages on the SQS queue at `url`."""
+
+    def __init__(self, url, client=None):
+        self.url = url
+        self.client = client or aws_clients.client("sqs")
+
+    def publish(self, leases):
+        """Add `leases` to the queue.
+
+        :returns int: the number added
+        """
+        count = 0
+        batch = []
+        for lease in leases:
+            batch.append({"Id": str(len(batch)), "MessageBody": json.dumps(lease)})
+            if len(batch) == BATCH_SIZE:
+                count += self._send(batch)
+                batch = []
+        if batch:
+            count += self._send(batch)
+        return count
+
+    def _send(self, batch):
+        response = self.client.send_message_batch(QueueUrl=self.url, Entries=batch)
+        if response.get("Failed"):
+            raise RuntimeError(f"failed to publish leases: {response['Failed']}")
+        return len(batch)
+
+    def claim(self, lease_seconds, wait_seconds=0):
+        """Claim the next lease for `lease_seconds`.
+
+        :returns tuple: (lease, receipt, times claimed), or None if none
+            became visible in `wait_seconds`
+        """
+        messages = self.client.receive_message(
+            QueueUrl=self.url,
+            MaxNumberOfMessages=1,
+            VisibilityTimeout=lease_seconds,
+            WaitTimeSeconds=wait_seconds,
+            AttributeNames=["ApproximateReceiveCount"],
+        ).get("Messages", [])
+        if not messages:
+            return None
+        message = messages[0]
+        return (
+            json.loads(message["Body"]),
+            message["ReceiptHandle"],
+            int(message["Attributes"]["ApproximateReceiveCount"]),
+        )
+
+    def extend(self, receipt, lease_seconds):
+        self.client.change_message_visibility(
+            QueueUrl=self.url, ReceiptHandle=receipt, VisibilityTimeout=lease_seconds
+        )
+
+    def complete(self, receipt):
+        self.client.delete_message(QueueUrl=self.url, ReceiptHandle=receipt)
+
+    def outstanding(self):
+        """The number of leases not yet completed, claimed or not."""
+        names = [
+            "ApproximateNumberOfMessages",
+            "ApproximateNumberOfMessagesNotVisible",
+        ]
+        attributes = self.client.get_queue_attributes(
+            QueueUrl=self.url, AttributeNames=names
+        )["Attributes"]
+        # some SQS stand-ins return every attribute
+        return sum(int(attributes[name]) for name in names)
+
+    def close(self):
+        pass
+
+
+class SQLiteLeaseQueue:
+    """A stand-in for SQS in a local SQLite file.
+
+    Claims are made in a transaction, so worker processes sharing the file
+    each get a different lease.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(
+            path, timeout=60, isolation_level=None, check_same_thread=False
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS leases ("
+            " id INTEGER PRIMARY KEY,"
+            " body TEXT NOT NULL,"
+            " visible REAL NOT NULL,"
+            " receipt TEXT,"
+            " claims INTEGER NOT NULL DEFAULT 0)"
+        )
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._db
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            else:
+                self._db.execute("COMMIT")
+
+    def publish(self, leases):
+        rows = [(json.dumps(lease), 0) for lease in leases]
+        with self._transaction() as db:
+            db.executemany("INSERT INTO leases (body, visible) VALUES (?, ?)", rows)
+        return len(rows)
+
+    def claim(self, lease_seconds, wait_seconds=0):
+        give_up = time.monotonic() + wait_seconds
+        while True:
+            with self._transaction() as db:
+                now = time.time()
+                row = db.execute(
+                    "SELECT id, body, claims FROM leases WHERE visible <= ?"
+                    " ORDER BY id LIMIT 1",
+                    (now,),
+                ).fetchone()
+                if row is not None:
+                    receipt = uuid.uuid4().hex
+                    db.execute(
+                        "UPDATE leases SET visible = ?, receipt = ?, claims = ?"
+                        " WHERE id = ?",
+                        (now + lease_seconds, receipt, row[2] + 1, row[0]),
+                    )
+                    return json.loads(row[1]), receipt, row[2] + 1
+            if time.monotonic() >= give_up:
+                return None
+            time.sleep(POLL_SECONDS)
+
+    def extend(self, receipt, lease_seconds):
+        with self._transaction() as db:
+            updated = db.execute(
+                "UPDATE leases SET visible = ? WHERE receipt = ? AND visible > ?",
+                (time.time() + lease_seconds, receipt, time.time()),
+            ).rowcount
+        if not updated:
+            raise LeaseLost(receipt)
+
+    def complete(self, receipt):
+        with self._transaction() as db:
+            db.execute("DELETE FROM leases WHERE receipt = ?", (receipt,))
+
+    def outstanding(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM leases").fetchone()[0]
+
+    def close(self):
+        self._db.close()
+
+
+def queue_from_url(url):
+    """Open the lease queue at `url`: an SQS queue URL, or ``sqlite://``."""
+    if url.startswith("sqlite://"):
+        return SQLiteLeaseQueue(url[len("sqlite://") :])
+    if url.startswith("https://"):
+        return SQSLeaseQueue(url)
+    raise ValueError(f"Unknown lease queue '{url}'")
+
+
+class SQLiteResults:
+    """Verdicts by key, in a local SQLite file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                " bucket TEXT NOT NULL,"
+                " key TEXT NOT NULL,"
+                " verdict TEXT NOT NULL,"
+                " results TEXT NOT NULL,"
+                " PRIMARY KEY (bucket, key))"
+            )
+
+    def record(self, bucket, key, verdict, results=()):
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+                (bucket, key, verdict, json.dumps(list(results))),
+            )
+
+    def verdicts(self, bucket, start_after=None, last_key=None):
+        """The verdicts of the keys after `start_after`, up to `last_key`.
+
+        :returns dict: key -> verdict
+        """
+        query = "SELECT key, verdict FROM results WHERE bucket = ? AND key > ?"
+        params = [bucket, start_after or ""]
+        if last_key is not None:
+            query += " AND key <= ?"
+            params.append(last_key)
+        with self._lock:
+            return dict(self._db.execute(query, params).fetchall())
+
+    def results(self, bucket):
+        """Yield (key, verdict, results) for every key in `bucket`."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT key, verdict, results FROM results WHERE bucket = ?"
+                " ORDER BY key",
+                (bucket,),
+            ).fetchall()
+        for key, verdict, results in rows:
+            yield key, verdict, json.loads(results)
+
+    def close(self):
+        self._db.close()
+
+
+class DynamoDBResults:
+    """Verdicts by key, in a DynamoDB table shared by all the workers."""
+
+    def __init__(self, table_name, client=None):
+        self.table_name = table_name
+        self.client = client or aws_clients.client("dynamodb")
+
+    def record(self, bucket, key, verdict, results=()):
+        self.client.put_item(
+            TableName=self.table_name,
+            Item={
+                "bucket": {"S": bucket},
+                "key": {"S": key},
+                "verdict": {"S": verdict},
+                "results": {"S": json.dumps(list(results))},
+            },
+        )
+
+    def _query(self, bucket, start_after=None):
+        condition = "#b = :b"
+        values = {":b": {"S": bucket}}
+        if start_after:
+            condition += " AND #k > :k"
+            values[":k"] = {"S": start_after}
+        paginator = self.client.get_paginator("query")
+        for page in paginator.paginate(
+            TableName=self.table_name,
+            KeyConditionExpression=condition,
+            ExpressionAttributeNames={"#b": "bucket", "#k": "key"},
+            ExpressionAttributeValues=values,
+        ):
+            for item in page["Items"]:
+                yield item["key"]["S"], item["verdict"]["S"], item["results"]["S"]
+
+    def verdicts(self, bucket, start_after=None, last_key=None):
+        verdicts = {}
+        for key, verdict, _ in self._query(bucket, start_after):
+            if last_key is not None and key > last_key:
+                break
+            verdicts[key] = verdict
+        return verdicts
+
+    def results(self, bucket):
+        for key, verdict, results in self._query(bucket):
+            yield key, verdict, json.loads(results)
+
+    def close(self):
+        pass
+
+
+def results_from_url(url):
+    """Open the results store at `url`: ``sqlite://`` or ``dynamodb://``."""
+    if url.startswith("sqlite://"):
+        return SQLiteResults(url[len("sqlite://") :])
+    if url.startswith("dynamodb://"):
+        return DynamoDBResults(url[len("dynamodb://") :])
+    raise ValueError(f"Unknown results store '{url}'")
+
+
+class LeaseProgress:
+    """The progress of a lease, kept in the results store.
+
+    Stands in for a ``backfill.Checkpoint``, so a reclaimed lease only
+    verifies the keys without a final verdict.
+    """
+
+    def __init__(self, results, lease):
+        self.results = results
+        self.bucket = lease["bucket"]
+        self.last_key = lease["start_after"]
+        self.verdicts = results.verdicts(
+            self.bucket, lease["start_after"], lease["last_key"]
+        )
+
+    def record(self, key, verdict, results=()):
+        self.verdicts[key] = verdict
+        self.results.record(self.bucket, key, verdict, results)
+
+    def advance(self, last_key):
+        self.last_key = last_key
+
+    def retries(self):
+        return sorted(key for key, verdict in self.verdicts.items() if verdict == RETRY)
+
+
+class Heartbeat(threading.Thread):
+    """Extend a lease every half lease, until the end of the ``with``."""
+
+    def __init__(self, queue, receipt, lease_seconds):
+        super().__init__(daemon=True)
+        self.queue = queue
+        self.receipt = receipt
+        self.lease_seconds = lease_seconds
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.lease_seconds / 2):
+            try:
+                self.queue.extend(self.receipt, self.lease_seconds)
+            except Exception as e:
+                # the lease may be verified twice, which is only wasteful
+                warning("failed to extend lease: %r", e)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.join()
+
+
+def work(
+    queue,
+    results,
+    verifier,
+    lease_seconds=DEFAULT_LEASE_SECONDS,
+    wait_seconds=DEFAULT_WAIT_SECONDS,
+    workers=DEFAULT_WORKERS,
+    max_claims=DEFAULT_MAX_CLAIMS,
+    on_result=None,
+):
+    """Verify the leases on `queue`, until all are completed.
+
+    :returns Counter: the number of keys per verdict, and of "leases"
+        completed and "abandoned" (left to time out)
+    """
+    totals = Counter()
+    while True:
+        claimed = queue.claim(lease_seconds, wait_seconds)
+        if claimed is None:
+            if not queue.outstanding():
+                return totals
+            # others' leases, which may yet time out
+            continue
+        lease, receipt, claims = claimed
+        info("claimed lease %s (claim %s)", lease["number"], claims)
+        backfill = Backfill(
+            lease["bucket"],
+            lease["prefix"],
+            verifier,
+            checkpoint=LeaseProgress(results, lease),
+            workers=workers,
+            last_key=lease["last_key"],
+            on_result=on_result,
+        )
+        try:
+            with Heartbeat(queue, receipt, lease_seconds):
+                lease_totals = backfill.run()
+        except Exception as e:
+            if claims < max_claims:
+                warning("abandoned lease %s: %r", lease["number"], e)
+                totals["abandoned"] += 1
+                continue
+            warning("gave up on lease %s: %r", lease["number"], e)
+            totals[RETRY] += give_up(results, lease, e)
+        else:
+            del lease_totals["seconds"]
+            totals.update(lease_totals)
+            if lease_totals[RETRY] and claims < max_claims:
+                # claimed again once it times out
+                totals["abandoned"] += 1
+                continue
+        queue.complete(receipt)
+        totals["leases"] += 1
+
+
+def give_up(results, lease, error):
+    """Mark the keys of a lease which keeps failing "retry", with `error`.
+
+    Its last key stands for any which couldn't be listed.
+
+    :returns int: the number of keys marked
+    """
+    bucket = lease["bucket"]
+    verdicts = results.verdicts(bucket, lease["start_after"], lease["last_key"])
+    keys = [key for key, verdict in verdicts.items() if verdict == RETRY]
+    if lease["last_key"] not in verdicts:
+        keys.append(lease["last_key"])
+    for key in keys:
+        results.record(bucket, key, RETRY, [repr(error)])
+    return len(keys)
+
+
+def print_failure(summary):
+    if summary["verdict"] != "pass":
+        print(json.dumps(summary), flush=True)
+
+
+def work_from_urls(queue_url, results_url, cache=None, **kwargs):
+    """``work()``, opening the queue and results store by URL.
+
+    For a worker process: nothing needs pickling but the URLs.
+    """
+    # stdout is for the results
+    structured_log.stream = sys.stderr
+    queue = queue_from_url(queue_url)
+    results = results_from_url(results_url)
+    try:
+        verifier = Verifier(verdict_cache=cache)
+        return work(queue, results, verifier, on_result=print_failure, **kwargs)
+    finally:
+        queue.close()
+        results.close()
+        structured_log.stream = None
+
+
+def run_workers(processes, queue_url, results_url, **kwargs):
+    """Run `processes` workers, until all the leases are completed.
+
+    :returns Counter: their totals, summed
+    """
+    if processes == 1:
+        return work_from_urls(queue_url, results_url, **kwargs)
+    totals = Counter()
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        futures = [
+            pool.submit(work_from_urls, queue_url, results_url, **kwargs)
+            for _ in range(processes)
+        ]
+        for future in futures:
+            totals.update(future.result())
+    return totals
+
+
+def failed(totals):
+    return any(
+        count
+        for verdict, count in totals.items()
+        if verdict not in ("pass", "excluded", "resumed", "leases", "abandoned")
+    )
+
+
+def parse_args(cmd_line=None):
+    parser = argparse.ArgumentParser(
+        description="Verify the executables in a bucket, on many machines."
+    )
+    commands = parser.add_subparsers(dest="command")
+    # set afterwards, as add_subparsers() only takes required= on Python 3.7+
+    commands.required = True
+
+    shard_parser = commands.add_parser("shard", help="publish the leases")
+    shard_parser.add_argument("queue")
+    shard_parser.add_argument("bucket")
+    shard_parser.add_argument("prefix", nargs="?", default="")
+    shard_parser.add_argument(
+        "--keys-per-lease",
+        type=int,
+        default=DEFAULT_KEYS_PER_LEASE,
+        metavar="N",
+        help=f"(default {DEFAULT_KEYS_PER_LEASE})",
+    )
+
+    work_parser = commands.add_parser("work", help="verify leased keys")
+    work_parser.add_argument("queue")
+    work_parser.add_argument("results", help="results store URL")
+    work_parser.add_argument(
+        "--processes", type=int, default=1, metavar="N", help="worker processes"
+    )
+    work_parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        metavar="N",
+        help=f"objects each process verifies at once (default {DEFAULT_WORKERS})",
+    )
+    work_parser.add_argument(
+        "--lease-seconds",
+        type=int,
+        default=DEFAULT_LEASE_SECONDS,
+        metavar="S",
+        help=f"(default {DEFAULT_LEASE_SECONDS})",
+    )
+    work_parser.add_argument(
+        "--wait-seconds",
+        type=int,
+        default=DEFAULT_WAIT_SECONDS,
+        metavar="S",
+        help=f"to wait for a lease (default {DEFAULT_WAIT_SECONDS})",
+    )
+    work_parser.add_argument(
+        "--max-claims",
+        type=int,
+        default=DEFAULT_MAX_CLAIMS,
+        metavar="N",
+        help=f"times a lease is retried (default {DEFAULT_MAX_CLAIMS})",
+    )
+    work_parser.add_argument(
+        "--cache", metavar="URL", help="verdict cache, e.g. dynamodb://table"
+    )
+
+    report_parser = commands.add_parser("report", help="output the results")
+    report_parser.add_argument("results", help="results store URL")
+    report_parser.add_argument("bucket")
+
+    args = parser.parse_args(cmd_line)
+    for name in ("keys_per_lease", "processes", "workers", "lease_seconds"):
+        if getattr(args, name, 1) < 1:
+            parser.error(f"--{name.replace('_', '-')} must be at least 1")
+    return args
+
+
+def main(cmd_line=None):
+    """Run a coordinator, worker, or report from the command line.
+
+    :returns result_code: 0 unless an object failed
+    """
+    args = parse_args(cmd_line)
+    if args.command == "shard":
+        queue = queue_from_url(args.queue)
+        try:
+            leases = shard(
+                aws_clients.client("s3"), args.bucket, args.prefix, args.keys_per_lease
+            )
+            print(json.dumps({"leases": queue.publish(leases)}))
+        finally:
+            queue.close()
+        raise SystemExit(0)
+    if args.command == "work":
+        totals = run_workers(
+            args.processes,
+            args.queue,
+            args.results,
+            cache=args.cache,
+            lease_seconds=args.lease_seconds,
+            wait_seconds=args.wait_seconds,
+            workers=args.workers,
+            max_claims=args.max_claims,
+        )
+    else:
+        results = results_from_url(args.results)
+        totals = Counter()
+        try:
+            for key, verdict, reasons in results.results(args.bucket):
+                totals[verdict] += 1
+                if verdict != "pass":
+                    failure = {"key": key, "verdict": verdict, "results": reasons}
+                    print(json.dumps(failure))
+        finally:
+            results.close()
+    print(json.dumps({"totals": totals}))
+    raise SystemExit(1 if failed(totals) else 0)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,70 @@
+"""
+Release manifests: ``SHA256SUMS`` and ``SHA512SUMS`` files.
+
+Each line is a hex digest and a path relative to the manifest, as written
+by ``sha256sum``::
+
+    4f0a...e1  win64/en-US/Firefox Setup 120.0.exe
+
+Only the entries the production filters accept (see
+``validate_moz_signature.production_exclusion()``) are checked. Each file's
+digest is computed as it's read for verification, and a file which doesn't
+match fails. Since the digest identifies the contents, it's also the
+verdict cache key, so files with a cached verdict aren't read at all.
+"""
+
+import os
+import re
+
+from fx_sig_verify.validate_moz_signature import production_exclusion
+
+# manifest file name -> hashlib algorithm
+ALGORITHMS = {"SHA256SUMS": "sha256", "SHA512SUMS": "sha512"}
+HEX_LENGTHS = {"sha256": 64, "sha512": 128}
+
+# "<digest>  <path>", or "<digest> *<path>" for binary mode
+_line = re.compile(r"^(?P<digest>[0-9a-fA-F]+) [ *](?P<path>.+)$")
+
+
+class ManifestMismatch(Exception):
+    """A file's contents don't match its manifest entry.
+
+    Not a SigVerifyException: it says nothing about the contents' signature,
+    so no verdict is cached.
+    """
+
+    pass
+
+
+def is_manifest(path):
+    return os.path.basename(path) in ALGORITHMS and os.path.isfile(path)
+
+
+def read_manifest(path):
+    """The entries of the manifest at `path` to check.
+
+    :returns list: of (path, algorithm, hexdigest), paths relative to the
+        current directory
+    :raises ValueError: for a line which isn't an entry
+    """
+    algorithm = ALGORITHMS[os.path.basename(path)]
+    base = os.path.dirname(path)
+    entries = []
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            line = line.rstrip("\r\n")
+            if not line.strip():
+                continue
+            match = _line.match(line)
+            if not match or len(match["digest"]) != HEX_LENGTHS[algorithm]:
+                raise ValueError(f"{path}:{number}: not a {algorithm} entry")
+            if production_exclusion(match["path"]) is not None:
+                continue
+            entries.append(
+                (
+                    os.path.join(base, match["path"]),
+                    algorithm,
+                    match["digest"].lower(),
+                )
+            )
+    return entries
@@ -0,0 +1,81 @@
+"""
+Per-record metrics, as CloudWatch Embedded Metric Format (EMF) log lines.
+
+CloudWatch turns each EMF line into metric data points, so percentiles of
+each stage are available without parsing the logs. One line is logged per
+record, from its ``summary()``:
+
+    ==================  ==============  ================================
+    metric              unit            from
+    ==================  ==============  ================================
+    WaitTime            Milliseconds    sleeping on a missing S3 key
+    DownloadTime        Milliseconds    retrieving (incl. wait & write)
+    WriteTime           Milliseconds    writing to the artifact buffer
+    ParseTime           Milliseconds    in-process signature checks
+    VerifyTime          Milliseconds    running ``osslsigncode``
+    NotifyTime          Milliseconds    publishing (or queueing) to SNS
+    BytesFetched        Bytes           probe and download
+    ==================  ==============  ================================
+
+Each is recorded across all records, and by ``Verdict`` ("pass", or the
+failure class). Stages a record didn't reach are left out.
+
+``METRICS_NAMESPACE`` names the namespace (default "fx-sig-verify"), and
+``METRICS=none`` turns the lines off.
+"""
+
+import os
+import time
+
+DEFAULT_NAMESPACE = "fx-sig-verify"
+
+# summary() timings key -> metric name
+STAGE_METRICS = (
+    ("wait", "WaitTime"),
+    ("download", "DownloadTime"),
+    ("write", "WriteTime"),
+    ("parse", "ParseTime"),
+    ("verify", "VerifyTime"),
+    ("notify", "NotifyTime"),
+)
+
+# metric lines start with this, so readers can skip them cheaply
+RECORD_PREFIX = '{"_aws":'
+
+
+def enabled():
+    return os.environ.get("METRICS", "emf").lower() != "none"
+
+
+def emf_record(summary, namespace=None, timestamp=None):
+    """The EMF object for one record's `summary`."""
+    if namespace is None:
+        namespace = os.environ.get("METRICS_NAMESPACE") or DEFAULT_NAMESPACE
+    if timestamp is None:
+        timestamp = time.time()
+    values = {}
+    definitions = []
+    timings = summary.get("timings", {})
+    for stage, name in STAGE_METRICS:
+        if stage in timings:
+            values[name] = timings[stage]
+            definitions.append({"Name": name, "Unit": "Milliseconds"})
+    values["BytesFetched"] = summary.get("bytes", 0)
+    definitions.append({"Name": "BytesFetched", "Unit": "Bytes"})
+    record = {
+        "_aws": {
+            "Timestamp": int(timestamp * 1000),
+            "CloudWatchMetrics": [
+                {
+                    "Namespace": namespace,
+                    "Dimensions": [[], ["Verdict"]],
+                    "Metrics": definitions,
+                }
+            ],
+        },
+        "Verdict": summary.get("verdict") or summary.get("status"),
+        # not a metric, but searchable
+        "key": summary.get("key"),
+    }
+    record.update(values)
+    return record
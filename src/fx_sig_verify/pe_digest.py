@@ -0,0 +1,255 @@
+"""
+PE checksum and Authenticode image digest, computed in process.
+
+Both values can be computed incrementally as an artifact is downloaded
+(``PEDigester.update()``), or in one pass over a memory mapped file
+(``digest_file()``). The 16-bit word sum for the checksum uses NumPy when it
+is installed (``pip install fx_sig_verify[fast]``), and the standard
+library otherwise.
+
+When more than one digest algorithm is needed (e.g. SHA-1 and SHA-256 for
+dual signed files), each is updated in its own thread -- ``hashlib``
+releases the GIL for large buffers, so they run concurrently.
+
+The Authenticode digest covers the whole file except the CheckSum field,
+the security data directory entry, and the certificate table itself.
+"""
+
+from array import array
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import mmap
+import sys
+import traceback
+
+from fx_sig_verify import authenticode
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover -- optional speedup
+    numpy = None
+
+# Size of the slices fed to the hashers when processing a whole file.
+DIGEST_CHUNK_SIZE = 1024 * 1024
+
+PEDigest = namedtuple(
+    "PEDigest",
+    [
+        "header",  # authenticode.PEHeader
+        "stored_checksum",
+        "checksum",  # as computed
+        "digests",  # {algorithm: digest bytes}
+        "size",
+    ],
+)
+
+
+def word_sum(data):
+    """Sum of the little endian 16-bit words in `data` (of even length)."""
+    if numpy is not None:
+        return int(numpy.frombuffer(data, dtype="<u2").sum(dtype=numpy.uint64))
+    words = array("H")
+    words.frombytes(data)
+    if sys.byteorder != "little":
+        words.byteswap()
+    return sum(words)
+
+
+def fold_checksum(total, size):
+    """Finish a PE checksum from the raw word sum and the file size."""
+    while total >> 16:
+        total = (total & 0xFFFF) + (total >> 16)
+    return (total + size) & 0xFFFFFFFF
+
+
+def pe_checksum(data, checksum_offset):
+    """Compute the PE checksum of a complete image.
+
+    :param data: bytes-like object holding the whole file
+    :param checksum_offset: file offset of the CheckSum field (excluded)
+    """
+    digester = PEDigester(algorithms=())
+    digester.checksum_offset = checksum_offset
+    digester.update(data)
+    return fold_checksum(digester.word_total, len(data))
+
+
+class PEDigester:
+    """Compute the PE checksum & Authenticode digest(s) of a stream of bytes.
+
+    Feed the file, in order, via update(); call finish() at the end. The
+    headers are decoded as soon as enough bytes have arrived.
+
+    Args:
+        algorithms: hashlib names of the digests wanted. If None, they are
+            taken from the signature(s) in the file, once it's complete.
+        threads: whether to update multiple digests concurrently; default is
+            to do so when more than one is wanted.
+    """
+
+    def __init__(self, algorithms=None, threads=None):
+        self.header = None
+        self.checksum_offset = None
+        self.size = 0
+        self.word_total = 0
+        self._odd_byte = None
+        self._pending = bytearray()  # bytes received before header decoded
+        self._algorithms = algorithms
+        # until we know which digests are wanted, compute the likely ones
+        self._hashers = {
+            name: hashlib.new(name) for name in (algorithms or ("sha1", "sha256"))
+        }
+        self._threads = threads
+        self._executor = None
+
+    # the regions (start, end) excluded from the Authenticode digest
+    def _excluded(self):
+        header = self.header
+        excluded = [
+            (header.checksum_offset, header.checksum_offset + 4),
+            (
+                header.security_dir_offset,
+                header.security_dir_offset + authenticode.DATA_DIRECTORY_ENTRY_SIZE,
+            ),
+        ]
+        if header.cert_table_offset and header.cert_table_size:
+            # the certificate table is at the end, so nothing after it counts
+            excluded.append((header.cert_table_offset, float("inf")))
+        return excluded
+
+    def update(self, data):
+        data = memoryview(data).cast("B")
+        if self.header is None and self._algorithms != ():
+            self._pending += data
+            if len(self._pending) < authenticode.HEADER_PROBE_SIZE:
+                return
+            self.header = authenticode.parse_pe_header(self._pending)
+            self.checksum_offset = self.header.checksum_offset
+            data, self._pending = memoryview(bytes(self._pending)), None
+        self._update_checksum(data)
+        if self.header is not None:
+            self._update_digests(data)
+        self.size += len(data)
+
+    def _update_checksum(self, data):
+        start = self.size
+        if self._odd_byte is not None and len(data):
+            # complete the word split across calls
+            self._add_word_bytes(start - 1, bytes((self._odd_byte, data[0])))
+            self._odd_byte = None
+            data = data[1:]
+            start += 1
+        if len(data) % 2:
+            self._odd_byte = data[-1]
+            data = data[:-1]
+        self._add_word_bytes(start, data)
+
+    def _add_word_bytes(self, start, data):
+        # the CheckSum field itself counts as zero
+        offset = self.checksum_offset
+        if offset is not None and start < offset + 4 and offset < start + len(data):
+            data = bytearray(data)
+            lo = max(offset - start, 0)
+            hi = min(offset + 4 - start, len(data))
+            data[lo:hi] = bytes(hi - lo)
+        self.word_total += word_sum(data)
+
+    def _update_digests(self, data):
+        start = self.size
+        end = start + len(data)
+        pieces = []
+        position = start
+        for ex_start, ex_end in self._excluded():
+            if ex_start >= end:
+                break
+            if ex_start > position:
+                pieces.append(data[position - start : ex_start - start])
+            position = max(position, min(ex_end, end))
+        if position < end:
+            pieces.append(data[position - start :])
+        for piece in pieces:
+            self._update_hashers(piece)
+
+    def _update_hashers(self, piece):
+        hashers = list(self._hashers.values())
+        use_threads = self._threads if self._threads is not None else len(hashers) > 1
+        if not use_threads or len(hashers) < 2:
+            for hasher in hashers:
+                hasher.update(piece)
+            return
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=len(hashers))
+        for future in [self._executor.submit(h.update, piece) for h in hashers]:
+            future.result()
+
+    def finish(self):
+        """Complete the computation.
+
+        :returns PEDigest:
+        :raises authenticode.AuthenticodeFormatError: if the data is not a
+            PE file
+        """
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        if self.header is None:
+            # short file, never reached the header size
+            pending, self._pending = bytes(self._pending or b""), None
+            self.header = authenticode.parse_pe_header(pending)
+            self.checksum_offset = self.header.checksum_offset
+            self.update(pending)
+        total = self.word_total
+        if self._odd_byte is not None:
+            total += self._odd_byte
+        return PEDigest(
+            self.header,
+            self.header.checksum,
+            fold_checksum(total, self.size),
+            {name: hasher.digest() for name, hasher in self._hashers.items()},
+            self.size,
+        )
+
+
+def digest_file(fileobj, algorithms=None):
+    """Compute the PE checksum & Authenticode digest(s) of a whole file.
+
+    The file is memory mapped when possible, so no copy is made.
+
+    :param fileobj: seekable binary file like object
+    :param algorithms: hashlib names of the digests wanted, default is the
+        ones used by the usual signatures.
+    :returns PEDigest:
+    """
+    digester = PEDigester(algorithms)
+    try:
+        fileno = fileobj.fileno()
+        fileobj.flush()
+        mapped = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+    except (AttributeError, OSError, ValueError):
+        mapped = None
+    if mapped is None:
+        # e.g. BytesIO, or an empty file (which can't be mapped)
+        fileobj.seek(0, 0)
+        for chunk in iter(lambda: fileobj.read(DIGEST_CHUNK_SIZE), b""):
+            digester.update(chunk)
+        return digester.finish()
+    with mapped, memoryview(mapped) as view:
+        try:
+            for start in range(0, len(view), DIGEST_CHUNK_SIZE):
+                digester.update(view[start : start + DIGEST_CHUNK_SIZE])
+            return digester.finish()
+        except BaseException as e:
+            # the traceback's frames hold slices of the mapping, which can't
+            # be closed while they exist
+            traceback.clear_frames(e.__traceback__)
+            raise
+
+
+def signed_digests(cert_table):
+    """Return ``{algorithm: digest}`` for each signature in a certificate table."""
+    digests = {}
+    for pkcs7 in authenticode.pkcs7_signatures(cert_table):
+        algorithm, digest = authenticode.indirect_data_digest(pkcs7)
+        digests.setdefault(algorithm, digest)
+    return digests
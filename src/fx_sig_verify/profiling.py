@@ -0,0 +1,194 @@
+"""
+On demand CPU (cProfile) and memory (tracemalloc) profiling.
+
+For Lambda, set in the environment:
+
+    ``PROFILE``
+        "cpu", "memory", or "all"; unset (the default) for no profiling
+    ``PROFILE_SAMPLE``
+        profile one in this many invocations (default 1, every one)
+    ``PROFILE_TOP``
+        how many functions & allocation sites to report (default 20)
+    ``PROFILE_OUTPUT``
+        a directory (e.g. ``/tmp``) to save the summary and raw cProfile
+        data in, rather than logging the summary
+
+and for ``fx-sig-verify``, use ``--profile`` (and ``--profile-output``).
+
+The summary has the top functions by cumulative time, and the top
+allocation sites by size, with the peak traced memory. cProfile only sees
+the thread which enables it, so each record's thread is profiled
+separately (see ``profiled_thread()``) and the results merged.
+"""
+
+import contextlib
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import threading
+import tracemalloc
+
+from fx_sig_verify import structured_log
+
+KINDS = {"cpu": (True, False), "memory": (False, True), "all": (True, True)}
+DEFAULT_TOP = 20
+
+# the Profiler in use, if any
+_active = None
+
+
+class Profiler:
+    """Profile the block it's entered for, then report on it.
+
+    Args:
+        label (str): what was profiled, e.g. the Lambda request id
+        cpu (bool): profile with cProfile
+        memory (bool): trace allocations with tracemalloc
+        top (int): number of functions & sites to report
+        output (str): directory to save the report in, None to log it
+    """
+
+    def __init__(self, label, cpu=True, memory=False, top=DEFAULT_TOP, output=None):
+        self.label = label
+        self.cpu = cpu
+        self.memory = memory
+        self.top = top
+        self.output = output
+        self.stats = None
+        self._started_tracing = False
+        self._profile = None
+        self._owner = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        global _active
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        if self.cpu:
+            self._owner = threading.get_ident()
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        _active = self
+        return self
+
+    def __exit__(self, *exc_info):
+        global _active
+        _active = None
+        if self._profile is not None:
+            self._profile.disable()
+            self.add_profile(self._profile)
+        self.report(self.summary())
+        return False
+
+    def add_profile(self, profile):
+        """Merge a thread's `profile` into the results."""
+        with self._lock:
+            if self.stats is None:
+                self.stats = pstats.Stats(profile, stream=io.StringIO())
+            else:
+                self.stats.add(profile)
+
+    def summary(self):
+        summary = {}
+        if self.stats is not None:
+            summary["functions"] = top_functions(self.stats, self.top)
+        if self.memory:
+            snapshot = tracemalloc.take_snapshot().filter_traces(
+                [tracemalloc.Filter(False, tracemalloc.__file__)]
+            )
+            _, peak = tracemalloc.get_traced_memory()
+            if self._started_tracing:
+                tracemalloc.stop()
+            summary["peak_memory"] = peak
+            summary["allocations"] = [
+                {
+                    "site": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                    "size": stat.size,
+                    "count": stat.count,
+                }
+                for stat in snapshot.statistics("lineno")[: self.top]
+            ]
+        return summary
+
+    def report(self, summary):
+        if self.output is None:
+            structured_log.emit(
+                structured_log.INFO, "profile of %s", (self.label,), profile=summary
+            )
+            return
+        base = os.path.join(self.output, f"fx-sig-verify-profile-{self.label}")
+        with open(base + ".json", "w") as f:
+            json.dump(summary, f, indent=1)
+        if self.stats is not None:
+            # for snakeviz & co
+            self.stats.dump_stats(base + ".prof")
+
+
+def top_functions(stats, top):
+    """The `top` functions in `stats`, by cumulative time."""
+    functions = []
+    ranked = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)
+    for (filename, lineno, name), (_, calls, tottime, cumtime, _) in ranked[:top]:
+        functions.append(
+            {
+                "function": f"{filename}:{lineno}({name})",
+                "calls": calls,
+                "tottime": round(tottime, 6),
+                "cumtime": round(cumtime, 6),
+            }
+        )
+    return functions
+
+
+@contextlib.contextmanager
+def profiled_thread():
+    """Include the calling thread's work in the active CPU profile, if any."""
+    profiler = _active
+    if profiler is None or not profiler.cpu or profiler._owner == threading.get_ident():
+        # nothing to do, or already profiled
+        yield
+        return
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        profiler.add_profile(profile)
+
+
+def profiler_from_environment(label):
+    """The Profiler configured by the environment, or None if this
+    invocation isn't to be profiled."""
+    kind = os.environ.get("PROFILE", "").lower()
+    if kind not in KINDS:
+        return None
+    try:
+        sample = max(1, int(os.environ.get("PROFILE_SAMPLE", 1)))
+    except ValueError:
+        sample = 1
+    if sample > 1 and random.randrange(sample):  # nosec - not crypto
+        return None
+    try:
+        top = max(1, int(os.environ.get("PROFILE_TOP", DEFAULT_TOP)))
+    except ValueError:
+        top = DEFAULT_TOP
+    cpu, memory = KINDS[kind]
+    return Profiler(
+        label, cpu=cpu, memory=memory, top=top, output=os.environ.get("PROFILE_OUTPUT")
+    )
+
+
+@contextlib.contextmanager
+def profile_from_environment(label):
+    """Profile the block, if the environment says so."""
+    profiler = profiler_from_environment(label)
+    if profiler is None:
+        yield
+        return
+    with profiler:
+        yield
@@ -0,0 +1,245 @@
+"""
+Batched, de-duplicated delivery of SNS notifications.
+
+A bad push can fail hundreds of artifacts in one go, and each failure used
+to be its own blocking ``Publish`` call and its own page. An
+``SNSDispatcher`` collects the notifications of one invocation:
+
+    - they are published from a background thread, so verification of the
+      next record continues meanwhile
+    - whatever is queued is sent together, via ``PublishBatch`` (up to 10
+      entries per call), or one at a time where that isn't available
+    - notifications in the same group (e.g. the same failure class under
+      the same S3 prefix) are sent individually only up to
+      ``collapse_after`` times; the rest are summarized in a single digest
+      when the dispatcher is flushed
+
+Call ``flush()`` at the end of the invocation: it sends the digests, waits
+for delivery, and reports any failures via each notification's
+``on_failure`` callback, in the calling thread.
+"""
+
+from collections import OrderedDict, namedtuple
+import queue
+import threading
+
+from botocore.exceptions import ClientError
+
+from fx_sig_verify import aws_clients
+
+# SNS PublishBatch limits
+MAX_BATCH_ENTRIES = 10
+MAX_BATCH_BYTES = 256 * 1024
+# SNS subjects must be shorter than this
+MAX_SUBJECT_LENGTH = 100
+
+DEFAULT_COLLAPSE_AFTER = 3
+# error codes meaning the endpoint has no PublishBatch
+BATCH_UNSUPPORTED = {"InvalidAction", "NotImplemented"}
+
+Notification = namedtuple("Notification", ["subject", "message", "on_failure"])
+
+_STOP = object()
+
+
+def subject_for(msg):
+    """SNS subject for `msg`: its first line, shortened to fit."""
+    # use first line of incoming msg as subject, but AWS limit is under 100
+    # chars.
+    # ASSUME anything over is due to long s3 URL and use heuristic
+    subject = msg.split("\n")[0]
+    if len(subject) >= MAX_SUBJECT_LENGTH:
+        # split assuming URL, then retain result (index 0) and file name
+        # (index -1). File name should be sufficient to allow page
+        # recipient to decide urgency of further investigation.
+        pieces = subject.split("/")
+        subject = f"{pieces[0]} ... {pieces[-1]}"
+        if len(subject) >= MAX_SUBJECT_LENGTH:
+            # don't try to be smarter, full text is still in 'msg'
+            subject = "Truncated subject, examine message"
+    return subject
+
+
+def batch_unsupported(e):
+    """True if `e` is the rejection of PublishBatch as an unknown action."""
+    return (
+        isinstance(e, ClientError)
+        and e.response.get("Error", {}).get("Code") in BATCH_UNSUPPORTED
+    )
+
+
+class SNSDispatcher:
+    """Publish the notifications of one invocation to an SNS topic.
+
+    Args:
+        topic_arn (str): where to publish
+        client: SNS client, default is the shared one
+        collapse_after (int): notifications sent per group before the rest
+            are summarized
+        linger (float): seconds to wait for more notifications to fill a
+            batch
+    """
+
+    def __init__(
+        self, topic_arn, client=None, collapse_after=DEFAULT_COLLAPSE_AFTER, linger=0.05
+    ):
+        self.topic_arn = topic_arn
+        self.client = client
+        self.collapse_after = collapse_after
+        self.linger = linger
+        self.requests = 0
+        self.published = 0
+        self.collapsed = 0
+        # False once PublishBatch is found to be unavailable
+        self.batching = True
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        # group -> [count, [(name, on_failure) of those held back]]
+        self._groups = OrderedDict()
+        self._failures = []
+
+    def submit(self, subject, message, group=None, name=None, on_failure=None):
+        """Queue a notification.
+
+        :param group: hashable description of what the notification is
+            about, e.g. ``("fail", "SigVerifyBadSignature", prefix)``; None
+            for notifications which must never be collapsed.
+        :param name: what to call this notification in a digest
+        :param on_failure: called with the error if delivery fails
+        """
+        with self._lock:
+            if group is not None:
+                held = self._groups.setdefault(group, [0, []])
+                held[0] += 1
+                if held[0] > self.collapse_after:
+                    held[1].append((name or subject, on_failure))
+                    self.collapsed += 1
+                    return
+        self._put(Notification(subject, message, on_failure))
+
+    def _put(self, notification):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="sns-dispatcher", daemon=True
+                )
+                self._thread.start()
+        self._queue.put(notification)
+
+    def flush(self):
+        """Send any digests, and wait until everything has been delivered."""
+        with self._lock:
+            groups, self._groups = self._groups, OrderedDict()
+        for group, (count, held) in groups.items():
+            if held:
+                self._submit_digest(group, count, held)
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(_STOP)
+            thread.join()
+        failures, self._failures = self._failures, []
+        for notification, error in failures:
+            if notification.on_failure is not None:
+                notification.on_failure(error)
+
+    def _submit_digest(self, group, count, held):
+        description = " ".join(str(part) for part in group if part)
+        names = [name for name, _ in held]
+        message = "\n".join(
+            [
+                f"{len(held)} more like this ({count} in all): {description}",
+                "",
+            ]
+            + names
+        )
+
+        def on_failure(error):
+            for _, callback in held:
+                if callback is not None:
+                    callback(error)
+
+        subject = subject_for(f"{len(held)} more: {description}")
+        self._put(Notification(subject, message, on_failure))
+
+    def _run(self):
+        stop = False
+        while not stop:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            while len(batch) < MAX_BATCH_ENTRIES:
+                try:
+                    item = self._queue.get(timeout=self.linger)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+            for entries in self._split(batch):
+                self._publish(entries)
+
+    @staticmethod
+    def _split(batch):
+        """Split `batch` so no request exceeds the SNS size limit."""
+        entries, size = [], 0
+        for notification in batch:
+            entry_size = len(notification.message.encode()) + len(
+                notification.subject.encode()
+            )
+            if entries and size + entry_size > MAX_BATCH_BYTES:
+                yield entries
+                entries, size = [], 0
+            entries.append(notification)
+            size += entry_size
+        if entries:
+            yield entries
+
+    def _publish(self, batch):
+        client = self.client or aws_clients.client("sns")
+        if self.batching and not hasattr(client, "publish_batch"):
+            # older botocore releases don't have it
+            self.batching = False
+        if self.batching:
+            try:
+                self._publish_batch(client, batch)
+                return
+            except Exception as e:
+                if not batch_unsupported(e):
+                    # report it, but keep going so the details reach the logs
+                    self._failures.extend((n, e) for n in batch)
+                    return
+                # e.g. an SNS stand-in without it
+                self.batching = False
+        for notification in batch:
+            self._publish_one(client, notification)
+
+    def _publish_batch(self, client, batch):
+        self.requests += 1
+        response = client.publish_batch(
+            TopicArn=self.topic_arn,
+            PublishBatchRequestEntries=[
+                {"Id": str(i), "Subject": n.subject, "Message": n.message}
+                for i, n in enumerate(batch)
+            ],
+        )
+        for failed in response.get("Failed", []):
+            error = "{}: {}".format(failed.get("Code"), failed.get("Message"))
+            self._failures.append((batch[int(failed["Id"])], error))
+        self.published += len(response.get("Successful", []))
+
+    def _publish_one(self, client, notification):
+        self.requests += 1
+        try:
+            client.publish(
+                TopicArn=self.topic_arn,
+                Subject=notification.subject,
+                Message=notification.message,
+            )
+        except Exception as e:
+            self._failures.append((notification, e))
+            return
+        self.published += 1
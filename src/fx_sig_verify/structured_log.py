@@ -0,0 +1,145 @@
+"""
+Structured, lazily formatted logging for CloudWatch.
+
+Everything a Lambda writes to stdout is ingested (and billed) by
+CloudWatch line by line, and later parsed by ``analyze_cloudwatch``. So:
+
+    - each log record is one line of JSON, starting with its ``"level"``
+    - a message is only formatted (``message % args``) if its level is
+      enabled, so ``debug("sns publish: %r", response)`` costs nothing at
+      the default verbosity
+    - a fraction of invocations can be logged at debug level, without
+      raising ``VERBOSE`` for all of them
+    - the input event echoed in each response can be truncated or omitted
+
+Levels follow ``VERBOSE``: warnings are always logged, 1 adds "info", and
+2 adds "debug". orjson is used for encoding when it is installed (the
+``fast`` extra).
+
+Settings, read from the environment at the start of each invocation:
+
+    ``LOG_SAMPLE_RATE``
+        fraction (0 to 1) of invocations logged at debug level (default 0)
+    ``LOG_INPUT_EVENT``
+        how the input event is echoed: "full", "truncate" (the default),
+        or "omit"
+    ``LOG_INPUT_EVENT_LIMIT``
+        characters of the event's JSON kept when truncating (default 4096)
+"""
+
+import datetime
+import json
+import os
+import random
+import sys
+import threading
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional
+    orjson = None
+
+WARNING = 0
+INFO = 1
+DEBUG = 2
+LEVEL_NAMES = {WARNING: "warning", INFO: "info", DEBUG: "debug"}
+
+DEFAULT_INPUT_EVENT_MODE = "truncate"
+DEFAULT_INPUT_EVENT_LIMIT = 4096
+
+# log records start with this, so readers can skip them cheaply
+RECORD_PREFIX = '{"level":'
+
+# where lines are written, None for stdout (which Lambda ingests)
+stream = None
+# set per invocation, by sample_invocation()
+_sampled = False
+_lock = threading.Lock()
+
+
+def dumps(obj):
+    """`obj` as compact JSON; anything not serializable becomes a string."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, default=str).decode()
+        except TypeError:
+            # e.g. integers beyond 64 bits, which json handles
+            pass
+    return json.dumps(obj, default=str, separators=(",", ":"))
+
+
+def sample_invocation(rate=None):
+    """Decide whether this invocation is logged at debug level.
+
+    :param rate: fraction of invocations to sample, default from
+        ``LOG_SAMPLE_RATE``
+    :returns bool: True if it is
+    """
+    global _sampled
+    if rate is None:
+        try:
+            rate = float(os.environ.get("LOG_SAMPLE_RATE", 0))
+        except ValueError:
+            rate = 0
+    _sampled = rate > 0 and random.random() < rate  # nosec - not crypto
+    return _sampled
+
+
+def enabled(level, verbose):
+    """True if records at `level` are logged at verbosity `verbose`."""
+    return verbose >= level or _sampled
+
+
+def write(line):
+    """Write one line to `stream`, without interleaving other threads'."""
+    with _lock:
+        (stream or sys.stdout).write(line + "\n")
+
+
+def emit(level, message, args=(), **fields):
+    """Log `message` % `args`, plus any `fields`, as a line of JSON.
+
+    Callers check ``enabled()`` first; this always writes.
+    """
+    record = {
+        "level": LEVEL_NAMES[level],
+        "time": datetime.datetime.utcnow().isoformat(),
+        "message": message % args if args else message,
+    }
+    record.update(fields)
+    write(dumps(record))
+
+
+def input_event_to_log(event, mode=None, limit=None):
+    """What to echo of `event`, or None to leave it out.
+
+    A truncated event is a string: the start of its JSON, and "...".
+    """
+    if mode is None:
+        mode = os.environ.get("LOG_INPUT_EVENT", DEFAULT_INPUT_EVENT_MODE)
+    if mode == "full":
+        return event
+    if mode == "omit":
+        return None
+    if limit is None:
+        try:
+            limit = int(
+                os.environ.get("LOG_INPUT_EVENT_LIMIT", DEFAULT_INPUT_EVENT_LIMIT)
+            )
+        except ValueError:
+            limit = DEFAULT_INPUT_EVENT_LIMIT
+    text = dumps(event)
+    if len(text) <= limit:
+        return event
+    return text[: max(0, limit - 3)] + "..."
+
+
+def response_line(response):
+    """The log line for a handler's `response`, echoing its input event as
+    configured."""
+    if "input_event" in response:
+        response = dict(response)
+        event = input_event_to_log(response.pop("input_event"))
+        if event is not None:
+            response["input_event"] = event
+    return dumps(response)
@@ -0,0 +1,174 @@
+"""
+Tracing of the stages of a verification.
+
+The backend is chosen from the environment when this module is imported
+(i.e. at cold start), by ``TRACING``:
+
+    ``xray`` (the default)
+        each traced function is an X-Ray subsegment (via fleece), as are
+        the AWS API calls
+    ``none``
+        nothing is traced: ``traced()`` returns the function itself, so
+        there is no per-call overhead at all. Also the default when
+        ``XRAY_DISABLE`` is set.
+    ``record``
+        spans are kept in memory by a ``SpanRecorder``, for benchmarks and
+        tests which want per-stage timings without an X-Ray daemon
+
+Use ``@traced()`` on functions and methods, and ``with span(name):`` for
+stages within them. Only the recorder records spans; for X-Ray they are
+free.
+"""
+
+from collections import namedtuple
+import contextlib
+import functools
+import os
+import threading
+import time
+
+Span = namedtuple("Span", ["name", "start", "duration", "error"])
+
+BACKENDS = ("xray", "none", "record")
+
+
+class _NullSpan:
+    """A span which records nothing (``contextlib.nullcontext`` is 3.7+)."""
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_null_span = _NullSpan()
+
+
+class SpanRecorder:
+    """Thread safe, in-memory list of ``Span``s."""
+
+    def __init__(self):
+        self._spans = []
+        self._lock = threading.Lock()
+
+    def add(self, span):
+        with self._lock:
+            self._spans.append(span)
+
+    def spans(self, name=None):
+        """The spans recorded so far (just those called `name`, if given)."""
+        with self._lock:
+            return [s for s in self._spans if name is None or s.name == name]
+
+    def totals(self):
+        """``{name: (count, total seconds)}`` of the spans recorded."""
+        totals = {}
+        for s in self.spans():
+            count, seconds = totals.get(s.name, (0, 0.0))
+            totals[s.name] = (count + 1, seconds + s.duration)
+        return totals
+
+    def clear(self):
+        with self._lock:
+            self._spans.clear()
+
+
+class NoopTracer:
+    """Trace nothing, at no cost."""
+
+    name = "none"
+
+    def traced(self, name=None):
+        return lambda func: func
+
+    def span(self, name):
+        return _null_span
+
+    def patch_clients(self):
+        pass
+
+
+class XRayTracer(NoopTracer):
+    """Trace functions as X-Ray subsegments."""
+
+    name = "xray"
+
+    def traced(self, name=None):
+        # fleece names subsegments after the function
+        from fleece.xray import trace_xray_subsegment
+
+        return trace_xray_subsegment()
+
+    def patch_clients(self):
+        from fleece.xray import monkey_patch_botocore_for_xray
+
+        monkey_patch_botocore_for_xray()
+
+
+class RecordingTracer(NoopTracer):
+    """Record spans in `recorder`."""
+
+    name = "record"
+
+    def __init__(self, recorder=None):
+        self.recorder = SpanRecorder() if recorder is None else recorder
+
+    def traced(self, name=None):
+        def decorator(func):
+            span_name = name or func.__qualname__
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                # inline rather than via span(), which is several times slower
+                start = time.perf_counter()
+                error = True
+                try:
+                    result = func(*args, **kwargs)
+                    error = False
+                    return result
+                finally:
+                    duration = time.perf_counter() - start
+                    self.recorder.add(Span(span_name, start, duration, error))
+
+            return wrapper
+
+        return decorator
+
+    @contextlib.contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        error = False
+        try:
+            yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self.recorder.add(Span(name, start, time.perf_counter() - start, error))
+
+
+def tracer_from_environment():
+    """The tracer named by ``TRACING`` (the default if it's not known)."""
+    backend = os.environ.get("TRACING", "").lower()
+    if backend not in BACKENDS:
+        backend = "none" if os.environ.get("XRAY_DISABLE") else "xray"
+    if backend == "none":
+        return NoopTracer()
+    if backend == "record":
+        return RecordingTracer()
+    return XRayTracer()
+
+
+tracer = tracer_from_environment()
+tracer.patch_clients()
+
+
+def traced(name=None):
+    """Decorator tracing each call of a function (or method) as a span."""
+    return tracer.traced(name)
+
+
+def span(name):
+    """Context manager tracing a stage as a span."""
+    return tracer.span(name)
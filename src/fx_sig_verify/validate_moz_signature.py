@@ -1,19 +1,33 @@
-from fleece import boto3
-from fleece.xray import monkey_patch_botocore_for_xray, trace_xray_subsegment
+from botocore.exceptions import ClientError
 
 # import boto3
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
-import datetime
+import contextlib
 import json
 import os
+import random
+import shutil
 import subprocess  # nosec  bandit complains otherwise
-import tempfile
+import threading
 import time
 from typing import Optional
 import urllib.request, urllib.parse, urllib.error
 import urllib.request, urllib.error, urllib.parse
 
 import fx_sig_verify
+from fx_sig_verify import authenticode
+from fx_sig_verify import aws_clients
+from fx_sig_verify import event_decoder
+from fx_sig_verify import event_dedup
+from fx_sig_verify import metrics
+from fx_sig_verify import pe_digest
+from fx_sig_verify import profiling
+from fx_sig_verify import sns_dispatcher
+from fx_sig_verify import structured_log
+from fx_sig_verify import tracing
+from fx_sig_verify import verdict_cache
+from fx_sig_verify.artifact_buffer import ArtifactBuffer
 
 # Certificate serial numbers we consider valid
 VALID_CERTS = [
@@ -55,15 +69,104 @@ PRODUCTION_KEY_PREFIX_EXCLUSIONS = (
 # guard)
 MAX_EXE_SIZE = 400 * (1024 * 1024)
 
-# by default wrap all boto calls with x-ray
-monkey_patch_botocore_for_xray()
+# Objects are copied in chunks of this size, so no more than one chunk is in
+# flight between S3, memory, and disk.
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
 
+# Downloads are kept in memory (see artifact_buffer) unless they exceed this
+# fraction of the Lambda memory limit, in which case they go to /tmp. The
+# default applies when we don't know the limit (e.g. testing).
+SPOOL_MEMORY_FRACTION = 0.25
+DEFAULT_SPOOL_MAX_SIZE = 32 * (1024 * 1024)
 
-def debug(*args):
-    if MozSignedObject.verbose >= 2:
-        now = datetime.datetime.utcnow().isoformat()
-        for msg in args:
-            print(f"{now}: {msg}")
+# S3 is read-after-write consistent, so we get the object straight away. In
+# case a notification does beat the object, a missing key is retried with
+# jittered exponential backoff (starting at S3_RETRY_BASE_DELAY seconds),
+# for up to S3_MAX_WAIT seconds, and never into the last DEADLINE_RESERVE
+# seconds of the Lambda's time.
+S3_RETRY_BASE_DELAY = 0.025
+S3_RETRY_MAX_DELAY = 1.0
+S3_MAX_WAIT = 9
+DEADLINE_RESERVE = 5
+
+# Objects are retrieved in parts of this size (DOWNLOAD_PART_SIZE_MB), up to
+# DOWNLOAD_CONCURRENCY parts at once. An object which fits in one part is
+# retrieved by a single request.
+DOWNLOAD_PART_SIZE = 8 * (1024 * 1024)
+DEFAULT_DOWNLOAD_CONCURRENCY = 8
+
+# Records in one event are processed concurrently, by up to this many
+# threads. Override with RECORD_WORKERS (1 processes them serially).
+DEFAULT_RECORD_WORKERS = 4
+
+# Records are started smallest first, and not at all unless there's
+# RECORD_MIN_TIME seconds before DEADLINE_RESERVE. osslsigncode gets at
+# most VERIFY_TIMEOUT seconds (and never past DEADLINE_RESERVE). Records
+# which don't finish in time are deferred: sent to DEFERRED_QUEUE_URL if
+# set, otherwise retried.
+RECORD_MIN_TIME = 1
+DEFAULT_VERIFY_TIMEOUT = 30
+
+
+def debug(message, *args):
+    """Log `message` % `args` when debugging; only formatted if so."""
+    if structured_log.enabled(structured_log.DEBUG, MozSignedObject.verbose):
+        structured_log.emit(structured_log.DEBUG, message, args)
+
+
+def info(message, *args):
+    """Log `message` % `args` when verbose; only formatted if so."""
+    if structured_log.enabled(structured_log.INFO, MozSignedObject.verbose):
+        structured_log.emit(structured_log.INFO, message, args)
+
+
+def warning(message, *args):
+    """Log `message` % `args`, always."""
+    structured_log.emit(structured_log.WARNING, message, args)
+
+
+def production_exclusion(name):
+    """Why the artifact `name` isn't checked in production, None if it is.
+
+    :param name: an S3 URL, or a path
+    """
+    # We have 2 criteria for filtering - file extension and file prefix. In
+    # both cases, we consider a pass for filtering a 'pass', with the
+    # explanation of why.
+
+    # Current criteria is based on prefix of filename. We include the two
+    # know good names, rather than exclude the two currently known
+    # exceptions (mar.exe & mbsdiff.exe) to reduce false positives (since a
+    # invalid exe will page someone).
+    basename = os.path.basename(name)
+    if not basename.endswith(PRODUCTION_EXTENSIONS):
+        return "Excluded from validation by file suffix"
+    if not basename.startswith(PRODUCTION_PREFIXES):
+        return "Excluded from validation by file prefix"
+    # ignore dependent & try builds, which is based on the first part
+    # of the key (in S3 terms), which is the "path" element of an S3
+    # url
+    key = urllib.parse.urlparse(str(name)).path
+    if key.startswith(PRODUCTION_KEY_PREFIX_EXCLUSIONS):
+        return "Excluded from validation by key prefix"
+    return None
+
+
+def verifier_command(fname):
+    """The command to verify the signature of file `fname`."""
+    return ["osslsigncode", "verify", fname]
+
+
+def show_verifier_output(results):
+    if results is None:
+        debug("No results from osslsigncode run (likely exception)")
+    else:
+        debug(
+            "osslsigncode exitcode: %s\n-- stderr:\n'%s'\n-- stdout\n'%s'",
+            results.returncode,
+            results.stderr,
+            results.stdout,
+        )
 
 
 class MozSignedObject:
@@ -71,11 +174,16 @@ class MozSignedObject:
     the name of the object and the final status.
 
     Sub class for different conventions on name and status reporting.
+
+    The class attributes are the defaults for artifacts created without a
+    ``verifier.Verifier``; otherwise the verifier's settings are used.
     """
 
     # simplify debugging - can be set via environ
     verbose = 0
     production_criteria = True
+    # see set_verdict_cache
+    verdict_cache = None
 
     @classmethod
     def set_production_criteria(cls, production_override=None):
@@ -83,15 +191,17 @@ class MozSignedObject:
         cls.production_criteria = True
         if production_override is None:
             production_override = os.environ.get("PRODUCTION")
-            print(f"PRODUCTION={production_override}")
+            info("PRODUCTION=%s", production_override)
         if production_override is not None:
             try:
                 cls.production_criteria = int(production_override)
             except ValueError:
                 cls.production_criteria = False if production_override else True
-            print(
-                f"production criteria {bool(cls.production_criteria)} based on {production_override}",
-                f"VERBOSE={cls.verbose}",
+            info(
+                "production criteria %s based on %s VERBOSE=%s",
+                bool(cls.production_criteria),
+                production_override,
+                cls.verbose,
             )
 
     @classmethod
@@ -104,19 +214,78 @@ class MozSignedObject:
             cls.verbose = int(env_value)
         if verbose_override:
             cls.verbose = verbose_override
-        print(f"verbose {cls.verbose} based on {env_value} or {verbose_override}")
+        info("verbose %s based on %s or %s", cls.verbose, env_value, verbose_override)
+
+    @classmethod
+    def set_verdict_cache(cls, url=None):
+        """Use the verdict cache at `url`, or the one named in the environment
+        (if any)."""
+        fingerprint = verdict_cache.trust_fingerprint(VALID_CERTS)
+        if url:
+            cls.verdict_cache = verdict_cache.cache_from_url(
+                url, fingerprint=fingerprint
+            )
+        else:
+            cls.verdict_cache = verdict_cache.cache_from_environment(
+                fingerprint=fingerprint
+            )
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, verifier=None, **kwargs):
+        if verifier is None:
+            from fx_sig_verify.verifier import Verifier
+
+            verifier = Verifier.from_class_settings(type(self))
+        self.verifier = verifier
+        # shadow the class settings
+        self.verbose = verifier.verbose
+        self.production_criteria = verifier.production_criteria
+        self.verdict_cache = verifier.verdict_cache
         self.artifact_name: Optional[str] = None
         self.object_status = None
         self.errors = []
         self.messages = []
+        # set if the digest was computed while the object was retrieved
+        self.digester = None
+        self.cache_hit = False
+        # seconds spent in each stage, see timed()
+        self.timings = {}
+        self._timings_lock = threading.Lock()
         if args or kwargs:
             raise TypeError("unexpected args")
 
+    @contextlib.contextmanager
+    def timed(self, stage):
+        """Add the time the block takes to ``timings[stage]``, and trace it."""
+        start = time.perf_counter()
+        try:
+            with tracing.span(stage):
+                yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start)
+
+    def add_time(self, stage, seconds):
+        with self._timings_lock:
+            self.timings[stage] = self.timings.get(stage, 0) + seconds
+
+    def timings_ms(self):
+        """``timings``, in milliseconds."""
+        with self._timings_lock:
+            return {stage: round(t * 1000, 1) for stage, t in self.timings.items()}
+
+    def verifier_timeout(self):
+        """Seconds osslsigncode may take, None for no limit."""
+        return None
+
+    def verdict(self):
+        """The outcome: "pass", the failure class, or "fail"."""
+        status = self.get_status()
+        if status in ("pass", "deferred"):
+            return status
+        return self.failure_class() or status
+
     def set_status(self, new_status, only_if_unset=False):
         if self.object_status and only_if_unset:
-            debug(f"ignoring '{new_status}', already '{self.object_status}'")
+            debug("ignoring '%s', already '%s'", new_status, self.object_status)
             return  # # Early Exit
         if self.object_status and not only_if_unset:
             #  changing -- keep track
@@ -143,6 +312,13 @@ class MozSignedObject:
     def add_message(self, *args):
         self.messages.extend(args)
 
+    def failure_class(self):
+        """Name of the exception which failed verification, if any."""
+        for error in self.errors:
+            if error.startswith("Failure reason: "):
+                return error[len("Failure reason: ") :]
+        return None
+
     def format_message(self):
         def indent(s):
             return "    " + str(s)
@@ -163,13 +339,81 @@ class MozSignedObject:
     def get_flo(self, valid=None) -> BytesIO:
         raise ValueError("get_flo not implemented")
 
+    def probe(self):
+        """Cheap checks to make before retrieving the whole object.
+
+        Subclasses for remote objects should raise the appropriate
+        SigVerifyException if the object is certain to fail.
+        """
+        pass
+
+    def cache_key(self):
+        """Key identifying the contents of the object, for the verdict cache.
+
+        None if the contents can't be identified cheaply.
+        """
+        return None
+
+    def lookup_verdict(self):
+        """Check the verdict cache for this object's contents.
+
+        :returns: True or False for a cached pass or fail, None if not cached
+        """
+        if self.verdict_cache is None:
+            return None
+        try:
+            verdict = self.verdict_cache.get(self.cache_key())
+        except Exception as e:
+            # the cache is an optimization, carry on without it
+            debug("verdict cache lookup failed: %r", e)
+            return None
+        if verdict is None:
+            return None
+        self.cache_hit = True
+        self.add_error(*verdict.results)
+        self.add_message("Verdict from cache")
+        return verdict.status == "pass"
+
+    def store_verdict(self, valid):
+        if self.verdict_cache is None or self.cache_hit:
+            return
+        try:
+            self.verdict_cache.put(
+                self.cache_key(), "pass" if valid else "fail", self.errors
+            )
+        except Exception as e:
+            debug("verdict cache store failed: %r", e)
+
+    def check_exe_cached(self):
+        """check_exe(), unless the verdict is already known."""
+        cached = self.lookup_verdict()
+        if cached is not None:
+            return cached
+        try:
+            valid = self.check_exe()
+        except SigVerifyException as e:
+            self.record_failure(e)
+            raise
+        self.store_verdict(valid)
+        return valid
+
+    def record_failure(self, e):
+        """Note the SigVerifyException `e` as the verdict."""
+        # the verdict on these is final, so worth keeping
+        self.add_error(f"Failure reason: {type(e).__name__}")
+        self.store_verdict(False)
+
+    def add_failure(self, e):
+        """Note the unexpected exception `e`, which stopped the check."""
+        self.add_error(f"failed to process {self.artifact_name} '{e!r}'")
+
     def show_file_stats(self, objf):
         if self.verbose:
             cur_pos = objf.tell()
             objf.seek(0, 2)
             len_ = objf.tell()
             objf.seek(0, 0)
-            print(f"Processing file of size {len_} (at {cur_pos})")
+            info("Processing file of size %s (at %s)", len_, cur_pos)
 
     def should_validate(self):
         """Filter out any items that should not be checked.
@@ -180,34 +424,13 @@ class MozSignedObject:
             # We're in test mode, process everything
             return True
 
-        # We have 2 criteria for filtering - file extension and file prefix. In
-        # both cases, we consider a pass for filtering a 'pass', with the
-        # explanation of why.
-
-        # Current criteria is based on prefix of filename. We include the two
-        # know good names, rather than exclude the two currently known
-        # exceptions (mar.exe & mbsdiff.exe) to reduce false positives (since a
-        # invalid exe will page someone).
-        basename = os.path.basename(self.artifact_name)
-        do_validation = True
-        if not basename.endswith(PRODUCTION_EXTENSIONS):
-            self.add_message("Excluded from validation by file suffix")
-            do_validation = False
-        elif not basename.startswith(PRODUCTION_PREFIXES):
-            self.add_message("Excluded from validation by file prefix")
-            do_validation = False
-        else:
-            # ignore dependent & try builds, which is based on the first part
-            # of the key (in S3 terms), which is the "path" element of an S3
-            # url
-            url = urllib.parse.urlparse(str(self.artifact_name))
-            key = url.path
-            if key.startswith(PRODUCTION_KEY_PREFIX_EXCLUSIONS):
-                self.add_message("Excluded from validation by key prefix")
-                do_validation = False
-        return do_validation
-
-    @trace_xray_subsegment()
+        reason = production_exclusion(self.artifact_name)
+        if reason is not None:
+            self.add_message(reason)
+            return False
+        return True
+
+    @tracing.traced()
     def check_exe(self):
         return self.check_exe_new()
 
@@ -220,75 +443,187 @@ class MozSignedObject:
         :raises SigVerifyException: if any specific problem is identified in
             the object
         """
+        objf = self.fetch()
+        with objf:
+            self.check_in_process(objf)
+            self.run_verifier(objf)
+        # the serial, checksum, and digest have already been checked, we only
+        # need osslsigncode for the cryptographic checks.
+        return True
+
+    def fetch(self):
+        """Retrieve the object, after probing it.
+
+        :returns: the open file to check
+        """
+        with self.timed("download"):
+            self.probe()
+            return self.get_flo()
+
+    def check_in_process(self, objf):
+        """The checks which don't need osslsigncode."""
+        self.show_file_stats(objf)
+        # Check who signed it in process first -- no need to fork
+        # osslsigncode for unsigned or non-Mozilla files.
+        with self.timed("parse"):
+            self.check_signer(objf)
+            self.check_digest(objf)
+        objf.seek(0, 0)
+
+    def checked_verifier_timeout(self):
+        """``verifier_timeout()``, if there's any time left.
+
+        :raises DeadlineExceeded: if there isn't
+        """
+        timeout = self.verifier_timeout()
+        if timeout is not None and timeout <= 0:
+            raise DeadlineExceeded("no time left to run osslsigncode")
+        return timeout
 
-        def show_output(results) -> None:
-            if MozSignedObject.verbose >= 2:
-                if results is None:
-                    print("No results from osslsigncode run (likely exception)")
-                else:
-                    print(
-                        f"stdout {type(results.stdout)}; stderr {type(results.stderr)}"
-                    )
-                    print(
-                        f"osslsigncode exitcode: {results.returncode}\n"
-                        f"-- stderr:\n'{results.stderr}'"
-                        f"\n-- stdout\n'{results.stdout}'"
-                    )
+    def run_verifier(self, objf):
+        """Have osslsigncode verify the signature in `objf`.
 
-        cert_serial_number = "invalid hex data"
-        with self.get_flo() as objf:
-            self.show_file_stats(objf)
-            # shelling out means we need a real file on disk, so create one
-            with tempfile.NamedTemporaryFile(mode="w+b") as real_file:
-                fname = getattr(real_file, "name", "unknown file name")
-                real_file.write(objf.read())
-                real_file.flush()
-                real_file.seek(0, 0)
-                results = None  # needed for linter
-                try:
+        :raises SigVerifyException: if it doesn't
+        :raises DeadlineExceeded: if it took too long
+        """
+        timeout = self.checked_verifier_timeout()
+        # shelling out means we need something osslsigncode can open by
+        # name, so provide one (unless we already have one)
+        with self.verifier_input(objf) as (fname, pass_fds):
+            results = None  # needed for linter
+            try:
+                with self.timed("verify"):
                     results = subprocess.run(  # nosec -- tell bandit we're confident we're doing this correctly
-                        ["osslsigncode", "verify", fname],
+                        verifier_command(fname),
                         universal_newlines=True,
                         stdout=subprocess.PIPE,
                         stderr=subprocess.PIPE,
+                        pass_fds=pass_fds,
+                        timeout=timeout,
                     )
-                    if results.returncode != 0:
-                        # file is badly formed
-                        show_output(results)
-                        raise SigVerifyBadSignature(
-                            f"Corrupted signature in {objf.original_name}: {results.returncode}"
-                        )
-                    else:
-                        show_output(results)
-                except Exception as e:
-                    print(f"osslsigncode exception {repr(e)}")
-                    show_output(results)
-                    raise SigVerifyNoSignature
-            # parse to get mozilla signature
-            for l in [line.strip() for line in results.stdout.splitlines()]:
-                # first "Serial" line is for the signature, rest are
-                # certificates
-                if l.startswith("Serial : "):
-                    cert_serial_number = int(l.split(":")[-1].strip(), 16)
-                    break
-                # the following situation occurs with post balrog stub installers
-                # i.e. it shouldn't occur with items uploaded to product
-                # delivery
-                if l.startswith("Calculated PE checksum:") and l.endswith(
-                    "MISMATCH!!!!"
-                ):
-                    show_output(results)
-                    raise SigVerifyBadSignature("Checksum Mismatch")
-            else:
-                show_output(results)
-                raise Exception(
-                    f"No serial in osslsigncode stdout (len {len(results.stdout)}): '{results.stdout}'"
-                )
+                self.check_verifier_results(objf, results)
+            except subprocess.TimeoutExpired:
+                # not the file's fault, so don't record a verdict
+                raise DeadlineExceeded(f"osslsigncode took over {timeout:.1f}s")
+            except OSError as e:
+                # nor is it missing, or unable to start
+                raise VerifierUnavailable(f"couldn't run osslsigncode: {e!r}")
+            except Exception as e:
+                warning("osslsigncode exception %r", e)
+                show_verifier_output(results)
+                raise SigVerifyNoSignature
+
+    @staticmethod
+    def check_verifier_results(objf, results):
+        """:raises SigVerifyBadSignature: if osslsigncode failed"""
+        show_verifier_output(results)
+        if results.returncode != 0:
+            # file is badly formed
+            raise SigVerifyBadSignature(
+                f"Corrupted signature in {objf.original_name}: {results.returncode}"
+            )
+
+    @staticmethod
+    @contextlib.contextmanager
+    def verifier_input(objf):
+        """Provide the contents of `objf` in a form a subprocess can open.
+
+        If `objf` is already an ArtifactBuffer or a regular file, it is used
+        as is. Otherwise the contents are copied in chunks to a new
+        ArtifactBuffer, which is released on exit.
+
+        :yields (path, pass_fds): the path to hand the subprocess, and any
+            file descriptors it must inherit to open that path.
+        """
+        if isinstance(objf, ArtifactBuffer):
+            objf.flush()
+            yield objf.verifier_path, objf.pass_fds
+            return
+        name = getattr(objf, "name", None)
+        if isinstance(name, str) and os.path.isfile(name):
+            yield name, ()
+            return
+        with ArtifactBuffer.create() as buffer:
+            objf.seek(0, 0)
+            shutil.copyfileobj(objf, buffer, DOWNLOAD_CHUNK_SIZE)
+            buffer.flush()
+            yield buffer.verifier_path, buffer.pass_fds
+
+    def check_digest(self, objf):
+        """Confirm the PE checksum and Authenticode digest of `objf`.
+
+        Uses the digest computed during retrieval, if there is one, and
+        otherwise computes it over a memory map of `objf`.
 
-        valid_signature = cert_serial_number in VALID_CERTS
-        if not valid_signature:
+        :raises SigVerifyBadSignature: if either doesn't match
+        """
+        try:
+            digest = None
+            if self.digester is not None:
+                digest = self.digester.finish()
+                self.digester = None
+            if digest is None or digest.size != self.file_size(objf):
+                digest = pe_digest.digest_file(objf)
+            signed = pe_digest.signed_digests(
+                authenticode.read_cert_table(objf, digest.header)
+            )
+        except authenticode.AuthenticodeFormatError as e:
+            raise SigVerifyBadSignature(f"Malformed signature: {e}")
+        # the following situation occurs with post balrog stub installers
+        # i.e. it shouldn't occur with items uploaded to product delivery
+        if digest.checksum != digest.stored_checksum:
+            debug("checksum %#x != %#x", digest.checksum, digest.stored_checksum)
+            raise SigVerifyBadSignature("Checksum Mismatch")
+        for algorithm, expected in signed.items():
+            actual = digest.digests.get(algorithm)
+            if actual is None:
+                # an unusual algorithm, which we didn't compute up front
+                actual = pe_digest.digest_file(objf, [algorithm]).digests[algorithm]
+            if actual != expected:
+                raise SigVerifyBadSignature(f"Digest Mismatch ({algorithm})")
+
+    def update_digester(self, chunk):
+        if self.digester is None:
+            return
+        try:
+            self.digester.update(chunk)
+        except authenticode.AuthenticodeFormatError:
+            # let check_exe report the problem
+            self.digester = None
+
+    @staticmethod
+    def file_size(objf):
+        position = objf.tell()
+        size = objf.seek(0, 2)
+        objf.seek(position, 0)
+        return size
+
+    def check_signer(self, objf):
+        """Confirm the Authenticode signature in `objf` is from Mozilla.
+
+        Only the PE headers and certificate table are examined, in process,
+        the signature itself is not verified.
+
+        :returns int: serial number of the signing certificate
+
+        :raises SigVerifyNoSignature: if `objf` is not a signed PE file
+        :raises SigVerifyBadSignature: if the signature can't be decoded
+        :raises SigVerifyNonMozSignature: if the signer isn't one the verifier
+            trusts
+        """
+        try:
+            cert_serial_number = authenticode.get_signer_serial(objf)
+        except authenticode.NotPEFileError as e:
+            debug("not a PE file: %s", e)
+            raise SigVerifyNoSignature
+        except authenticode.AuthenticodeFormatError as e:
+            raise SigVerifyBadSignature(f"Malformed signature: {e}")
+        if cert_serial_number is None:
+            raise SigVerifyNoSignature
+        debug("signer serial %s", cert_serial_number)
+        if cert_serial_number not in self.verifier.valid_certs:
             raise SigVerifyNonMozSignature
-        return valid_signature
+        return cert_serial_number
 
 
 class BytesIOWithName(BytesIO):
@@ -306,15 +641,175 @@ class BytesIOWithName(BytesIO):
         self.original_name = original_name or "no-name-supplied"
 
 
+def object_size(result):
+    """Size of the whole object, from a (possibly ranged) get_object result."""
+    # "bytes 0-4095/246056"
+    content_range = result.get("ContentRange", "")
+    if "/" in content_range:
+        return int(content_range.rsplit("/", 1)[-1])
+    # whole object returned
+    return result["ContentLength"]
+
+
+def content_length(result):
+    """Size of the body of a (possibly ranged) get_object result."""
+    if "ContentLength" in result:
+        return result["ContentLength"]
+    # not returned by every S3 stand-in for a range, "bytes 0-4095/246056"
+    first, last = result["ContentRange"].split()[-1].split("/")[0].split("-")
+    return int(last) - int(first) + 1
+
+
+def invalid_range(e):
+    """True if `e` is S3 refusing a range, as it does any of an empty object."""
+    if not isinstance(e, ClientError):
+        return False
+    # some S3 stand-ins give just the status
+    return e.response.get("Error", {}).get("Code") in ("InvalidRange", "416")
+
+
+class S3RangeReader:
+    """Read-only, seekable file like access to an S3 object via ranged GETs.
+
+    Each read() which isn't satisfied by the previous response issues one
+    GET for exactly the bytes requested. Used to examine the headers of an
+    object without downloading all of it.
+    """
+
+    def __init__(self, s3_client, bucket, key):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.original_name = key
+        self.size = None
+        self.bytes_fetched = 0
+        self.requests = 0
+        self._pos = 0
+        self._block_start = 0
+        self._block = b""
+
+    def fetch(self, start, length):
+        """GET `length` bytes from `start`, learning the object size."""
+        if self.size is not None:
+            length = min(length, self.size - start)
+            if length <= 0:
+                return b""
+        try:
+            result = self.s3_client.get_object(
+                Bucket=self.bucket,
+                Key=self.key,
+                Range=f"bytes={start}-{start + length - 1}",
+            )
+        except ClientError as e:
+            if start or not invalid_range(e):
+                raise
+            # S3 refuses any range of an empty object
+            self.size = 0
+            return b""
+        data = result["Body"].read()
+        self.requests += 1
+        self.bytes_fetched += len(data)
+        self.size = object_size(result)
+        self._block_start, self._block = start, data
+        return data
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            raise ValueError("S3RangeReader requires an explicit read size")
+        offset = self._pos - self._block_start
+        if 0 <= offset and offset + size <= len(self._block):
+            data = self._block[offset : offset + size]
+        else:
+            data = self.fetch(self._pos, size)
+        self._pos += len(data)
+        return data
+
+    def seek(self, offset, whence=0):
+        if whence == 0:
+            self._pos = offset
+        elif whence == 1:
+            self._pos += offset
+        elif whence == 2:
+            if self.size is None:
+                self.fetch(0, authenticode.HEADER_PROBE_SIZE)
+            self._pos = self.size + offset
+        else:
+            raise ValueError(f"invalid whence ({whence})")
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+
+def is_missing_key(e):
+    """True if `e` is S3 saying the object doesn't exist (yet)."""
+    if not isinstance(e, ClientError):
+        return False
+    return e.response.get("Error", {}).get("Code") in ("NoSuchKey", "404")
+
+
 class MozSignedObjectViaLambda(MozSignedObject):
-    def __init__(self, bucket=None, key=None, *args, **kwargs):
+    # Lambda memory limit (MiB), from the invocation context
+    memory_limit_mb = None
+    # when (time.time()) the Lambda invocation will be stopped
+    deadline = None
+    # sns_dispatcher.SNSDispatcher for the invocation, None to publish
+    # each notification immediately
+    dispatcher = None
+
+    @classmethod
+    def set_deadline(cls, context=None):
+        """Note when the invocation times out, from the Lambda context."""
+        remaining = getattr(context, "get_remaining_time_in_millis", None)
+        cls.deadline = time.time() + remaining() / 1000 if callable(remaining) else None
+
+    def time_left(self):
+        """Seconds until DEADLINE_RESERVE, None if there's no deadline."""
+        if self.deadline is None:
+            return None
+        return self.deadline - DEADLINE_RESERVE - time.time()
+
+    @classmethod
+    def set_memory_limit(cls, memory_limit_in_mb=None):
+        """Size in-memory buffering to the Lambda's configured memory."""
+        try:
+            cls.memory_limit_mb = int(memory_limit_in_mb) or None
+        except (TypeError, ValueError):
+            cls.memory_limit_mb = None
+
+    @classmethod
+    def spool_max_size(cls, memory_limit_mb=None):
+        """Largest download we'll hold in memory rather than on disk.
+
+        :param memory_limit_mb: the memory available, default the class's
+        """
+        memory_limit_mb = memory_limit_mb or cls.memory_limit_mb
+        if not memory_limit_mb:
+            return DEFAULT_SPOOL_MAX_SIZE
+        return int(memory_limit_mb * (1024 * 1024) * SPOOL_MEMORY_FRACTION)
+
+    def __init__(self, bucket=None, key=None, *args, etag=None, size=None, **kwargs):
         super().__init__(*args, **kwargs)
+        self.memory_limit_mb = self.verifier.memory_limit_mb
+        self.deadline = self.verifier.deadline
+        self.dispatcher = self.verifier.dispatcher
         self.bucket_name = bucket
         self.key_name = key
+        # from the event record, if supplied
+        self.etag = etag
+        self.size = size
         self.s3_wait_time = 0
+        # seconds slept before each retry of a missing object
+        self.s3_waits = []
+        self.object_exists = False
+        self.probe_bytes = 0
+        self.download_bytes = 0
+        self.download_parts = 0
         self.artifact_name = f"s3://{bucket}/{key}"
 
         self.had_s3_error = False
+        # set if we ran out of time, see defer()
+        self.deferred = False
         # S3 is an "eventually consistent" object store. Which leads to the
         # rare, but observed, case where the first S3 get will fail with
         # "NoSuchObject".
@@ -337,6 +832,24 @@ class MozSignedObjectViaLambda(MozSignedObject):
         """For S3, we need the bucket & key names."""
         return self.bucket_name, self.key_name
 
+    @property
+    def needs_retry(self):
+        """True if this object must be processed again."""
+        return self.had_s3_error or self.deferred
+
+    def defer(self, reason):
+        """Leave this object for a later invocation, with time to finish."""
+        self.deferred = True
+        self.add_message(f"Deferred: {reason}")
+        self.set_status("deferred")
+
+    def verifier_timeout(self):
+        timeout = int_from_environment("VERIFY_TIMEOUT", DEFAULT_VERIFY_TIMEOUT)
+        time_left = self.time_left()
+        if time_left is not None:
+            timeout = min(timeout, time_left)
+        return timeout
+
     def report_validity(self, valid=None):
         """
         For invoked lambda functions, we have 3 report channels:
@@ -353,101 +866,272 @@ class MozSignedObjectViaLambda(MozSignedObject):
             # Infer validity from message
             valid = message.startswith("pass")
         if self.verbose:
-            print(f"msg: '{message}'")
-            print(f"sum: '{self.summary()}'")
+            info("msg: '%s'", message)
+            info("sum: '%s'", self.summary())
         if (not valid) or self.verbose:
             self.send_sns(message)
 
     def summary(self):
-        debug(f"len errors {len(self.errors)},  messages {len(self.messages)}")
+        debug("len errors %s,  messages %s", len(self.errors), len(self.messages))
         json_info = {
             "bucket": self.bucket_name,
             "key": self.key_name,
             "status": self.get_status(),
             "results": self.errors + self.messages,
             "s3wait": self.s3_wait_time,
+            "s3waits": [round(delay, 3) for delay in self.s3_waits],
+            "cached": self.cache_hit,
+            "verdict": self.verdict(),
+            "timings": self.timings_ms(),
+            "bytes": self.probe_bytes + self.download_bytes,
         }
         return json_info
 
-    @trace_xray_subsegment()
-    def get_flo(self):
-        s3_client = boto3.client("s3")
-        debug("in get_flo")
-        start_waiting = time.time()
-        try:
-            # Make sure the object is really available taken from
-            #   https://blog.rackspace.com/the-devnull-s3-bucket-hacking-with-aws-lambda-and-python
-            # Don't use defaults, though -- that's 100 sec during testing!
-            waiter = s3_client.get_waiter("object_exists")
-            waiter.wait(
-                Bucket=self.bucket_name,
-                Key=self.key_name,
-                WaiterConfig={"Delay": 3, "MaxAttempts": 3},
-            )
-            result = s3_client.get_object(Bucket=self.bucket_name, Key=self.key_name)
-        except Exception as e:
-            debug(f"s3 exceptions type: {type(e)}")
-            self.had_s3_error = True
-            text = repr(e)[:256]
-            self.add_error(
-                "failed to process s3 object {}/{} '{}'".format(
-                    self.bucket_name, self.key_name, text
+    def cache_key(self):
+        if not self.etag:
+            # not in the event, worth a HEAD to avoid the download
+            try:
+                head = self.verifier.client("s3").head_object(
+                    Bucket=self.bucket_name, Key=self.key_name
                 )
+            except Exception as e:
+                # any real problem gets reported when we get the object
+                debug("head_object failed: %r", e)
+                return None
+            self.etag, self.size = head["ETag"], head["ContentLength"]
+        return verdict_cache.s3_key(self.etag, self.size)
+
+    def record_s3_error(self, e):
+        """Note an S3 failure, so the invocation will be retried."""
+        debug("s3 exceptions type: %s", type(e))
+        self.had_s3_error = True
+        text = repr(e)[:256]
+        self.add_error(
+            "failed to process s3 object {}/{} '{}'".format(
+                self.bucket_name, self.key_name, text
             )
-            raise
+        )
+
+    def s3_retry(self, operation, *args, **kwargs):
+        """Call the S3 `operation`, retrying while the object is missing.
+
+        Only the first retrieval of an object is retried. The time taken is
+        added to `s3_wait_time`, and each sleep recorded in `s3_waits`.
+        """
+        started = time.monotonic()
+        give_up = time.time() + S3_MAX_WAIT
+        if self.deadline is not None:
+            give_up = min(give_up, self.deadline - DEADLINE_RESERVE)
+        attempt = 0
+        try:
+            while True:
+                try:
+                    result = operation(*args, **kwargs)
+                    self.object_exists = True
+                    return result
+                except ClientError as e:
+                    if self.object_exists or not is_missing_key(e):
+                        raise
+                    ceiling = min(
+                        S3_RETRY_MAX_DELAY, S3_RETRY_BASE_DELAY * 2 ** attempt
+                    )
+                    delay = random.uniform(ceiling / 2, ceiling)  # nosec - jitter
+                    if time.time() + delay > give_up:
+                        raise
+                    debug("%s not found, retry in %.3fs", self.key_name, delay)
+                    time.sleep(delay)
+                    self.add_time("wait", delay)
+                    self.s3_waits.append(delay)
+                    attempt += 1
         finally:
-            self.s3_wait_time = time.time() - start_waiting
+            self.s3_wait_time += time.monotonic() - started
 
-        debug(f"after s3_client.get_object() result={type(result)}")
-        if result["ContentLength"] > MAX_EXE_SIZE:
+    def check_size(self, size, details=""):
+        if size > MAX_EXE_SIZE:
             msg = """Too big: {}/{} {}
                     ({})""".format(
-                self.bucket_name, self.key_name, result["ContentLength"], repr(result)
+                self.bucket_name, self.key_name, size, details
             )
-            print(msg)
+            warning("%s", msg)
             raise SigVerifyTooBig(msg)
+
+    @tracing.traced()
+    def probe(self):
+        """Check the headers and signer via small ranged GETs.
+
+        Objects which aren't PE files, are unsigned, aren't signed by
+        Mozilla, or are too big are rejected before we pay to download all
+        of them.
+        """
+        s3_client = self.verifier.client("s3")
+        reader = S3RangeReader(s3_client, self.bucket_name, self.key_name)
+        try:
+            self.s3_retry(reader.fetch, 0, authenticode.HEADER_PROBE_SIZE)
+        except Exception as e:
+            self.record_s3_error(e)
+            raise
+        try:
+            self.check_size(reader.size, "from ranged GET")
+            reader.seek(0, 0)
+            self.check_signer(reader)
+        except SigVerifyException:
+            raise
+        except Exception as e:
+            self.record_s3_error(e)
+            raise
+        finally:
+            self.probe_bytes = reader.bytes_fetched
+            debug(
+                "probe used %s GETs for %s bytes", reader.requests, reader.bytes_fetched
+            )
+
+    @tracing.traced()
+    def get_flo(self):
+        s3_client = self.verifier.client("s3")
+        debug("in get_flo")
+        part_size = download_part_size()
+        try:
+            result = self.s3_retry(self.get_first_part, s3_client, part_size)
+        except Exception as e:
+            self.record_s3_error(e)
+            raise
+
+        debug("after s3_client.get_object() result=%s", type(result))
+        size = object_size(result)
+        self.check_size(size, repr(result))
         debug("before body read")
-        flo = BytesIOWithName(result["Body"].read(), original_name=self.key_name)
-        debug(f"after read() flo={type(flo)}")
+        # download directly into the buffer the verifier will read
+        flo = ArtifactBuffer.create(
+            size_hint=size,
+            max_memory=self.spool_max_size(self.memory_limit_mb),
+            original_name=self.key_name,
+        )
+        try:
+            if size <= content_length(result):
+                self.download_whole(flo, result["Body"])
+            else:
+                self.download_in_parts(s3_client, flo, result, size, part_size)
+        except Exception as e:
+            # an interrupted transfer is worth retrying, as a failed GET is
+            self.record_s3_error(e)
+            flo.close()
+            raise
+        flo.seek(0, 0)
+        debug("after read() flo=%s parts=%s", flo.backend, self.download_parts)
         return flo
 
-    @trace_xray_subsegment()
+    def get_first_part(self, s3_client, part_size):
+        """GET the first `part_size` bytes, which is all of a small object."""
+        try:
+            return s3_client.get_object(
+                Bucket=self.bucket_name,
+                Key=self.key_name,
+                Range=f"bytes=0-{part_size - 1}",
+            )
+        except ClientError as e:
+            if not invalid_range(e):
+                raise
+            # S3 refuses any range of an empty object
+            return s3_client.get_object(Bucket=self.bucket_name, Key=self.key_name)
+
+    def download_whole(self, flo, body):
+        """Copy a single response to `flo`, digesting as it arrives."""
+        self.download_parts = 1
+        # compute the checksum & digests while we wait on the network
+        self.digester = pe_digest.PEDigester()
+        write_time = 0
+        try:
+            for chunk in iter(lambda: body.read(DOWNLOAD_CHUNK_SIZE), b""):
+                start = time.perf_counter()
+                flo.write(chunk)
+                write_time += time.perf_counter() - start
+                self.download_bytes += len(chunk)
+                self.update_digester(chunk)
+        finally:
+            self.add_time("write", write_time)
+
+    def download_in_parts(self, s3_client, flo, first, size, part_size):
+        """Retrieve the rest of the object as concurrent ranged GETs.
+
+        Each part is written at its offset in the preallocated `flo`. Parts
+        arrive out of order, so the digest is computed afterwards.
+
+        :param first: the response holding the first part
+        """
+        self.digester = None
+        fd = flo.fileno()
+        os.ftruncate(fd, size)
+        starts = range(0, size, part_size)
+        self.download_parts = len(starts)
+
+        def fetch(start):
+            end = min(start + part_size, size)
+            if start == 0:
+                body = first["Body"]
+            else:
+                conditions = {}
+                if "ETag" in first:
+                    # fail, rather than mix versions, if it's replaced (not
+                    # every S3 stand-in returns it for a range)
+                    conditions["IfMatch"] = first["ETag"]
+                body = s3_client.get_object(
+                    Bucket=self.bucket_name,
+                    Key=self.key_name,
+                    Range=f"bytes={start}-{end - 1}",
+                    **conditions,
+                )["Body"]
+            offset = start
+            write_time = 0
+            try:
+                for chunk in iter(lambda: body.read(DOWNLOAD_CHUNK_SIZE), b""):
+                    write_start = time.perf_counter()
+                    os.pwrite(fd, chunk, offset)
+                    write_time += time.perf_counter() - write_start
+                    offset += len(chunk)
+            finally:
+                self.add_time("write", write_time)
+                with self._timings_lock:
+                    self.download_bytes += offset - start
+            if offset != end:
+                raise IOError(f"short read of bytes {start}-{end - 1}: got {offset}")
+
+        workers = min(download_concurrency(), len(starts))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            # list() to raise any failure
+            list(pool.map(fetch, starts))
+
+    @tracing.traced()
     def process_one_s3_file(self):
         if self.verbose:
-            print(f"Processing {self.artifact_name}")
+            info("Processing %s", self.artifact_name)
         valid_sig = True
         try:
             if self.should_validate():
-                valid_sig = self.check_exe()
+                valid_sig = self.check_exe_cached()
+        except DeadlineExceeded as e:
+            self.defer(str(e))
+            return False
         except Exception as e:
             valid_sig = False
             if isinstance(e, SigVerifyException):
-                self.add_error(f"Failure reason: {type(e).__name__}")
+                # reason already recorded
+                pass
             else:
-                text = repr(e)[:256]
-                self.add_error(
-                    "failed to process s3 object {}/{} '{}'".format(
-                        self.bucket_name, self.key_name, text
-                    )
-                )
+                self.add_failure(e)
         self.set_status("pass" if valid_sig else "fail", only_if_unset=True)
         return valid_sig
 
-    @trace_xray_subsegment()
+    def add_failure(self, e):
+        text = repr(e)[:256]
+        self.add_error(
+            "failed to process s3 object {}/{} '{}'".format(
+                self.bucket_name, self.key_name, text
+            )
+        )
+
+    @tracing.traced()
     def send_sns(self, msg, e=None, reraise=False):
-        # use first line of incoming msg as subject, but AWS limit is under 100
-        # chars.
-        # ASSUME anything over is due to long s3 URL and use heuristic
-        subject = msg.split("\n")[0]
-        if len(subject) >= 100:
-            # split assuming URL, then retain result (index 0) and file name
-            # (index -1). File name should be sufficient to allow page
-            # recipient to decide urgency of further investigation.
-            pieces = subject.split("/")
-            subject = f"{pieces[0]} ... {pieces[-1]}"
-            if len(subject) >= 100:
-                # don't try to be smarter, full text is still in 'msg'
-                subject = "Truncated subject, examine message"
+        subject = sns_dispatcher.subject_for(msg)
 
         # append bucket & key, short key first
         msg += "\n{}\nkey={}\nbucket={}".format(
@@ -458,32 +1142,69 @@ class MozSignedObjectViaLambda(MozSignedObject):
             import traceback
 
             msg += traceback.format_exc()
-        client = boto3.client("sns")
-        # keep a global to prevent infinite recursion on arn error
-        global topic_arn
-        topic_arn = os.environ.get("SNSARN", "")
+        topic_arn = self.verifier.topic_arn or os.environ.get("SNSARN", "")
         if self.verbose:
-            print(f"snsarn: {topic_arn}")
+            info("snsarn: %s", topic_arn)
         if not topic_arn:
             # bad config, we expected this in the environ
-            # set flag so we don't re-raise
-            topic_arn = "no-topic-arn"
             raise KeyError("Missing 'SNSARN' from environment")
-        try:
-            # if the publish fails, we still want to continue, so we get the
-            # details into the cloud watch logs. Otherwise, this can
-            # (sometimes) terminate the lambda causing retries & DLQ
-            response = client.publish(Message=msg, Subject=subject, TopicArn=topic_arn)
-            debug(f"sns publish: '{response}'")
-        except Exception as e:
+
+        def publish_failed(error):
             self.add_message(
                 "sns publish failed\n"
                 "   msg ({}): '{}'\n"
                 "  subj ({}): '{}'\n"
                 "exception: '{}'"
-                "".format(len(msg), str(msg), len(subject), str(subject), str(e))
+                "".format(len(msg), str(msg), len(subject), str(subject), str(error))
             )
 
+        with self.timed("notify"):
+            if self.dispatcher is not None:
+                # only queued here, the dispatcher publishes
+                self.dispatcher.submit(
+                    subject,
+                    msg,
+                    group=self.notification_group(),
+                    name=self.artifact_name,
+                    on_failure=publish_failed,
+                )
+                return
+            client = self.verifier.client("sns")
+            try:
+                # if the publish fails, we still want to continue, so we get the
+                # details into the cloud watch logs. Otherwise, this can
+                # (sometimes) terminate the lambda causing retries & DLQ
+                response = client.publish(
+                    Message=msg, Subject=subject, TopicArn=topic_arn
+                )
+                debug("sns publish: '%s'", response)
+            except Exception as e:
+                publish_failed(e)
+
+    def notification_group(self):
+        """What a notification is about, for collapsing similar ones."""
+        prefix = os.path.dirname(self.key_name or "")
+        location = f"s3://{self.bucket_name}/" + (f"{prefix}/" if prefix else "")
+        return self.object_status, self.failure_class(), location
+
+
+class DeadlineExceeded(Exception):
+    """Not enough of the invocation left to check the object.
+
+    Says nothing about the object, so it's deferred rather than failed.
+    """
+
+    pass
+
+
+class VerifierUnavailable(Exception):
+    """``osslsigncode`` couldn't be run, e.g. it's missing.
+
+    Says nothing about the object, so no verdict is recorded.
+    """
+
+    pass
+
 
 class SigVerifyException(Exception):
     """Catchall for any signature problem found.
@@ -529,34 +1250,257 @@ def unpacked_s3_events(events, notices=None):
     :param events: dict with key 'Records' & value a list of sub-events
     :param notices: dict in which to place a note if SNS detected
     :returns s3_event_record: sequence of s3 event records
+    :raises ValueError: at the first part of `events` which can't be decoded
     """
+    decoder = event_decoder.EventDecoder(max_errors=1)
+    for record in decoder.records(events):
+        if decoder.error_count:
+            break
+        if notices and decoder.sns_unpacked:
+            notices["unpacker"] = "SNS message unpacked"
+        if record.raw is not None:
+            yield record.raw
+    if decoder.error_count:
+        error = decoder.errors[0]
+        raise ValueError(f"Invalid AWS Event at {error.path}: {error.error}")
+
+
+def artifact_to_check_via_s3(lambda_event_record, verifier=None):
+    """Create the artifact for an S3 record.
+
+    :param lambda_event_record: an ``event_decoder.S3Record``, or a record
+        of an S3 notification
+    :param verifier: the ``verifier.Verifier`` to check it with, default
+        one with the class settings
+    """
+    record = lambda_event_record
+    if not isinstance(record, event_decoder.S3Record):
+        record = event_decoder.from_s3_event_record(record)
+    obj = MozSignedObjectViaLambda(
+        record.bucket,
+        record.key,
+        etag=record.etag,
+        size=record.size,
+        verifier=verifier,
+    )
+    return obj
+
+
+def process_record(record, verifier=None):
+    """Verify & report on the object named in one S3 event record.
+
+    All errors are caught and recorded on the returned artifact, so one bad
+    record never affects another.
+
+    :returns MozSignedObjectViaLambda: with the results
+    """
+    with profiling.profiled_thread():
+        return check_record(record, verifier)
+
+
+def check_record(record, verifier=None):
+    """``process_record()``, outside any profiling."""
+    artifact = artifact_to_check_via_s3(record, verifier)
+    time_left = artifact.time_left()
+    if time_left is not None and time_left < RECORD_MIN_TIME:
+        artifact.defer("not started, too close to the deadline")
+        return artifact
     try:
-        for event in events["Records"]:
-            if "s3" in event:
-                yield event
-            elif "Sns" in event:
-                # embedded events encoded as json string
-                if notices:
-                    notices["unpacker"] = "SNS message unpacked"
-                yield from unpacked_s3_events(json.loads(event["Sns"]["Message"]))
-            else:
-                raise KeyError(f"unknown event type '{json.dumps(event)}'")
-    except Exception:
-        raise ValueError(f"Invalid AWS Event '{json.dumps(events)}'")
+        valid_sig = False
+        try:
+            valid_sig = artifact.process_one_s3_file()
+            debug("after process 1 %s", valid_sig)
+        except SigVerifyNonMozSignature as e:
+            msg = "non-moz signature"
+            debug(msg)
+            artifact.send_sns(msg, e)
+        except SigVerifyTooBig as e:
+            # send SNS of program failure
+            msg = "data failure"
+            debug(msg)
+            artifact.send_sns(msg, e)
+        except SigVerifyNoSignature as e:
+            msg = "exe without sig"
+            debug(msg)
+            artifact.send_sns(msg, e)
+        except SigVerifyBadSignature as e:
+            # send SNS of bad binary uploaded
+            msg = "bad sig"
+            debug(msg)
+            artifact.send_sns(msg, e)
+        except SigVerifyException as e:
+            msg = "unclassified error"
+            debug(msg)
+            artifact.send_sns(msg, e)
+        except (Exception) as e:
+            # uncaught by me program failure
+            msg = "app failure: " + str(type(e).__name__) + str(repr(e))
+            debug("%s", msg)
+            artifact.send_sns(msg, e)
+    except (Exception) as e:
+        # double exception, should already have a message
+        artifact.add_error(f"app failure 2: {str(e)}")
+    if not artifact.deferred:
+        # we'll report on it when it's finished
+        artifact.report_validity()
+    return artifact
 
 
-def artifact_to_check_via_s3(lambda_event_record):
-    bucket_name = lambda_event_record["s3"]["bucket"]["name"]
-    key_name = lambda_event_record["s3"]["object"]["key"]
-    # issue #14 - the below decode majik is from AWS sample code.
+def int_from_environment(name, default):
+    """Positive integer setting from the environment, or `default`."""
+    try:
+        return max(1, int(os.environ.get(name, default)))
+    except ValueError:
+        return default
 
-    real_key_name = urllib.parse.unquote_plus(key_name)
-    obj = MozSignedObjectViaLambda(bucket_name, real_key_name)
-    return obj
 
+def record_workers():
+    """Number of records to process concurrently, from the environment."""
+    return int_from_environment("RECORD_WORKERS", DEFAULT_RECORD_WORKERS)
+
+
+def download_part_size():
+    """Bytes per ranged GET, from the environment."""
+    if "DOWNLOAD_PART_SIZE_MB" in os.environ:
+        return int_from_environment("DOWNLOAD_PART_SIZE_MB", 8) * (1024 * 1024)
+    return DOWNLOAD_PART_SIZE
+
+
+def download_concurrency():
+    """Number of parts to retrieve at once, from the environment."""
+    return int_from_environment("DOWNLOAD_CONCURRENCY", DEFAULT_DOWNLOAD_CONCURRENCY)
+
+
+def record_size(record):
+    """Sort key putting records smallest first, those of unknown size last."""
+    size = getattr(record, "size", None)
+    return (size is None, size or 0)
+
+
+def process_records(records, max_workers=DEFAULT_RECORD_WORKERS, verifier=None):
+    """Process each record, up to `max_workers` at a time.
+
+    The smallest objects are started first, so as many as possible finish
+    before the deadline.
+
+    :param verifier: the ``verifier.Verifier`` to check them with
+    :returns list: the artifacts, in the same order as `records`
+    """
+    if verifier is None:
+        from fx_sig_verify.verifier import Verifier
+
+        verifier = Verifier.from_class_settings(MozSignedObjectViaLambda)
+    order = sorted(range(len(records)), key=lambda i: record_size(records[i]))
+    scheduled = [records[i] for i in order]
+    if max_workers <= 1 or len(records) <= 1:
+        processed = [process_record(record, verifier) for record in scheduled]
+    else:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(records))) as pool:
+            processed = list(
+                pool.map(lambda record: process_record(record, verifier), scheduled)
+            )
+    artifacts = [None] * len(records)
+    for i, artifact in zip(order, processed):
+        artifacts[i] = artifact
+    return artifacts
+
+
+def start_invocation(context):
+    """Apply the settings for a Lambda invocation."""
+    structured_log.sample_invocation()
+    MozSignedObject.set_verbose()
+    MozSignedObject.set_verdict_cache()
+    MozSignedObjectViaLambda.set_memory_limit(
+        getattr(context, "memory_limit_in_mb", None)
+    )
+    MozSignedObjectViaLambda.set_deadline(context)
+
+
+def check_records(records, pipelined=False):
+    """Process S3 event records, batching the notifications they cause.
+
+    :param pipelined: process them as a pipeline (see
+        ``aio.process_records()``), rather than with ``RECORD_WORKERS``
+        threads
+    :returns list: the artifacts, in the same order as `records`
+    """
+    dispatcher = sns_dispatcher.SNSDispatcher(
+        os.environ.get("SNSARN", ""),
+        collapse_after=int_from_environment(
+            "SNS_COLLAPSE_AFTER", sns_dispatcher.DEFAULT_COLLAPSE_AFTER
+        ),
+    )
+    # the dispatcher is this invocation's alone
+    from fx_sig_verify.verifier import Verifier
+
+    verifier = Verifier.from_class_settings(
+        MozSignedObjectViaLambda, dispatcher=dispatcher
+    )
+    try:
+        if pipelined:
+            from fx_sig_verify import aio
+
+            return aio.run(aio.process_records(records, verifier))
+        return process_records(records, record_workers(), verifier)
+    finally:
+        # publish failures are reported in the results
+        dispatcher.flush()
+
+
+def requeue(records):
+    """Send deferred `records` to ``DEFERRED_QUEUE_URL``, if it's set.
+
+    Each is sent as an S3 notification of its own, for ``sqs_handler``.
+
+    :returns bool: True if they were all sent
+    """
+    queue_url = os.environ.get("DEFERRED_QUEUE_URL")
+    if not queue_url:
+        return False
+    entries = [
+        {
+            "Id": str(i),
+            "MessageBody": json.dumps(
+                {"Records": [event_decoder.to_s3_event_record(record)]}
+            ),
+        }
+        for i, record in enumerate(records)
+    ]
+    try:
+        client = aws_clients.client("sqs")
+        for start in range(0, len(entries), 10):
+            response = client.send_message_batch(
+                QueueUrl=queue_url, Entries=entries[start : start + 10]
+            )
+            if response.get("Failed"):
+                warning("requeue failed: %s", response["Failed"])
+                return False
+    except Exception as e:
+        warning("requeue failed: %r", e)
+        return False
+    return True
+
+
+def log_response(response):
+    if metrics.enabled():
+        # per record metrics, for CloudWatch to extract
+        for result in response.get("results", []):
+            structured_log.write(structured_log.dumps(metrics.emf_record(result)))
+    # always output response to CloudWatch (issue #17)
+    # in json format. It needs to be sent to stdout, as one line (with as
+    # much of the input event as configured)
+    structured_log.write(structured_log.response_line(response))
+
+    # make best effort to get debug info. seems to get lost in container
+    # version of lambda
+    import sys
 
-@trace_xray_subsegment()
-def lambda_handler(event, context):
+    sys.stderr.flush()
+    sys.stdout.flush()
+
+
+@tracing.traced()
+def lambda_handler(event, context, pipelined=False):
     """The main entry point when this package is installed as an AWS Lambda
     Function.
 
@@ -564,72 +1508,95 @@ def lambda_handler(event, context):
 
     :param event: a JSON formatted string as described in the AWS Documentation
     :param context: an AWS data structure we do not use.
+    :param pipelined: see ``check_records()``
 
     :returns result: a JSON formatted representation of the action taken. While
                      the AWS lambda interface does not require a return,
                      providing one makes testing and other use cases simpler
     """
-    MozSignedObject.set_verbose()
+    start_invocation(context)
     response = {
         "version": fx_sig_verify.__version__,
         "input_event": event,
         "request_id": context.aws_request_id,
     }
-    results = []
-    had_S3_error = False
-    for record in unpacked_s3_events(event, response):
-        artifact = artifact_to_check_via_s3(record)
-        try:
-            valid_sig = False
-            try:
-                valid_sig = artifact.process_one_s3_file()
-                debug(f"after process 1 {valid_sig}")
-            except SigVerifyNonMozSignature as e:
-                msg = "non-moz signature"
-                debug(msg)
-                artifact.send_sns(msg, e)
-            except SigVerifyTooBig as e:
-                # send SNS of program failure
-                msg = "data failure"
-                debug(msg)
-                artifact.send_sns(msg, e)
-            except SigVerifyNoSignature as e:
-                msg = "exe without sig"
-                debug(msg)
-                artifact.send_sns(msg, e)
-            except SigVerifyBadSignature as e:
-                # send SNS of bad binary uploaded
-                msg = "bad sig"
-                debug(msg)
-                artifact.send_sns(msg, e)
-            except SigVerifyException as e:
-                msg = "unclassified error"
-                debug(msg)
-                artifact.send_sns(msg, e)
-            except (Exception) as e:
-                # uncaught by me program failure
-                msg = "app failure: " + str(type(e).__name__) + str(repr(e))
-                debug(msg)
-                artifact.send_sns(msg, e)
-        except (Exception) as e:
-            # double exception, should already have a message
-            artifact.add_error(f"app failure 2: {str(e)}")
-        artifact.report_validity()
-        results.append(artifact.summary())
-        had_S3_error = any((had_S3_error, artifact.had_s3_error))
+    decoder = event_decoder.EventDecoder()
+    duplicates = event_dedup.DuplicateFilter()
+    records = [r for r in decoder.records(event) if duplicates.is_new(r)]
+    if decoder.sns_unpacked:
+        response["unpacker"] = "SNS message unpacked"
+    if decoder.error_count:
+        # the rest of the event is still processed
+        response["errors"] = [f"bad record {e.path}: {e.error}" for e in decoder.errors]
+        response["error_count"] = decoder.error_count
+    with profiling.profile_from_environment(context.aws_request_id):
+        artifacts = check_records(records, pipelined)
+    duplicates.remember(records, artifacts)
+    results = [artifact.summary() for artifact in artifacts]
+    had_S3_error = any(artifact.had_s3_error for artifact in artifacts)
+    deferred = [r for r, artifact in zip(records, artifacts) if artifact.deferred]
     response["results"] = results
-    # always output response to CloudWatch (issue #17)
-    # in json format. It needs to be sent to stdout
-    print(json.dumps(response))
-
-    # make best effort to get debug info. seems to get lost in container
-    # version of lambda
-    import sys
-
-    sys.stderr.flush()
-    sys.stdout.flush()
+    response["duplicates"] = duplicates.dropped
+    if deferred:
+        response["deferred"] = len(deferred)
+        response["requeued"] = requeue(deferred)
+    log_response(response)
 
     # AWS will retry for us if we fail. So let's do that on an S3 error.
     if had_S3_error:
         raise OSError("S3 error, try again")
+    # the finished records are remembered, so only the rest are retried
+    if deferred and not response["requeued"]:
+        raise OSError("Out of time, try again")
     return response
+
+
+@tracing.traced()
+def sqs_handler(event, context):
+    """The entry point when invoked by an SQS event source mapping.
+
+    Unlike ``lambda_handler``, an S3 error doesn't fail the invocation.
+    Instead, the messages naming objects we couldn't retrieve are listed
+    in ``batchItemFailures``, so only they are delivered again. The event
+    source mapping must have ``ReportBatchItemFailures`` enabled.
+
+    :param event: a batch of SQS messages, each holding S3 event records
+    :param context: the Lambda context
+
+    :returns dict: with the ``batchItemFailures``, and our ``results``
+    """
+    start_invocation(context)
+    response = {
+        "version": fx_sig_verify.__version__,
+        "input_event": event,
+        "request_id": context.aws_request_id,
+    }
+    decoder = event_decoder.EventDecoder()
+    duplicates = event_dedup.DuplicateFilter()
+    records = [r for r in decoder.records(event) if duplicates.is_new(r)]
+    failed = []
+    if decoder.error_count:
+        response["errors"] = [
+            f"bad message {e.message_id}: {e.path}: {e.error}" for e in decoder.errors
+        ]
+        response["error_count"] = decoder.error_count
+        # leave them for the queue's redrive policy (dead letter queue)
+        failed.extend(e.message_id for e in decoder.errors if e.message_id)
+    with profiling.profile_from_environment(context.aws_request_id):
+        artifacts = check_records(records)
+    duplicates.remember(records, artifacts)
+    deferred = 0
+    for record, artifact in zip(records, artifacts):
+        deferred += artifact.deferred
+        if artifact.needs_retry and record.message_id not in failed:
+            failed.append(record.message_id)
+    response["results"] = [artifact.summary() for artifact in artifacts]
+    response["duplicates"] = duplicates.dropped
+    if deferred:
+        response["deferred"] = deferred
+    response["batchItemFailures"] = [{"itemIdentifier": i} for i in failed]
+    log_response(response)
+    return {
+        "batchItemFailures": response["batchItemFailures"],
+        "results": response["results"],
+    }
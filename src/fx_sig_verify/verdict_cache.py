@@ -0,0 +1,277 @@
+"""
+Cache of verification verdicts, keyed by content.
+
+The same bytes get verified over and over: Lambda retries after an S3 error,
+candidates are copied to releases, and SNS re-delivers events. A verdict is
+a pure function of the bytes and of the certificates we trust, so it can be
+cached by content hash (or S3 ETag & size), as long as the trusted
+certificates are part of the entry.
+
+Backends:
+    - ``SQLiteVerdictCache`` for the command line (``--cache FILE``)
+    - ``DynamoDBVerdictCache`` for Lambda, shared across containers
+    - ``MemoryVerdictCache`` for a single process (and testing)
+
+The Lambda function picks a backend from the ``VERDICT_CACHE`` environment
+variable, e.g. ``sqlite:///tmp/verdicts.db`` or ``dynamodb://table-name``.
+"""
+
+from collections import OrderedDict, namedtuple
+import copy
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from fx_sig_verify import aws_clients
+
+# environment variable naming the cache to use, if any
+CACHE_ENV = "VERDICT_CACHE"
+# how long a verdict is good for
+DEFAULT_TTL = 7 * 24 * 60 * 60
+DEFAULT_MAX_ENTRIES = 10000
+
+Verdict = namedtuple("Verdict", ["status", "results", "created"])
+
+
+def s3_key(etag, size):
+    """Cache key for an S3 object.
+
+    :param etag: the object's ETag (quotes are ignored)
+    :param size: the object's size in bytes
+    """
+    if not etag or size is None:
+        return None
+    return "etag:{}:{}".format(etag.strip('"'), int(size))
+
+
+def sha256_key(hexdigest):
+    """Cache key for content with a known SHA-256."""
+    return content_key("sha256", hexdigest)
+
+
+def content_key(algorithm, hexdigest):
+    """Cache key for content with a known `algorithm` (hashlib name) digest."""
+    return f"{algorithm}:{hexdigest}"
+
+
+def sha256_file(fileobj, chunk_size=1024 * 1024):
+    """SHA-256 of a file's contents, leaving it positioned at the start."""
+    hasher = hashlib.sha256()
+    fileobj.seek(0, 0)
+    for chunk in iter(lambda: fileobj.read(chunk_size), b""):
+        hasher.update(chunk)
+    fileobj.seek(0, 0)
+    return hasher.hexdigest()
+
+
+def trust_fingerprint(valid_certs):
+    """Identify a set of trusted certificates.
+
+    Verdicts made with different trusted certificates don't match, so a cert
+    rotation invalidates the cache.
+    """
+    text = ",".join(str(serial) for serial in sorted(valid_certs))
+    return hashlib.sha256(text.encode()).hexdigest()[:16]
+
+
+class VerdictCache:
+    """Interface for the verdict caches.
+
+    Args:
+        ttl (int): seconds a verdict remains valid
+        fingerprint (str): see ``trust_fingerprint()``
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL, fingerprint=""):
+        self.ttl = ttl
+        self.fingerprint = fingerprint
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return the Verdict for `key`, or None."""
+        if key is None:
+            return None
+        found = self._get(self._full_key(key))
+        if found is None or found.created + self.ttl < time.time():
+            self.misses += 1
+            return None
+        self.hits += 1
+        return found
+
+    def put(self, key, status, results=()):
+        """Record the verdict for `key`."""
+        if key is None:
+            return
+        self._put(self._full_key(key), Verdict(status, list(results), time.time()))
+
+    def with_fingerprint(self, fingerprint):
+        """This cache, seen with another trust fingerprint.
+
+        The storage is shared; the hit & miss counts aren't.
+        """
+        if fingerprint == self.fingerprint:
+            return self
+        view = copy.copy(self)
+        view.fingerprint = fingerprint
+        view.hits = view.misses = 0
+        return view
+
+    def _full_key(self, key):
+        return f"{self.fingerprint}:{key}" if self.fingerprint else key
+
+    def _get(self, key):
+        raise NotImplementedError
+
+    def _put(self, key, verdict):
+        raise NotImplementedError
+
+
+class MemoryVerdictCache(VerdictCache):
+    """Least recently used cache in process memory."""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, **kwargs):
+        super().__init__(**kwargs)
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        with self._lock:
+            verdict = self._entries.get(key)
+            if verdict is not None:
+                self._entries.move_to_end(key)
+            return verdict
+
+    def _put(self, key, verdict):
+        with self._lock:
+            self._entries[key] = verdict
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class SQLiteVerdictCache(VerdictCache):
+    """Cache in a local SQLite database file."""
+
+    def __init__(self, path, max_entries=DEFAULT_MAX_ENTRIES, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS verdicts ("
+                " cache_key TEXT PRIMARY KEY,"
+                " status TEXT NOT NULL,"
+                " results TEXT NOT NULL,"
+                " created REAL NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS verdicts_created ON verdicts (created)"
+            )
+
+    def _get(self, key):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT status, results, created FROM verdicts WHERE cache_key = ?",
+                (key,),
+            ).fetchone()
+        if row is None:
+            return None
+        return Verdict(row[0], json.loads(row[1]), row[2])
+
+    def _put(self, key, verdict):
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO verdicts VALUES (?, ?, ?, ?)",
+                (key, verdict.status, json.dumps(verdict.results), verdict.created),
+            )
+            self._evict()
+
+    def _evict(self):
+        self._db.execute(
+            "DELETE FROM verdicts WHERE created < ?", (time.time() - self.ttl,)
+        )
+        self._db.execute(
+            "DELETE FROM verdicts WHERE cache_key IN ("
+            " SELECT cache_key FROM verdicts ORDER BY created DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def close(self):
+        self._db.close()
+
+
+class DynamoDBVerdictCache(VerdictCache):
+    """Cache in a DynamoDB table, shared by all Lambda containers.
+
+    The table needs a string hash key named ``cache_key``. Enable DynamoDB's
+    TTL on the ``expires`` attribute to have old entries removed.
+    """
+
+    def __init__(self, table_name, client=None, **kwargs):
+        super().__init__(**kwargs)
+        self.table_name = table_name
+        self.client = client or aws_clients.client("dynamodb")
+
+    def _get(self, key):
+        item = self.client.get_item(
+            TableName=self.table_name, Key={"cache_key": {"S": key}}
+        ).get("Item")
+        if not item:
+            return None
+        return Verdict(
+            item["status"]["S"],
+            json.loads(item["results"]["S"]),
+            float(item["created"]["N"]),
+        )
+
+    def _put(self, key, verdict):
+        self.client.put_item(
+            TableName=self.table_name,
+            Item={
+                "cache_key": {"S": key},
+                "status": {"S": verdict.status},
+                "results": {"S": json.dumps(verdict.results)},
+                "created": {"N": repr(verdict.created)},
+                "expires": {"N": str(int(verdict.created + self.ttl))},
+            },
+        )
+
+
+def cache_from_url(url, **kwargs):
+    """Create the cache described by `url`.
+
+    :param url: ``sqlite:///path/to/file``, ``dynamodb://table``, or
+        ``memory:``
+    """
+    if url.startswith("sqlite://"):
+        return SQLiteVerdictCache(url[len("sqlite://") :], **kwargs)
+    if url.startswith("dynamodb://"):
+        return DynamoDBVerdictCache(url[len("dynamodb://") :], **kwargs)
+    if url.startswith("memory:"):
+        return MemoryVerdictCache(**kwargs)
+    raise ValueError(f"Unknown verdict cache '{url}'")
+
+
+_environment_cache = (None, None)
+
+
+def cache_from_environment(**kwargs):
+    """Return the cache named by ``VERDICT_CACHE``, or None.
+
+    The cache is reused across (warm) invocations while the setting is
+    unchanged.
+    """
+    global _environment_cache
+    url = os.environ.get(CACHE_ENV, "").strip()
+    if not url:
+        return None
+    if _environment_cache[0] != url:
+        _environment_cache = (url, cache_from_url(url, **kwargs))
+    return _environment_cache[1]
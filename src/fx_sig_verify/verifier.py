@@ -0,0 +1,299 @@
+"""
+Library API: verify files, bytes, or S3 objects.
+
+A ``Verifier`` holds all its configuration -- the certificates it trusts,
+whether production criteria apply, its verdict cache, AWS clients, and (for
+Lambda) the deadline -- and never changes it, so one verifier can be used
+from many threads at once, and several differently configured verifiers can
+coexist in a process::
+
+    verifier = Verifier(verdict_cache="sqlite:///tmp/verdicts.db")
+    with ThreadPoolExecutor() as pool:
+        for artifact in pool.map(verifier.verify_path, paths):
+            print(artifact.summary())
+
+Each call makes an artifact (``MozSignedObject`` subclass) to hold the state
+of that one verification, and returns it once checked. The artifacts take
+all their settings from their verifier. Created without one, they use a
+verifier with the settings of their class (``set_verbose()`` & co), as
+the Lambda and command line entry points always have.
+
+No notifications are sent: that's up to the caller.
+"""
+
+import hashlib
+
+from fx_sig_verify import aws_clients
+from fx_sig_verify import manifest
+from fx_sig_verify import pe_digest
+from fx_sig_verify import validate_moz_signature
+from fx_sig_verify import verdict_cache as verdict_caches
+from fx_sig_verify.validate_moz_signature import (
+    DOWNLOAD_CHUNK_SIZE,
+    BytesIOWithName,
+    MozSignedObject,
+    MozSignedObjectViaLambda,
+    SigVerifyException,
+)
+
+
+class Verifier:
+    """Verify executables, with this configuration.
+
+    Args:
+        valid_certs: serial numbers of the signing certificates to accept,
+            default ``VALID_CERTS``
+        production_criteria (bool): only check production artifacts (see
+            ``MozSignedObject.should_validate()``)
+        verbose (int): as ``VERBOSE``
+        verdict_cache: a ``verdict_cache.VerdictCache``, or the URL of one
+            (see ``verdict_cache.cache_from_url()``); a cache shared with
+            verifiers trusting other certificates keeps their verdicts apart
+        clients (dict): AWS client to use per service name, default the
+            shared ones in ``aws_clients``
+        topic_arn (str): SNS topic for notifications, default ``SNSARN``
+        deadline (float): ``time.time()`` by which to have finished
+        memory_limit_mb (int): memory available, to size in-memory buffers
+        dispatcher: ``sns_dispatcher.SNSDispatcher`` to queue notifications
+            with, None to publish each immediately
+    """
+
+    def __init__(
+        self,
+        valid_certs=None,
+        production_criteria=True,
+        verbose=0,
+        verdict_cache=None,
+        clients=None,
+        topic_arn=None,
+        deadline=None,
+        memory_limit_mb=None,
+        dispatcher=None,
+    ):
+        if valid_certs is None:
+            valid_certs = validate_moz_signature.VALID_CERTS
+        self.valid_certs = frozenset(valid_certs)
+        self.production_criteria = production_criteria
+        self.verbose = verbose
+        fingerprint = verdict_caches.trust_fingerprint(self.valid_certs)
+        if isinstance(verdict_cache, str):
+            verdict_cache = verdict_caches.cache_from_url(
+                verdict_cache, fingerprint=fingerprint
+            )
+        elif verdict_cache is not None:
+            verdict_cache = verdict_cache.with_fingerprint(fingerprint)
+        self.verdict_cache = verdict_cache
+        self.clients = dict(clients or {})
+        self.topic_arn = topic_arn
+        self.deadline = deadline
+        self.memory_limit_mb = memory_limit_mb
+        self.dispatcher = dispatcher
+
+    @classmethod
+    def from_class_settings(cls, artifact_class=MozSignedObject, **overrides):
+        """A verifier configured as `artifact_class` is, by its class
+        attributes."""
+        settings = {
+            "production_criteria": artifact_class.production_criteria,
+            "verbose": artifact_class.verbose,
+            "verdict_cache": artifact_class.verdict_cache,
+        }
+        for name in ("deadline", "memory_limit_mb", "dispatcher"):
+            if hasattr(artifact_class, name):
+                settings[name] = getattr(artifact_class, name)
+        settings.update(overrides)
+        return cls(**settings)
+
+    def client(self, service_name):
+        """The AWS client this verifier uses for `service_name`."""
+        found = self.clients.get(service_name)
+        return found if found is not None else aws_clients.client(service_name)
+
+    def verify_path(self, path, digest=None):
+        """Verify the local file at `path`.
+
+        :param digest: (algorithm, hexdigest) of the contents, from a
+            release manifest; the file fails if it doesn't match
+        :returns: the checked artifact, see its ``get_status()`` and
+            ``summary()``
+        """
+        artifact = MozSignedFile(path, verifier=self, digest=digest)
+        try:
+            artifact.process_one_local_file()
+        except SigVerifyException:
+            pass
+        return artifact
+
+    def verify_bytes(self, data, name="<bytes>"):
+        """Verify the executable in `data`.
+
+        :returns: the checked artifact
+        """
+        artifact = MozSignedBytes(data, name, verifier=self)
+        artifact.process()
+        return artifact
+
+    def verify_s3(self, bucket, key, etag=None, size=None):
+        """Verify the S3 object `key` in `bucket`.
+
+        :param etag: the object's ETag, if known
+        :param size: the object's size, if known
+        :returns MozSignedObjectViaLambda: the checked artifact. Check
+            ``needs_retry`` for failures to retrieve it.
+        """
+        artifact = MozSignedObjectViaLambda(
+            bucket, key, etag=etag, size=size, verifier=self
+        )
+        artifact.process_one_s3_file()
+        return artifact
+
+
+class MozSignedBytes(MozSignedObject):
+    """An executable already in memory."""
+
+    def __init__(self, data, name, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.data = data
+        self.artifact_name = name
+        self.sha256 = None
+
+    def get_flo(self):
+        return BytesIOWithName(self.data, original_name=self.artifact_name)
+
+    def cache_key(self):
+        if self.sha256 is None:
+            self.sha256 = hashlib.sha256(self.data).hexdigest()
+        return verdict_caches.sha256_key(self.sha256)
+
+    def summary(self):
+        return {
+            "name": self.artifact_name,
+            "status": self.get_status(),
+            "results": self.errors + self.messages,
+        }
+
+    def report_validity(self, valid=None):
+        pass
+
+    def process(self):
+        try:
+            valid = self.check_exe_cached()
+        except SigVerifyException:
+            valid = False
+        except Exception as e:
+            valid = False
+            self.add_failure(e)
+        self.set_status("pass" if valid else "fail")
+        return valid
+
+
+class MozSignedFile(MozSignedObject):
+    """A local file.
+
+    Args:
+        fname (str): its path
+        digest: (algorithm, hexdigest) its contents should have, e.g. from
+            a release manifest; it fails if they don't
+    """
+
+    def __init__(self, fname=None, *args, digest=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.artifact_name = fname
+        self.url = "file://{}".format(fname)
+        self.sha256 = None
+        self.digest = digest
+        # whether the contents have been found to match it
+        self.digest_checked = False
+
+    def get_location(self):
+        "For S3, we need the bucket & key names"
+        return self.bucket, self.key
+
+    def report_validity(self, valid):
+        """
+        For invoked cli functions, we have 2 report channels:
+            1. print to stdout
+            2. exit code
+
+        The severity of any failure controls the what & where.
+        Any filtering or special casing should probably be applied in this
+        function. (E.g. excluding any artifacts from rules.)
+        """
+        if self.verbose:
+            print(self.format_message())
+
+    def summary(self):
+        json_info = {
+            "bucket": None,
+            "key": self.artifact_name,
+            "status": self.get_status(),
+            "results": self.errors + self.messages,
+            "cached": self.cache_hit,
+            "verdict": self.verdict(),
+            "timings": self.timings_ms(),
+        }
+        return json_info
+
+    def get_flo(self):
+        flo = open(self.artifact_name, "rb")
+        if self.digest is not None and not self.digest_checked:
+            try:
+                self.check_manifest_digest(flo)
+            except BaseException:
+                flo.close()
+                raise
+        return flo
+
+    def check_manifest_digest(self, flo):
+        """Confirm the contents match the manifest, computing the PE digest
+        (for check_digest) in the same pass.
+
+        :raises manifest.ManifestMismatch: if they don't
+        """
+        algorithm, expected = self.digest
+        hasher = hashlib.new(algorithm)
+        self.digester = pe_digest.PEDigester()
+        for chunk in iter(lambda: flo.read(DOWNLOAD_CHUNK_SIZE), b""):
+            hasher.update(chunk)
+            self.update_digester(chunk)
+        flo.seek(0, 0)
+        if hasher.hexdigest() != expected:
+            raise manifest.ManifestMismatch(
+                "{} of {} doesn't match the manifest".format(
+                    algorithm, self.artifact_name
+                )
+            )
+        self.digest_checked = True
+
+    def cache_key(self):
+        if self.digest is not None:
+            # verdicts are remembered against the manifest's digest, so
+            # the file has to be read to know it's still what was verified
+            if not self.digest_checked:
+                with open(self.artifact_name, "rb") as flo:
+                    self.check_manifest_digest(flo)
+            return verdict_caches.content_key(*self.digest)
+        if self.sha256 is None:
+            with self.get_flo() as flo:
+                self.sha256 = verdict_caches.sha256_file(flo)
+        return verdict_caches.sha256_key(self.sha256)
+
+    def process_one_local_file(self):
+        if self.verbose:
+            print("Processing {}".format(self.artifact_name))
+        try:
+            valid_sig = self.check_exe_cached()
+        except Exception as e:
+            valid_sig = False
+            if isinstance(e, SigVerifyException):
+                # reason already recorded
+                pass
+            else:
+                self.add_failure(e)
+        self.set_status("pass" if valid_sig else "fail")
+        return valid_sig
+
+    def add_failure(self, e):
+        self.add_error(
+            "failed to process local file {} '{}'".format(self.artifact_name, repr(e))
+        )
@@ -16,3 +16,23 @@ def setup_environment_for_moto():
 def clear_environment():
     """ Reset verbosity before each suite """
     utils.zero_verbose()
+
+
+@pytest.fixture(autouse=True)
+def fresh_aws_clients():
+    """ Clients are cached, don't carry them from one mock to the next """
+    from fx_sig_verify.aws_clients import reset_clients
+
+    reset_clients()
+    yield
+    reset_clients()
+
+
+@pytest.fixture(autouse=True)
+def forget_recent_records():
+    """ Records seen by one test mustn't be dropped as duplicates in another """
+    from fx_sig_verify.event_dedup import recent_records
+
+    recent_records.clear()
+    yield
+    recent_records.clear()
@@ -0,0 +1,126 @@
+# The asyncio API runs osslsigncode without blocking, and the pipelined
+# handler downloads the next record while the current one is verified.
+
+import asyncio
+import os
+import time
+
+from moto import mock_s3, mock_sns, mock_sqs
+import pytest
+import tests.utils as u
+
+from fx_sig_verify import aio
+from fx_sig_verify.aio import AsyncVerifier
+from fx_sig_verify.validate_moz_signature import (
+    DEADLINE_RESERVE,
+    MozSignedObject,
+)
+from fx_sig_verify.verifier import Verifier
+
+GOOD = "32bit.exe"
+NON_MOZ = "signtool.exe"
+
+
+@pytest.fixture(autouse=True)
+def reset_after_test():
+    yield
+    MozSignedObject.production_criteria = True
+
+
+@pytest.fixture
+def osslsigncode(tmp_path, monkeypatch):
+    """Put a stand-in osslsigncode, taking `seconds`, first on the PATH."""
+
+    def install(seconds=0, exit_code=0):
+        script = tmp_path / "osslsigncode"
+        script.write_text(
+            f"#!/bin/sh\n[ {exit_code} = 0 ] || exit {exit_code}\nexec sleep {seconds}\n"
+        )
+        script.chmod(0o755)
+        monkeypatch.setenv("PATH", f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+
+    return install
+
+
+@pytest.fixture
+def aws():
+    with mock_s3(), mock_sns(), mock_sqs():
+        u.setup_aws_mocks()
+        bucket = u.create_bucket()
+        u.zero_production()
+        yield bucket
+
+
+def test_verify_paths_concurrently(osslsigncode):
+    # GIVEN: osslsigncode takes a while
+    osslsigncode(seconds=0.5)
+    verifier = AsyncVerifier(Verifier(production_criteria=False))
+    paths = [os.path.join("tests/data", name) for name in (GOOD, GOOD, NON_MOZ)]
+
+    async def verify_all():
+        return await asyncio.gather(*map(verifier.verify_path, paths))
+
+    # WHEN: files are verified at once
+    start = time.perf_counter()
+    artifacts = aio.run(verify_all())
+    elapsed = time.perf_counter() - start
+    # THEN: the checks overlapped, and each got its own verdict
+    assert elapsed < 0.9
+    assert [a.get_status() for a in artifacts] == ["pass", "pass", "fail"]
+    assert artifacts[2].failure_class() == "SigVerifyNonMozSignature"
+    assert "verify" in artifacts[0].timings
+
+
+def test_verifier_failure(osslsigncode):
+    # GIVEN: osslsigncode rejects the file
+    osslsigncode(exit_code=1)
+    verifier = AsyncVerifier(Verifier(production_criteria=False))
+    # WHEN: it's verified
+    artifact = aio.run(verifier.verify_path(os.path.join("tests/data", GOOD)))
+    # THEN: it fails as it does when verified synchronously
+    assert artifact.get_status() == "fail"
+    assert artifact.failure_class() == "SigVerifyNoSignature"
+
+
+def test_verifier_killed_at_deadline(osslsigncode, aws):
+    # GIVEN: osslsigncode would take longer than the invocation has left
+    osslsigncode(seconds=10)
+    _, key = u.upload_file(aws, GOOD)
+    deadline = time.time() + DEADLINE_RESERVE + 1.5
+    verifier = AsyncVerifier(Verifier(production_criteria=False, deadline=deadline))
+    # WHEN: the object is verified
+    start = time.perf_counter()
+    artifact = aio.run(verifier.verify_s3(u.bucket_name, key))
+    # THEN: it's deferred in time, without a verdict
+    assert time.perf_counter() - start < 3
+    assert artifact.get_status() == "deferred"
+    assert artifact.needs_retry
+
+
+def test_pipeline_overlaps_stages(osslsigncode, aws, monkeypatch):
+    # GIVEN: an event with several records, and a slow osslsigncode
+    osslsigncode(seconds=0.3)
+    keys = [u.upload_file(aws, GOOD, f"firefox-{i}.exe")[1] for i in range(3)]
+    event = {"Records": [u.build_event(u.bucket_name, k)["Records"][0] for k in keys]}
+    log = []
+    prepare, verify = aio.prepare, aio.verify
+
+    def logged_prepare(artifact, screen=False):
+        log.append(("download", artifact.key_name))
+        return prepare(artifact, screen)
+
+    async def logged_verify(artifact, objf):
+        log.append(("verify", artifact.key_name))
+        await verify(artifact, objf)
+        log.append(("verified", artifact.key_name))
+
+    monkeypatch.setattr(aio, "prepare", logged_prepare)
+    monkeypatch.setattr(aio, "verify", logged_verify)
+    # WHEN: the pipelined handler processes it
+    response = aio.lambda_handler(event, u.dummy_context)
+    # THEN: each record was downloaded before the one before was verified
+    for previous, key in zip(keys, keys[1:]):
+        assert log.index(("download", key)) < log.index(("verified", previous))
+        assert log.index(("verified", previous)) < log.index(("verify", key))
+    assert [r["key"] for r in response["results"]] == keys
+    assert all(r["status"] == "pass" for r in response["results"])
@@ -0,0 +1,176 @@
+# A backfill verifies the production objects under a prefix, without GETting
+# the others, and an interrupted one resumes from its checkpoint.
+
+import json
+import os
+
+import boto3
+from moto import mock_s3
+import pytest
+import tests.utils as u
+
+from fx_sig_verify.backfill import (
+    Backfill,
+    Checkpoint,
+    CheckpointMismatch,
+    main,
+)
+from fx_sig_verify.verifier import Verifier
+
+INSTALLERS = [f"pub/firefox/releases/1.0/Firefox Setup {i}.exe" for i in range(6)]
+EXCLUDED = [
+    "pub/firefox/releases/1.0/SHA256SUMS.txt",
+    "pub/firefox/try-builds/Firefox Setup.exe",
+]
+HEADER = {"bucket": u.bucket_name, "prefix": "pub/", "trust": "t"}
+
+
+@pytest.fixture
+def osslsigncode(tmp_path, monkeypatch):
+    """Put a stand-in osslsigncode, which passes everything, first on the PATH."""
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    script = bin_dir / "osslsigncode"
+    script.write_text("#!/bin/sh\nexit 0\n")
+    script.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+
+
+@pytest.fixture
+def bucket(osslsigncode):
+    with mock_s3():
+        bucket = u.create_bucket()
+        for key in INSTALLERS + EXCLUDED:
+            u.upload_file(bucket, "32bit.exe", key)
+        yield bucket
+
+
+@pytest.fixture
+def verifier(bucket):
+    """A Verifier, with the keys it GETs in .gets."""
+    s3 = boto3.client("s3")
+    gets = []
+    s3.meta.events.register(
+        "provide-client-params.s3.GetObject",
+        lambda params, **_: gets.append(params["Key"]),
+    )
+    verifier = Verifier(clients={"s3": s3})
+    verifier.gets = gets
+    return verifier
+
+
+def run(verifier, path, **kwargs):
+    checkpoint = Checkpoint(str(path), HEADER)
+    try:
+        return Backfill(
+            u.bucket_name, "pub/", verifier, checkpoint, workers=3, **kwargs
+        ).run()
+    finally:
+        checkpoint.close()
+
+
+def test_backfill(verifier, tmp_path):
+    # GIVEN: installers and files production doesn't check
+    # WHEN: they're backfilled
+    totals = run(verifier, tmp_path / "ckpt")
+    # THEN: just the installers are verified
+    assert totals["pass"] == len(INSTALLERS)
+    assert totals["excluded"] == len(EXCLUDED)
+    assert set(verifier.gets) == set(INSTALLERS)
+
+
+def test_resume(verifier, tmp_path):
+    # GIVEN: a backfill which was interrupted
+    path = tmp_path / "ckpt"
+    first = run(verifier, path, max_objects=4)
+    verified = set(verifier.gets)
+    verifier.gets.clear()
+    # WHEN: it's resumed
+    second = run(verifier, path)
+    # THEN: the rest are verified, and nothing twice
+    assert first["pass"] == 4
+    assert second["pass"] == len(INSTALLERS) - 4
+    assert not verified & set(verifier.gets)
+    checkpoint = Checkpoint(str(path), HEADER)
+    checkpoint.close()
+    assert checkpoint.verdicts == {key: "pass" for key in INSTALLERS}
+    assert checkpoint.last_key == max(INSTALLERS + EXCLUDED)
+
+
+def test_retry_on_resume(verifier, tmp_path):
+    # GIVEN: a checkpoint of a backfill which had an S3 error
+    path = tmp_path / "ckpt"
+    run(verifier, path)
+    with open(path, "a") as f:
+        f.write(json.dumps({"key": INSTALLERS[2], "verdict": "retry"}) + "\n")
+        # and was killed mid-write
+        f.write('{"key": "pub/')
+    verifier.gets.clear()
+    # WHEN: it's resumed
+    totals = run(verifier, path)
+    # THEN: just that object is verified again
+    assert set(verifier.gets) == {INSTALLERS[2]}
+    assert totals["pass"] == 1
+
+
+def test_resume_twice_after_torn_write(verifier, tmp_path):
+    # GIVEN: a checkpoint of a backfill which was killed mid-write
+    path = tmp_path / "ckpt"
+    run(verifier, path, max_objects=2)
+    with open(path, "a") as f:
+        f.write('{"key": "pub/')
+    # WHEN: it's resumed, interrupted again, and resumed again
+    run(verifier, path, max_objects=2)
+    verifier.gets.clear()
+    totals = run(verifier, path)
+    # THEN: the checkpoint can still be read, and the rest are verified
+    assert totals["pass"] == len(INSTALLERS) - 4
+    assert len(set(verifier.gets)) == len(INSTALLERS) - 4
+    checkpoint = Checkpoint(str(path), HEADER)
+    checkpoint.close()
+    assert checkpoint.verdicts == {key: "pass" for key in INSTALLERS}
+
+
+def test_retry_after_unfinished_key(verifier, tmp_path):
+    # GIVEN: a checkpoint with a retry, and keys before it not yet verified
+    path = tmp_path / "ckpt"
+    checkpoint = Checkpoint(str(path), HEADER)
+    checkpoint.record(INSTALLERS[-1], "retry")
+    checkpoint.close()
+    # WHEN: it's resumed, but interrupted after the retry
+    first = run(verifier, path, max_objects=1)
+    # THEN: the checkpoint isn't advanced past the keys before it
+    checkpoint = Checkpoint(str(path), HEADER)
+    checkpoint.close()
+    assert checkpoint.last_key is None
+    # AND: they're verified when it's resumed again
+    verifier.gets.clear()
+    second = run(verifier, path)
+    assert first["pass"] == 1
+    assert second["pass"] == len(INSTALLERS) - 1
+    assert set(verifier.gets) == set(INSTALLERS[:-1])
+
+
+def test_checkpoint_of_another_backfill(tmp_path):
+    path = str(tmp_path / "ckpt")
+    Checkpoint(path, HEADER).close()
+    with pytest.raises(CheckpointMismatch):
+        Checkpoint(path, dict(HEADER, trust="rotated"))
+
+
+def test_main(bucket, tmp_path, capsys):
+    # GIVEN: the objects under a prefix
+    args = ["--checkpoint", str(tmp_path / "ckpt"), u.bucket_name, "pub/"]
+    # WHEN: they're backfilled from the command line, twice
+    with pytest.raises(SystemExit) as first:
+        main(args + ["--all"])
+    with pytest.raises(SystemExit) as second:
+        main(args)
+    # THEN: all passed, and the second run had nothing to do
+    *results, totals, again = [
+        json.loads(line) for line in capsys.readouterr().out.splitlines()
+    ]
+    assert first.value.code == second.value.code == 0
+    assert sorted(r["key"] for r in results) == INSTALLERS
+    assert totals["totals"]["pass"] == len(INSTALLERS)
+    assert "pass" not in again["totals"]
@@ -0,0 +1,81 @@
+# Events with several records have them processed concurrently, and each
+# result reported on its own.
+
+from moto import mock_s3, mock_sns, mock_sqs
+import pytest
+import tests.utils as u
+
+from fx_sig_verify import validate_moz_signature
+from fx_sig_verify.validate_moz_signature import (
+    MozSignedObject,
+    lambda_handler,
+    record_workers,
+)  # noqa: E402
+
+
+def build_multi_event(bucket_name, key_names):
+    records = []
+    for key_name in key_names:
+        records.extend(u.build_event(bucket_name, key_name)["Records"])
+    return {"Records": records}
+
+
+@pytest.fixture(autouse=True)
+def production_after_test():
+    yield
+    MozSignedObject.production_criteria = True
+
+
+@mock_s3
+@mock_sns
+@mock_sqs
+@pytest.mark.parametrize("workers", ["1", "4"])
+def test_results_in_record_order(workers, monkeypatch):
+    u.setup_aws_mocks()
+    bucket = u.create_bucket()
+    u.zero_production()
+    monkeypatch.setenv("RECORD_WORKERS", workers)
+    # GIVEN: an event naming several objects
+    key_names = []
+    for i, fname in enumerate(["signtool.exe", "vswriter.exe"] * 3):
+        _, key_name = u.upload_file(bucket, fname, f"{i}-{fname}")
+        key_names.append(key_name)
+    event = build_multi_event(u.bucket_name, key_names)
+    # WHEN: it is processed
+    response = lambda_handler(event, u.dummy_context)
+    # THEN: there is one result per record, in order
+    assert [r["key"] for r in response["results"]] == key_names
+    for result in response["results"]:
+        assert result["status"] == "fail"
+        assert "Failure reason: SigVerifyNonMozSignature" in result["results"]
+
+
+@mock_s3
+@mock_sns
+@mock_sqs
+def test_s3_error_isolated(capsys, monkeypatch):
+    monkeypatch.setattr(validate_moz_signature, "S3_MAX_WAIT", 0.5)
+    u.setup_aws_mocks()
+    bucket = u.create_bucket()
+    u.zero_production()
+    # GIVEN: an event naming an object which exists, and one which doesn't
+    _, key_name = u.upload_file(bucket, "signtool.exe", "firefox.exe")
+    event = build_multi_event(u.bucket_name, [key_name, "firefox-bogus.exe"])
+    # WHEN: it is processed
+    # THEN: the event is retried
+    with pytest.raises(IOError):
+        lambda_handler(event, u.dummy_context)
+    #  but the good object was still processed & reported
+    out, _ = capsys.readouterr()
+    assert "SigVerifyNonMozSignature" in out
+
+
+@pytest.mark.parametrize(
+    "setting, expected", [(None, 4), ("8", 8), ("0", 1), ("many", 4)]
+)
+def test_record_workers(setting, expected, monkeypatch):
+    if setting is None:
+        monkeypatch.delenv("RECORD_WORKERS", raising=False)
+    else:
+        monkeypatch.setenv("RECORD_WORKERS", setting)
+    assert record_workers() == expected
@@ -0,0 +1,137 @@
+# Records are scheduled against the Lambda deadline, and those which can't
+# finish in time are deferred rather than killed mid-flight.
+
+import json
+import subprocess
+import time
+
+import boto3
+from moto import mock_s3, mock_sns, mock_sqs
+import pytest
+import tests.utils as u
+
+from fx_sig_verify import event_decoder
+from fx_sig_verify import validate_moz_signature
+from fx_sig_verify.validate_moz_signature import (
+    DEADLINE_RESERVE,
+    MozSignedObject,
+    MozSignedObjectViaLambda,
+    lambda_handler,
+    process_records,
+    sqs_handler,
+)
+
+
+class ShortContext:
+    aws_request_id = "SHORT ID"
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def get_remaining_time_in_millis(self):
+        return self.seconds * 1000
+
+
+@pytest.fixture(autouse=True)
+def reset_after_test():
+    yield
+    MozSignedObject.production_criteria = True
+    MozSignedObjectViaLambda.deadline = None
+
+
+@pytest.fixture
+def aws():
+    with mock_s3(), mock_sns(), mock_sqs():
+        u.setup_aws_mocks()
+        bucket = u.create_bucket()
+        u.zero_production()
+        yield bucket
+
+
+def s3_record(key, size):
+    return event_decoder.S3Record(
+        u.bucket_name, key, None, size, None, "s3", None, None
+    )
+
+
+def test_smallest_first(monkeypatch):
+    started = []
+
+    def process_record(record, verifier=None):
+        started.append(record.key)
+        return record.key
+
+    monkeypatch.setattr(validate_moz_signature, "process_record", process_record)
+    # GIVEN: records of assorted (and unknown) sizes
+    records = [s3_record("big", 900), s3_record("unknown", None), s3_record("small", 5)]
+    # WHEN: they're processed
+    artifacts = process_records(records, max_workers=1)
+    # THEN: the smallest is started first, but results keep the event order
+    assert started == ["small", "big", "unknown"]
+    assert artifacts == ["big", "unknown", "small"]
+
+
+def test_not_started_near_deadline(aws):
+    _, key_name = u.upload_file(aws, "signtool.exe", "firefox.exe")
+    event = u.build_event(u.bucket_name, key_name)
+    # GIVEN: less time left than a record needs
+    context = ShortContext(DEADLINE_RESERVE + 0.5)
+    # WHEN: an event is processed
+    # THEN: it is retried
+    with pytest.raises(IOError, match="Out of time"):
+        lambda_handler(event, context)
+
+
+def test_deferred_requeued(aws, monkeypatch):
+    queue_url = boto3.client("sqs").create_queue(QueueName="deferred")["QueueUrl"]
+    monkeypatch.setenv("DEFERRED_QUEUE_URL", queue_url)
+    _, key_name = u.upload_file(aws, "signtool.exe", "firefox two.exe")
+    event = u.build_event(u.bucket_name, key_name)
+    # GIVEN: too little time to process an event
+    # WHEN: it is processed
+    response = lambda_handler(event, ShortContext(DEADLINE_RESERVE + 0.5))
+    # THEN: the record is deferred, not failed
+    [result] = response["results"]
+    assert result["status"] == "deferred"
+    assert response["deferred"] == 1 and response["requeued"]
+    #  and sent to the queue, for sqs_handler
+    [message] = boto3.client("sqs").receive_message(QueueUrl=queue_url)["Messages"]
+    decoded = list(event_decoder.EventDecoder().records(json.loads(message["Body"])))
+    assert [r.key for r in decoded] == [key_name]
+
+
+def test_verifier_timeout(aws, monkeypatch):
+    timeouts = []
+
+    def hung_run(*args, timeout=None, **kwargs):
+        timeouts.append(timeout)
+        raise subprocess.TimeoutExpired(args[0], timeout)
+
+    monkeypatch.setattr(validate_moz_signature.subprocess, "run", hung_run)
+    monkeypatch.setenv("VERIFY_TIMEOUT", "20")
+    bucket_name, key_name = u.upload_file(aws, "32bit.exe", "firefox.exe")
+    # GIVEN: osslsigncode hangs, and 15s are left before the reserve
+    MozSignedObjectViaLambda.deadline = time.time() + DEADLINE_RESERVE + 15
+    artifact = MozSignedObjectViaLambda(bucket_name, key_name)
+    # WHEN: the object is checked
+    assert not artifact.process_one_s3_file()
+    # THEN: osslsigncode had the time left, and the object was deferred
+    assert 14 < timeouts[0] <= 15
+    assert artifact.deferred and artifact.needs_retry
+    assert artifact.get_status() == "deferred"
+    assert not artifact.errors
+
+
+def test_sqs_deferred_redelivered(aws):
+    _, key_name = u.upload_file(aws, "signtool.exe", "firefox.exe")
+    event = {
+        "Records": [
+            {
+                "messageId": "m1",
+                "body": json.dumps(u.build_event(u.bucket_name, key_name)),
+                "eventSource": "aws:sqs",
+            }
+        ]
+    }
+    response = sqs_handler(event, ShortContext(DEADLINE_RESERVE))
+    assert response["batchItemFailures"] == [{"itemIdentifier": "m1"}]
@@ -0,0 +1,186 @@
+# A distributed backfill: leases of key ranges on a queue, claimed by worker
+# processes, which record verdicts in a shared store. A lease which isn't
+# completed is claimed again once it times out.
+
+import json
+import os
+import time
+
+import boto3
+from moto import mock_s3, mock_sqs
+import pytest
+import tests.utils as u
+
+from fx_sig_verify import leases
+from fx_sig_verify.backfill import list_objects
+from fx_sig_verify.verifier import Verifier
+
+INSTALLERS = [f"pub/firefox/releases/1.0/Firefox Setup {i}.exe" for i in range(7)]
+EXCLUDED = ["pub/firefox/releases/1.0/SHA256SUMS.txt"]
+
+
+@pytest.fixture
+def osslsigncode(tmp_path, monkeypatch):
+    """Put a stand-in osslsigncode, which passes everything, first on the PATH."""
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    script = bin_dir / "osslsigncode"
+    script.write_text("#!/bin/sh\nexit 0\n")
+    script.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+
+
+@pytest.fixture
+def bucket(osslsigncode):
+    with mock_s3():
+        bucket = u.create_bucket()
+        for key in INSTALLERS + EXCLUDED:
+            u.upload_file(bucket, "32bit.exe", key)
+        yield bucket
+
+
+@pytest.fixture(params=["sqs", "sqlite"])
+def queue(request, tmp_path):
+    if request.param == "sqlite":
+        queue = leases.SQLiteLeaseQueue(str(tmp_path / "queue.db"))
+        yield queue
+        queue.close()
+        return
+    with mock_sqs():
+        url = boto3.client("sqs").create_queue(QueueName="leases")["QueueUrl"]
+        yield leases.SQSLeaseQueue(url, client=boto3.client("sqs"))
+
+
+def test_shard(bucket):
+    # GIVEN: 8 keys
+    client = boto3.client("s3")
+    # WHEN: they're sharded 3 to a lease
+    shards = list(leases.shard(client, u.bucket_name, "pub/", keys_per_lease=3))
+    # THEN: the leases cover them, without overlapping
+    keys = sorted(INSTALLERS + EXCLUDED)
+    assert [(s["start_after"], s["last_key"]) for s in shards] == [
+        (None, keys[2]),
+        (keys[2], keys[5]),
+        (keys[5], keys[7]),
+    ]
+    covered = [
+        obj["Key"]
+        for s in shards
+        for obj in list_objects(client, u.bucket_name, "pub/", s["start_after"])
+        if obj["Key"] <= s["last_key"]
+    ]
+    assert sorted(covered) == keys
+
+
+def test_timed_out_lease_reclaimed(queue):
+    # GIVEN: a lease, claimed by a worker which then died
+    queue.publish([{"number": 0}])
+    _, receipt, _ = queue.claim(lease_seconds=1)
+    # WHEN: it times out
+    assert queue.claim(lease_seconds=1) is None
+    time.sleep(1.5)
+    # THEN: another worker claims it
+    lease, receipt, claims = queue.claim(lease_seconds=30)
+    assert lease == {"number": 0}
+    assert claims == 2
+    queue.extend(receipt, 30)
+    queue.complete(receipt)
+    assert queue.outstanding() == 0
+
+
+def test_extended_lease_kept(queue):
+    # GIVEN: a claimed lease, with a heartbeat
+    queue.publish([{"number": 0}])
+    _, receipt, _ = queue.claim(lease_seconds=1)
+    # WHEN: it's been held longer than the lease
+    with leases.Heartbeat(queue, receipt, 1):
+        time.sleep(1.5)
+        # THEN: it's not claimed by anyone else
+        assert queue.claim(lease_seconds=1) is None
+
+
+def test_worker_processes(bucket, tmp_path, capsys):
+    # GIVEN: leases on a queue, one claimed by a worker which died
+    queue_url = f"sqlite://{tmp_path / 'queue.db'}"
+    results_url = f"sqlite://{tmp_path / 'results.db'}"
+    queue = leases.queue_from_url(queue_url)
+    queue.publish(leases.shard(boto3.client("s3"), u.bucket_name, "pub/", 2))
+    queue.claim(lease_seconds=1)
+    # WHEN: worker processes run
+    totals = leases.run_workers(3, queue_url, results_url, wait_seconds=1)
+    # THEN: every lease is completed, the crashed one included
+    assert queue.outstanding() == 0
+    assert totals["leases"] == 4
+    assert totals["pass"] == len(INSTALLERS)
+    assert totals["excluded"] == len(EXCLUDED)
+    queue.close()
+    # AND: the verdicts are in the results store
+    results = leases.results_from_url(results_url)
+    assert {key: verdict for key, verdict, _ in results.results(u.bucket_name)} == {
+        key: "pass" for key in INSTALLERS
+    }
+    results.close()
+    assert capsys.readouterr().out == ""
+
+
+def test_reclaimed_lease_skips_verified(bucket, tmp_path):
+    # GIVEN: a lease which had an S3 error on one key
+    queue = leases.SQLiteLeaseQueue(str(tmp_path / "queue.db"))
+    results = leases.SQLiteResults(str(tmp_path / "results.db"))
+    queue.publish(leases.shard(boto3.client("s3"), u.bucket_name, "pub/", 100))
+    for key in INSTALLERS:
+        results.record(u.bucket_name, key, "pass")
+    results.record(u.bucket_name, INSTALLERS[3], "retry", ["NoSuchKey"])
+    verifier = Verifier()
+    # WHEN: it's claimed again
+    totals = leases.work(queue, results, verifier, wait_seconds=0)
+    # THEN: just that key is verified
+    assert totals["pass"] == 1
+    assert totals["resumed"] == len(INSTALLERS) - 1
+    assert results.verdicts(u.bucket_name)[INSTALLERS[3]] == "pass"
+    queue.close()
+    results.close()
+
+
+def test_failing_lease_given_up(tmp_path):
+    # GIVEN: a lease of a bucket which doesn't exist
+    queue = leases.SQLiteLeaseQueue(str(tmp_path / "queue.db"))
+    results = leases.SQLiteResults(str(tmp_path / "results.db"))
+    lease = {"bucket": "gone", "prefix": "", "number": 0, "start_after": None}
+    queue.publish([dict(lease, last_key="b.exe")])
+    # WHEN: it's worked
+    with mock_s3():
+        totals = leases.work(
+            queue, results, Verifier(), lease_seconds=1, wait_seconds=0, max_claims=2
+        )
+    # THEN: it's given up after the last claim, its keys left to retry
+    assert queue.outstanding() == 0
+    assert totals["abandoned"] == 1
+    assert totals["leases"] == 1
+    [(key, verdict, reasons)] = results.results("gone")
+    assert (key, verdict) == ("b.exe", "retry")
+    assert "NoSuchBucket" in reasons[0]
+    queue.close()
+    results.close()
+
+
+def test_report(tmp_path, capsys):
+    # GIVEN: results, one a failure
+    url = f"sqlite://{tmp_path / 'results.db'}"
+    results = leases.results_from_url(url)
+    results.record(u.bucket_name, "a.exe", "pass")
+    results.record(u.bucket_name, "b.exe", "SigVerifyNoSignature", ["unsigned"])
+    results.close()
+    # WHEN: they're reported
+    with pytest.raises(SystemExit) as e:
+        leases.main(["report", url, u.bucket_name])
+    # THEN: the failure is output, and the totals
+    out = capsys.readouterr().out
+    failure, totals = [json.loads(line) for line in out.splitlines()]
+    assert e.value.code == 1
+    assert failure == {
+        "key": "b.exe",
+        "verdict": "SigVerifyNoSignature",
+        "results": ["unsigned"],
+    }
+    assert totals["totals"] == {"pass": 1, "SigVerifyNoSignature": 1}
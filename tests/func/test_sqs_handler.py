@@ -0,0 +1,80 @@
+# When fed by SQS, only the messages whose objects couldn't be retrieved are
+# reported as failures, to be delivered again.
+
+import json
+
+from moto import mock_s3, mock_sns, mock_sqs
+import pytest
+import tests.utils as u
+
+from fx_sig_verify import validate_moz_signature
+from fx_sig_verify.validate_moz_signature import MozSignedObject, sqs_handler
+
+
+def sqs_message(message_id, body):
+    return {
+        "messageId": message_id,
+        "receiptHandle": "handle-" + message_id,
+        "body": body if isinstance(body, str) else json.dumps(body),
+        "eventSource": "aws:sqs",
+    }
+
+
+def sns_wrapped(body):
+    return {"Type": "Notification", "Message": json.dumps(body)}
+
+
+@pytest.fixture(autouse=True)
+def short_s3_wait(monkeypatch):
+    monkeypatch.setattr(validate_moz_signature, "S3_MAX_WAIT", 0.2)
+    yield
+    MozSignedObject.production_criteria = True
+
+
+@pytest.fixture
+def aws():
+    with mock_s3(), mock_sns(), mock_sqs():
+        u.setup_aws_mocks()
+        bucket = u.create_bucket()
+        u.zero_production()
+        yield bucket
+
+
+def test_only_failed_messages_reported(aws):
+    _, key_name = u.upload_file(aws, "signtool.exe", "firefox.exe")
+    # GIVEN: a batch naming an existing object, a missing one, and the
+    #   existing one again via SNS
+    event = {
+        "Records": [
+            sqs_message("m1", u.build_event(u.bucket_name, key_name)),
+            sqs_message("m2", u.build_event(u.bucket_name, "firefox-bogus.exe")),
+            sqs_message("m3", sns_wrapped(u.build_event(u.bucket_name, key_name))),
+        ]
+    }
+    # WHEN: it is processed
+    response = sqs_handler(event, u.dummy_context)
+    # THEN: only the message with the missing object is retried
+    assert response["batchItemFailures"] == [{"itemIdentifier": "m2"}]
+    #  and all were reported
+    statuses = [r["status"] for r in response["results"]]
+    assert statuses == ["fail", "fail", "fail"]
+    reasons = response["results"][2]["results"]
+    assert "Failure reason: SigVerifyNonMozSignature" in reasons
+
+
+def test_test_event_and_garbage(aws, capsys):
+    # GIVEN: the S3 test event, and a message which isn't JSON
+    event = {
+        "Records": [
+            sqs_message("m1", {"Service": "Amazon S3", "Event": "s3:TestEvent"}),
+            sqs_message("m2", "not json"),
+        ]
+    }
+    # WHEN: they're processed
+    response = sqs_handler(event, u.dummy_context)
+    # THEN: the test event is consumed, the other left for the DLQ
+    assert response["batchItemFailures"] == [{"itemIdentifier": "m2"}]
+    assert response["results"] == []
+    out, _ = capsys.readouterr()
+    logged = json.loads(out.strip().splitlines()[-1])
+    assert logged["errors"][0].startswith("bad message m2")
@@ -0,0 +1,41 @@
+# Each result says where the time went, and is logged as metrics.
+
+import json
+
+from moto import mock_s3, mock_sns, mock_sqs
+import pytest
+import tests.utils as u
+
+from fx_sig_verify.validate_moz_signature import MozSignedObject, lambda_handler
+
+
+@pytest.fixture(autouse=True)
+def production_after_test():
+    yield
+    MozSignedObject.production_criteria = True
+
+
+@mock_s3
+@mock_sns
+@mock_sqs
+def test_stage_timings_logged(capsys):
+    u.setup_aws_mocks()
+    bucket = u.create_bucket()
+    u.zero_production()
+    # GIVEN: an object signed by someone else
+    bucket_name, key_name = u.upload_file(bucket, "signtool.exe", "firefox.exe")
+    event = u.build_event(bucket_name, key_name)
+    # WHEN: it is processed
+    response = lambda_handler(event, u.dummy_context)
+    # THEN: the result has the stages it went through
+    [result] = response["results"]
+    assert result["verdict"] == "SigVerifyNonMozSignature"
+    assert set(result["timings"]) == {"download", "notify"}
+    assert result["bytes"] > 0
+    #  and they're logged as metrics, before the response
+    out, _ = capsys.readouterr()
+    *_, metric_line, response_line = out.strip().splitlines()
+    metric = json.loads(metric_line)
+    assert metric["Verdict"] == "SigVerifyNonMozSignature"
+    assert metric["DownloadTime"] == result["timings"]["download"]
+    assert json.loads(response_line)["request_id"] == response["request_id"]
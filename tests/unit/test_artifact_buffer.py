@@ -0,0 +1,75 @@
+# Check each artifact buffer backend can be read by a subprocess via the path
+# it provides.
+
+import subprocess  # nosec
+import sys
+
+import pytest
+
+from fx_sig_verify import artifact_buffer as ab
+
+PAYLOAD = b"MZ" + bytes(range(256)) * 64
+
+
+def available_backends():
+    return ab.preferred_backends()
+
+
+@pytest.mark.parametrize("backend", available_backends())
+def test_subprocess_reads_buffer(backend):
+    # GIVEN: a buffer with some contents
+    with ab.ArtifactBuffer.create(backends=[backend]) as buf:
+        buf.write(PAYLOAD)
+        buf.flush()
+        assert buf.backend == backend
+        # WHEN: a child process opens it by path
+        results = subprocess.run(  # nosec
+            [
+                sys.executable,
+                "-c",
+                "import sys; sys.stdout.write(str(len(open(sys.argv[1], 'rb').read())))",
+                buf.verifier_path,
+            ],
+            stdout=subprocess.PIPE,
+            universal_newlines=True,
+            pass_fds=buf.pass_fds,
+        )
+    # THEN: it sees everything we wrote
+    assert results.returncode == 0
+    assert int(results.stdout) == len(PAYLOAD)
+
+
+@pytest.mark.skipif(
+    ab._libc_memfd_create() is None, reason="C library has no memfd_create"
+)
+def test_libc_memfd(monkeypatch):
+    # GIVEN: only the C library's memfd_create, as on Python 3.6
+    monkeypatch.setattr(ab, "memfd_create", ab._libc_memfd_create())
+    # WHEN: a memory file is created
+    with ab.ArtifactBuffer.create(backends=[ab.MEMFD]) as buf:
+        buf.write(PAYLOAD)
+        buf.flush()
+        # THEN: its path reads back what was written
+        with open(buf.verifier_path, "rb") as f:
+            assert f.read() == PAYLOAD
+    assert buf.in_memory
+
+
+def test_large_artifacts_go_to_disk():
+    # GIVEN: an artifact larger than we want in memory
+    # WHEN: a buffer is created for it
+    with ab.ArtifactBuffer.create(size_hint=1000, max_memory=999) as buf:
+        # THEN: it is on disk
+        assert buf.backend == ab.TMP
+        assert not buf.in_memory
+
+
+@pytest.mark.parametrize("forced", ab.ALL_BACKENDS)
+def test_backend_override(forced, monkeypatch):
+    # GIVEN: a backend forced via the environment
+    monkeypatch.setenv(ab.BACKEND_ENV, forced)
+    # WHEN: the backends are chosen
+    backends = ab.preferred_backends()
+    # THEN: it is tried first, with disk as a fallback
+    assert backends[0] == forced
+    assert backends[-1] == ab.TMP
@@ -0,0 +1,99 @@
+# Check the in-process Authenticode parsing finds the same signer osslsigncode
+# reports, without needing osslsigncode installed.
+
+import io
+
+import pytest
+
+import tests.utils as u
+from fx_sig_verify import authenticode
+from fx_sig_verify.validate_moz_signature import (
+    VALID_CERTS,
+    MozSignedObject,
+    SigVerifyBadSignature,
+    SigVerifyNoSignature,
+    SigVerifyNonMozSignature,
+)
+
+DATA_DIR = "tests/data/"
+
+# files signed by someone other than Mozilla
+non_moz_file_names_list = [
+    "signtool.exe",
+    "vswriter.exe",
+]
+
+
+def read_data(fname):
+    with open(DATA_DIR + fname, "rb") as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("fname", u.good_file_names_list)
+def test_mozilla_serial(fname):
+    # GIVEN: a file signed by Mozilla
+    with open(DATA_DIR + fname, "rb") as f:
+        # WHEN: the signer serial is extracted
+        serial = authenticode.get_signer_serial(f)
+    # THEN: it is one we trust
+    assert serial in VALID_CERTS
+
+
+@pytest.mark.parametrize("fname", non_moz_file_names_list)
+def test_non_mozilla_serial(fname):
+    # GIVEN: a file validly signed by someone else
+    with open(DATA_DIR + fname, "rb") as f:
+        # WHEN: the signer serial is extracted
+        serial = authenticode.get_signer_serial(f)
+    # THEN: there is one, but we don't trust it
+    assert serial is not None
+    assert serial not in VALID_CERTS
+
+
+def test_unsigned_pe():
+    # GIVEN: a PE file with the security directory zeroed out
+    data = bytearray(read_data("32bit.exe"))
+    header = authenticode.parse_pe_header(data)
+    data[header.security_dir_offset : header.security_dir_offset + 8] = bytes(8)
+    # WHEN: the signer serial is extracted
+    serial = authenticode.get_signer_serial(io.BytesIO(data))
+    # THEN: there is none
+    assert serial is None
+
+
+@pytest.mark.parametrize(
+    "data", [b"", b"not an exe", b"MZ" + bytes(100), b"MZ" + bytes(0x3A) + bytes(4)]
+)
+def test_not_a_pe_file(data):
+    # GIVEN: data which isn't a PE file
+    # WHEN: the signer serial is extracted
+    # THEN: the right exception is raised
+    with pytest.raises(authenticode.NotPEFileError):
+        authenticode.get_signer_serial(io.BytesIO(data))
+
+
+def test_truncated_cert_table():
+    # GIVEN: a signed file missing the end of its certificate table
+    data = read_data("32bit.exe")[:-100]
+    # WHEN: the signer serial is extracted
+    # THEN: it is reported as malformed
+    with pytest.raises(authenticode.AuthenticodeFormatError):
+        authenticode.get_signer_serial(io.BytesIO(data))
+
+
+@pytest.mark.parametrize(
+    "fname, exception",
+    [
+        ("signtool.exe", SigVerifyNonMozSignature),
+        ("PostBalrogStub.exe", SigVerifyBadSignature),
+        ("../data/README.rst", SigVerifyNoSignature),
+    ],
+)
+def test_check_signer_rejects(fname, exception):
+    # GIVEN: a file not signed by Mozilla
+    obj = MozSignedObject()
+    with open(DATA_DIR + fname, "rb") as f:
+        # WHEN: the signer is checked
+        # THEN: it is rejected without running osslsigncode
+        with pytest.raises(exception):
+            obj.check_signer(f)
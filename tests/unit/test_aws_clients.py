@@ -0,0 +1,72 @@
+# Clients are created once per service and shared, including across threads.
+
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.config import Config
+
+from moto import mock_s3
+import pytest
+import tests.utils as u
+
+from fx_sig_verify import aws_clients
+from fx_sig_verify.validate_moz_signature import MozSignedObjectViaLambda
+
+
+def test_client_reused():
+    # GIVEN: a client has been created
+    first = aws_clients.client("s3")
+    # WHEN: another is requested
+    second = aws_clients.client("s3")
+    # THEN: it's the same one
+    assert first is second
+    #  but other services get their own
+    assert aws_clients.client("sns") is not first
+
+
+def test_client_shared_by_threads():
+    # GIVEN: many threads wanting a client at once
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        # WHEN: they ask for it
+        clients = list(pool.map(lambda _: aws_clients.client("s3"), range(64)))
+    # THEN: only one was created
+    assert len({id(c) for c in clients}) == 1
+
+
+def test_reset():
+    first = aws_clients.client("s3")
+    aws_clients.reset_clients()
+    assert aws_clients.client("s3") is not first
+
+
+@pytest.mark.parametrize(
+    "env, pool, attempts, keepalive",
+    [
+        ({}, aws_clients.DEFAULT_POOL_SIZE, aws_clients.DEFAULT_MAX_ATTEMPTS, True),
+        ({"CLIENT_POOL_SIZE": "5", "AWS_MAX_ATTEMPTS": "7"}, 5, 7, True),
+        ({"CLIENT_TCP_KEEPALIVE": "0"}, aws_clients.DEFAULT_POOL_SIZE, 3, False),
+        ({"CLIENT_POOL_SIZE": "lots"}, aws_clients.DEFAULT_POOL_SIZE, 3, True),
+    ],
+)
+def test_config_from_environment(env, pool, attempts, keepalive, monkeypatch):
+    for name in ("CLIENT_POOL_SIZE", "AWS_MAX_ATTEMPTS", "CLIENT_TCP_KEEPALIVE"):
+        monkeypatch.delenv(name, raising=False)
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+    config = aws_clients.client_config()
+    assert config.max_pool_connections == pool
+    assert config.retries["max_attempts"] == attempts
+    if "tcp_keepalive" in Config.OPTION_DEFAULTS:
+        assert config.tcp_keepalive == keepalive
+
+
+@mock_s3
+def test_artifacts_share_client():
+    bucket = u.create_bucket()
+    bucket_name, key_name = u.upload_file(bucket, "signtool.exe", "firefox.exe")
+    # GIVEN: several objects are retrieved
+    for _ in range(3):
+        artifact = MozSignedObjectViaLambda(bucket_name, key_name)
+        with artifact.get_flo():
+            pass
+    # THEN: only the one S3 client was created
+    assert list(aws_clients._clients) == ["s3"]
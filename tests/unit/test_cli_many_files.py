@@ -0,0 +1,80 @@
+# fx-sig-verify checks many files per run: paths, globs and @filelists, in
+# worker processes with --jobs, reporting a JSON line per file.
+
+import json
+
+import pytest
+
+from fx_sig_verify.cli import expand_suspects, main
+from fx_sig_verify.validate_moz_signature import MozSignedObject
+
+NON_MOZ = ["tests/data/signtool.exe", "tests/data/vswriter.exe"]
+
+
+@pytest.fixture(autouse=True)
+def reset_after_test():
+    yield
+    MozSignedObject.production_criteria = True
+    MozSignedObject.verbose = 0
+
+
+def json_lines(capsys):
+    out, _ = capsys.readouterr()
+    return [json.loads(line) for line in out.splitlines()]
+
+
+def test_expand_suspects(tmp_path):
+    # GIVEN: a file listing a path and a glob
+    listing = tmp_path / "files.txt"
+    listing.write_text("tests/data/bad_1.exe\n\ntests/data/s*.exe\n")
+    # WHEN: it's expanded, with other arguments
+    paths = expand_suspects(
+        ["tests/data/v*.exe", f"@{listing}", "tests/data/none*.exe", "missing.exe"]
+    )
+    # THEN: the paths are in order, keeping what doesn't exist
+    assert paths == [
+        "tests/data/vswriter.exe",
+        "tests/data/bad_1.exe",
+        "tests/data/signtool.exe",
+        "tests/data/none*.exe",
+        "missing.exe",
+    ]
+
+
+@pytest.mark.parametrize("jobs", ["1", "2"])
+def test_json_lines(jobs, capsys):
+    # GIVEN: files which fail, and one which doesn't exist
+    paths = NON_MOZ + ["missing.exe"]
+    # WHEN: they're checked
+    with pytest.raises(SystemExit) as e:
+        main(["--json", "--jobs", jobs] + paths)
+    # THEN: there's a line per file, in order, and one of totals
+    *results, totals = json_lines(capsys)
+    assert e.value.code == 1
+    assert [r["key"] for r in results] == paths
+    assert [r["verdict"] for r in results] == [
+        "SigVerifyNonMozSignature",
+        "SigVerifyNonMozSignature",
+        "fail",
+    ]
+    assert totals["totals"]["files"] == 3
+    assert totals["totals"]["failed"] == 3
+    assert "parse" in totals["totals"]["timings"]
+
+
+def test_two_files_text(capsys):
+    # GIVEN: two files, without --json
+    # WHEN: they're checked
+    with pytest.raises(SystemExit) as e:
+        main(NON_MOZ)
+    # THEN: each is reported, and the totals on stderr
+    out, err = capsys.readouterr()
+    assert e.value.code == 1
+    assert out.count("fail for tests/data/") == 2
+    assert "2 files: 0 passed, 2 failed" in err
+
+
+def test_missing_filelist(capsys):
+    with pytest.raises(SystemExit) as e:
+        main(["@no-such-list"])
+    assert e.value.code == 2
@@ -0,0 +1,191 @@
+# The decoder finds the S3 objects in each kind of envelope, and reports bad
+# sub-records without rejecting the rest of the event.
+
+import json
+
+from moto import mock_s3, mock_sns, mock_sqs
+import pytest
+import tests.utils as u
+
+from fx_sig_verify import event_decoder
+from fx_sig_verify.validate_moz_signature import (
+    MozSignedObject,
+    lambda_handler,
+    unpacked_s3_events,
+)
+
+
+def s3_record(key, bucket="bucket", **extra):
+    s3_object = {"key": key, "size": 42, "eTag": "abc", "sequencer": "0A"}
+    s3_object.update(extra)
+    return {
+        "eventSource": "aws:s3",
+        "s3": {"bucket": {"name": bucket}, "object": s3_object},
+    }
+
+
+def s3_event(*keys):
+    return {"Records": [s3_record(key) for key in keys]}
+
+
+def sns_event(message):
+    return {
+        "Records": [{"EventSource": "aws:sns", "Sns": {"Message": json.dumps(message)}}]
+    }
+
+
+def sqs_event(*bodies):
+    return {
+        "Records": [
+            {"messageId": f"m{i}", "eventSource": "aws:sqs", "body": json.dumps(body)}
+            for i, body in enumerate(bodies)
+        ]
+    }
+
+
+def eventbridge_event(key):
+    return {
+        "source": "aws.s3",
+        "detail-type": "Object Created",
+        "detail": {
+            "bucket": {"name": "bucket"},
+            "object": {"key": key, "size": 7, "etag": "def", "sequencer": "0B"},
+        },
+    }
+
+
+def decode(event):
+    decoder = event_decoder.EventDecoder()
+    return decoder, list(decoder.records(event))
+
+
+@pytest.mark.parametrize(
+    "event, source",
+    [
+        (s3_event("a+b.exe", "c.exe"), "s3"),
+        (sns_event(s3_event("a+b.exe", "c.exe")), "sns"),
+        (sqs_event(s3_event("a+b.exe"), s3_event("c.exe")), "sqs"),
+        (sqs_event(sns_event(s3_event("a+b.exe", "c.exe"))), "sqs"),
+        (
+            sqs_event(
+                {"Type": "Notification", "Message": json.dumps(s3_event("a+b.exe"))},
+                s3_event("c.exe"),
+            ),
+            "sqs",
+        ),
+    ],
+)
+def test_envelopes(event, source):
+    # GIVEN: S3 notifications in any envelope
+    # WHEN: they are decoded
+    decoder, records = decode(event)
+    # THEN: the objects are found, in order, with keys unescaped
+    assert [r.key for r in records] == ["a b.exe", "c.exe"]
+    assert {r.source for r in records} == {source}
+    assert (records[0].bucket, records[0].etag, records[0].size) == (
+        "bucket",
+        "abc",
+        42,
+    )
+    assert decoder.errors == []
+
+
+def test_eventbridge():
+    # GIVEN: an EventBridge event, whose keys are not escaped
+    decoder, records = decode(eventbridge_event("a+b.exe"))
+    # THEN: the key is used as is
+    assert records == [
+        event_decoder.S3Record(
+            "bucket", "a+b.exe", "def", 7, "0B", "eventbridge", None, None
+        )
+    ]
+    # and other EventBridge events are ignored
+    other = dict(eventbridge_event("x"), **{"detail-type": "Object Deleted"})
+    assert decode(other)[1] == []
+
+
+def test_sqs_message_ids():
+    _, records = decode(sqs_event(s3_event("a"), s3_event("b", "c")))
+    assert [(r.key, r.message_id) for r in records] == [
+        ("a", "m0"),
+        ("b", "m1"),
+        ("c", "m1"),
+    ]
+
+
+def test_bad_sub_records_isolated():
+    # GIVEN: an event with good records around bad ones
+    event = sqs_event(s3_event("a"), "not an S3 event", s3_event("b"))
+    event["Records"][1]["body"] = "{not json"
+    event["Records"].append({"unexpected": "x" * 10000})
+    # WHEN: it is decoded
+    decoder, records = decode(event)
+    # THEN: the good ones are found
+    assert [r.key for r in records] == ["a", "b"]
+    #  and each bad one reported, briefly
+    assert [(e.path, e.message_id) for e in decoder.errors] == [
+        ("event.Records[1].body", "m1"),
+        ("event.Records[3]", None),
+    ]
+    assert all(len(e.error) <= event_decoder.MAX_ERROR_TEXT for e in decoder.errors)
+
+
+def test_errors_bounded():
+    event = {"Records": [{"bogus": i} for i in range(500)]}
+    decoder, _ = decode(event)
+    assert decoder.error_count == 500
+    assert len(decoder.errors) == event_decoder.MAX_ERRORS
+
+
+def test_deep_nesting():
+    # GIVEN: envelopes nested deeper than the recursion limit
+    event = s3_event("deep")
+    for _ in range(2000):
+        event = {"Records": [event]}
+    # WHEN: it is decoded
+    _, records = decode(event)
+    # THEN: the object is found
+    assert [r.key for r in records] == ["deep"]
+
+
+def test_test_event_ignored():
+    decoder, records = decode({"Service": "Amazon S3", "Event": "s3:TestEvent"})
+    assert records == [] and decoder.errors == []
+
+
+def test_unpacked_s3_events_compatible():
+    # GIVEN: an SNS wrapped event
+    s3_events = s3_event("a", "b")
+    notices = {"note": "x"}
+    # WHEN: it is unpacked the old way
+    records = list(unpacked_s3_events(sns_event(s3_events), notices))
+    # THEN: the original records are returned
+    assert records == s3_events["Records"]
+    assert notices["unpacker"] == "SNS message unpacked"
+    # and invalid events are still rejected, with a short message
+    with pytest.raises(ValueError) as e:
+        list(unpacked_s3_events({"Records": [{"bogus": "x" * 10000}]}))
+    assert len(str(e.value)) < 1000
+
+
+@mock_s3
+@mock_sns
+@mock_sqs
+def test_lambda_processes_good_records():
+    u.setup_aws_mocks()
+    bucket = u.create_bucket()
+    u.zero_production()
+    _, key_name = u.upload_file(bucket, "signtool.exe", "firefox.exe")
+    # GIVEN: an event with one good record, and one bad
+    event = u.build_event(u.bucket_name, key_name)
+    event["Records"].append({"bogus": "record"})
+    # WHEN: it is processed
+    try:
+        response = lambda_handler(event, u.dummy_context)
+    finally:
+        MozSignedObject.production_criteria = True
+    # THEN: the good record is checked
+    assert [r["key"] for r in response["results"]] == [key_name]
+    #  and the bad one reported
+    assert response["error_count"] == 1
+    assert response["errors"][0].startswith("bad record event.Records[1]")
@@ -0,0 +1,97 @@
+# Repeated deliveries of the same S3 event are only processed once.
+
+import json
+
+from moto import mock_s3, mock_sns, mock_sqs
+import pytest
+import tests.utils as u
+
+from fx_sig_verify import event_dedup
+from fx_sig_verify import validate_moz_signature
+from fx_sig_verify.validate_moz_signature import MozSignedObject, lambda_handler
+
+
+def record(key, sequencer="0055AED6DCD90281E5", bucket=u.bucket_name):
+    built = u.build_event(bucket, key)["Records"][0]
+    if sequencer:
+        built["s3"]["object"]["sequencer"] = sequencer
+    return built
+
+
+def logged_response(capsys):
+    out, _ = capsys.readouterr()
+    return json.loads([line for line in out.splitlines() if line.startswith("{")][-1])
+
+
+@pytest.fixture(autouse=True)
+def production_after_test():
+    yield
+    MozSignedObject.production_criteria = True
+
+
+def test_record_key():
+    assert event_dedup.record_key(record("k", "01")) == (u.bucket_name, "k", "01")
+    etag_only = record("k", None)
+    etag_only["s3"]["object"]["eTag"] = "abc"
+    assert event_dedup.record_key(etag_only) == (u.bucket_name, "k", "abc")
+    # without either, we can't tell a repeat from a new upload
+    assert event_dedup.record_key(record("k", None)) is None
+
+
+def test_repeats_within_batch():
+    # GIVEN: a batch with repeated records
+    duplicates = event_dedup.DuplicateFilter(event_dedup.RecentRecords())
+    batch = [record("a"), record("a"), record("b"), record("a", "02"), record("a")]
+    # WHEN: they are filtered
+    kept = [r for r in batch if duplicates.is_new(r)]
+    # THEN: each change is kept once
+    assert [event_dedup.record_key(r)[1:] for r in kept] == [
+        ("a", "0055AED6DCD90281E5"),
+        ("b", "0055AED6DCD90281E5"),
+        ("a", "02"),
+    ]
+    assert duplicates.dropped == 2
+
+
+def test_unidentifiable_never_dropped():
+    duplicates = event_dedup.DuplicateFilter(event_dedup.RecentRecords())
+    assert all(duplicates.is_new(record("a", None)) for _ in range(3))
+
+
+def test_lru_bounded():
+    # GIVEN: a small memory of recent records
+    recent = event_dedup.RecentRecords(max_entries=2)
+    # WHEN: more are added
+    for key in "abc":
+        recent.add(key)
+    # THEN: the oldest are forgotten
+    assert "a" not in recent
+    assert "c" in recent
+    assert len(recent) == 2
+
+
+@mock_s3
+@mock_sns
+@mock_sqs
+def test_across_invocations(monkeypatch, capsys):
+    monkeypatch.setattr(validate_moz_signature, "S3_MAX_WAIT", 0.2)
+    u.setup_aws_mocks()
+    bucket = u.create_bucket()
+    u.zero_production()
+    _, key_name = u.upload_file(bucket, "signtool.exe", "firefox.exe")
+    # GIVEN: an event with the same upload thrice, and a missing object
+    event = {"Records": [record(key_name)] * 3 + [record("firefox-bogus.exe")]}
+    # WHEN: it is processed
+    with pytest.raises(IOError):
+        lambda_handler(event, u.dummy_context)
+    # THEN: the copies were dropped
+    logged = logged_response(capsys)
+    assert logged["duplicates"] == 2
+    assert len(logged["results"]) == 2
+    # WHEN: it is delivered again
+    with pytest.raises(IOError):
+        lambda_handler(event, u.dummy_context)
+    # THEN: only the missing object is tried again
+    logged = logged_response(capsys)
+    assert logged["duplicates"] == 3
+    assert [r["key"] for r in logged["results"]] == ["firefox-bogus.exe"]
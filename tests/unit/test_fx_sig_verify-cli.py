@@ -30,7 +30,7 @@ def invalid_invocations():
     return ("-i".split(),
             "--helx".split(),
             "-v".split(),
-            "file_1 file_2".split(),  # 2 files not allowed
+            "--jobs 0 file_1".split(),
             "".split(),  # 0 files not allowed (without switches)
             )
 
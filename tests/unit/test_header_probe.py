@@ -0,0 +1,86 @@
+# Check that the ranged GET probe rejects bad uploads before the full object
+# is downloaded.
+
+import boto3
+from moto import mock_s3
+import pytest
+import tests.utils as u
+
+from fx_sig_verify.validate_moz_signature import (
+    MozSignedObjectViaLambda,
+    S3RangeReader,
+    SigVerifyBadSignature,
+    SigVerifyNoSignature,
+    SigVerifyNonMozSignature,
+)
+
+
+def no_full_download():
+    raise AssertionError("get_flo should not be called")
+
+
+@mock_s3
+@pytest.mark.parametrize(
+    "fname, exception",
+    [
+        ("signtool.exe", SigVerifyNonMozSignature),
+        ("vswriter.exe", SigVerifyNonMozSignature),
+        ("PostBalrogStub.exe", SigVerifyBadSignature),
+        ("README.rst", SigVerifyNoSignature),
+    ],
+)
+def test_probe_rejects(fname, exception):
+    bucket = u.create_bucket()
+    # GIVEN: an upload which can't be signed by Mozilla
+    bucket_name, key_name = u.upload_file(bucket, fname, "firefox-" + fname)
+    artifact = MozSignedObjectViaLambda(bucket_name, key_name)
+    artifact.get_flo = no_full_download
+    # WHEN: it is checked
+    # THEN: the probe rejects it
+    with pytest.raises(exception):
+        artifact.check_exe()
+    #  having read only the headers & certificate table
+    assert 0 < artifact.probe_bytes < 32 * 1024
+    assert not artifact.had_s3_error
+
+
+@mock_s3
+@pytest.mark.parametrize("fname", u.good_file_names_list)
+def test_probe_accepts(fname):
+    bucket = u.create_bucket()
+    # GIVEN: an upload signed by Mozilla
+    bucket_name, key_name = u.upload_file(bucket, fname)
+    artifact = MozSignedObjectViaLambda(bucket_name, key_name)
+    # WHEN: it is probed
+    artifact.probe()
+    # THEN: no exception is raised, and only a little was fetched
+    assert 0 < artifact.probe_bytes < 32 * 1024
+
+
+@mock_s3
+def test_probe_empty_object():
+    bucket = u.create_bucket()
+    # GIVEN: an empty upload
+    bucket.put_object(Body=b"", Key="firefox.exe")
+    artifact = MozSignedObjectViaLambda(u.bucket_name, "firefox.exe")
+    # WHEN: it is probed
+    # THEN: it has no signature (and isn't an S3 error)
+    with pytest.raises(SigVerifyNoSignature):
+        artifact.probe()
+    assert not artifact.had_s3_error
+
+
+@mock_s3
+def test_range_reader_caches_block():
+    bucket = u.create_bucket()
+    bucket_name, key_name = u.upload_file(bucket, "32bit.exe")
+    reader = S3RangeReader(boto3.client("s3"), bucket_name, key_name)
+    # GIVEN: a reader which has fetched the start of the object
+    first = reader.read(4096)
+    # WHEN: bytes inside that block are read again
+    reader.seek(10)
+    again = reader.read(100)
+    # THEN: no new request is made
+    assert again == first[10:110]
+    assert reader.requests == 1
+    assert reader.size == 246056
@@ -0,0 +1,134 @@
+# Release trees and SHA256SUMS/SHA512SUMS manifests: only production files
+# are checked, against the manifest digest, and cached verdicts are reused
+# for files which still match it.
+
+import hashlib
+import json
+import os
+import shutil
+
+import pytest
+
+from fx_sig_verify import manifest
+from fx_sig_verify import pe_digest
+from fx_sig_verify.cli import main, production_files
+from fx_sig_verify.validate_moz_signature import MozSignedObject
+from fx_sig_verify.verifier import Verifier
+
+INSTALLER = "win64/en-US/Firefox Setup 1.0.exe"
+
+
+@pytest.fixture(autouse=True)
+def reset_after_test():
+    yield
+    MozSignedObject.production_criteria = True
+    MozSignedObject.verdict_cache = None
+    MozSignedObject.verbose = 0
+
+
+@pytest.fixture
+def osslsigncode(tmp_path_factory, monkeypatch):
+    """Put a stand-in osslsigncode, which passes everything, first on the PATH."""
+    bin_dir = tmp_path_factory.mktemp("bin")
+    script = bin_dir / "osslsigncode"
+    script.write_text("#!/bin/sh\nexit 0\n")
+    script.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+
+
+@pytest.fixture
+def release(tmp_path):
+    """A release tree, with its SHA256SUMS."""
+    installer = tmp_path / INSTALLER
+    installer.parent.mkdir(parents=True)
+    shutil.copy("tests/data/32bit.exe", installer)
+    shutil.copy("tests/data/bad_1.exe", installer.parent / "mar.exe")
+    (tmp_path / "win64/en-US/firefox-1.0.zip").write_bytes(b"PK")
+    lines = [
+        f"{hashlib.sha256(path.read_bytes()).hexdigest()}  {path.relative_to(tmp_path)}"
+        for path in sorted(tmp_path.rglob("*"))
+        if path.is_file()
+    ]
+    (tmp_path / "SHA256SUMS").write_text("\n".join(lines) + "\n")
+    return tmp_path
+
+
+def test_only_production_files(release):
+    # GIVEN: a release tree
+    # WHEN: it's listed, or its manifest read
+    listed = production_files(str(release))
+    [(path, algorithm, digest)] = manifest.read_manifest(str(release / "SHA256SUMS"))
+    # THEN: just the installer is checked
+    assert listed == [str(release / INSTALLER)]
+    assert path == str(release / INSTALLER)
+    assert algorithm == "sha256"
+    assert digest == hashlib.sha256((release / INSTALLER).read_bytes()).hexdigest()
+
+
+def test_malformed_manifest(tmp_path):
+    sums = tmp_path / "SHA512SUMS"
+    sums.write_text("abc123  Firefox Setup.exe\n")
+    with pytest.raises(ValueError):
+        manifest.read_manifest(str(sums))
+
+
+def test_digest_in_same_pass(release, osslsigncode, monkeypatch):
+    def no_second_pass(*args, **kwargs):
+        raise AssertionError("read the file again for the digest")
+
+    monkeypatch.setattr(pe_digest, "digest_file", no_second_pass)
+    # GIVEN: the manifest digest of an installer
+    [(path, *digest)] = manifest.read_manifest(str(release / "SHA256SUMS"))
+    # WHEN: it's verified
+    artifact = Verifier(production_criteria=False).verify_path(path, tuple(digest))
+    # THEN: the PE digest was computed while checking the manifest digest
+    assert artifact.failure_class() != "SigVerifyBadSignature"
+    assert not any("failed to process" in error for error in artifact.errors)
+
+
+def test_mismatch_fails_uncached(release):
+    # GIVEN: an installer which doesn't match the manifest
+    verifier = Verifier(production_criteria=False, verdict_cache="memory:")
+    digest = ("sha256", "0" * 64)
+    # WHEN: it's verified
+    artifact = verifier.verify_path(str(release / INSTALLER), digest)
+    # THEN: it fails, and that's not remembered against the digest
+    assert artifact.get_status() == "fail"
+    assert "ManifestMismatch" in artifact.errors[0]
+    assert verifier.verdict_cache.get("sha256:" + "0" * 64) is None
+
+
+def test_cached_files_skipped(release, osslsigncode, tmp_path, capsys):
+    # GIVEN: a manifest which has been checked before
+    cache = str(tmp_path / "verdicts.db")
+    sums = str(release / "SHA256SUMS")
+    with pytest.raises(SystemExit):
+        main(["--json", "--cache", cache, sums])
+    capsys.readouterr()
+    # WHEN: it's checked again
+    with pytest.raises(SystemExit):
+        main(["--json", "--cache", cache, sums])
+    # THEN: the installer's verdict is reused, without checking it again
+    result, totals = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert result["cached"]
+    assert "download" not in result["timings"]
+    assert totals["totals"]["cached"] == 1
+
+
+def test_tampered_file_not_cached(release, osslsigncode, tmp_path, capsys):
+    # GIVEN: a manifest whose installer passed
+    cache = str(tmp_path / "verdicts.db")
+    sums = str(release / "SHA256SUMS")
+    with pytest.raises(SystemExit):
+        main(["--json", "--cache", cache, sums])
+    capsys.readouterr()
+    # WHEN: the installer is replaced, and the manifest checked again
+    shutil.copy("tests/data/bad_1.exe", release / INSTALLER)
+    with pytest.raises(SystemExit) as e:
+        main(["--json", "--cache", cache, sums])
+    # THEN: it fails, as not matching the manifest
+    result, totals = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert e.value.code == 1
+    assert not result["cached"]
+    assert result["status"] == "fail"
+    assert "ManifestMismatch" in result["results"][0]
@@ -0,0 +1,66 @@
+# Per-record stage timings are logged as CloudWatch Embedded Metric Format.
+
+from analyze_cloudwatch import main as analyze_cloudwatch
+from fx_sig_verify import metrics
+
+
+def summary(**extra):
+    result = {
+        "bucket": "b",
+        "key": "pub/firefox/firefox.exe",
+        "status": "fail",
+        "verdict": "SigVerifyBadSignature",
+        "timings": {"download": 120.5, "verify": 80.0, "notify": 3.2},
+        "bytes": 4096,
+    }
+    result.update(extra)
+    return result
+
+
+def test_emf_record(monkeypatch):
+    monkeypatch.delenv("METRICS_NAMESPACE", raising=False)
+    # GIVEN: a record's summary
+    # WHEN: its metrics are made
+    record = metrics.emf_record(summary(), timestamp=1.5)
+    # THEN: the stages it reached are metrics, by verdict & overall
+    [directive] = record["_aws"]["CloudWatchMetrics"]
+    assert directive["Namespace"] == "fx-sig-verify"
+    assert directive["Dimensions"] == [[], ["Verdict"]]
+    assert [m["Name"] for m in directive["Metrics"]] == [
+        "DownloadTime",
+        "VerifyTime",
+        "NotifyTime",
+        "BytesFetched",
+    ]
+    assert record["_aws"]["Timestamp"] == 1500
+    assert record["Verdict"] == "SigVerifyBadSignature"
+    assert record["VerifyTime"] == 80.0
+    assert record["BytesFetched"] == 4096
+    assert "WaitTime" not in record
+
+
+def test_metrics_off(monkeypatch):
+    monkeypatch.setenv("METRICS", "none")
+    assert not metrics.enabled()
+
+
+def test_analyze_stage_timings(tmp_path, capsys):
+    # GIVEN: a log with responses old and new, and metric lines
+    log = tmp_path / "log.txt"
+    log.write_text(
+        '2017-10-23T00:00:13.100Z {"_aws":{"Timestamp":1},"Verdict":"pass"}\n'
+        '2017-10-23T00:00:13.200Z {"request_id":"r1","results":'
+        '[{"status":"pass","results":[],"timings":{"download":10.0,"verify":30.0}},'
+        '{"status":"pass","results":[],"timings":{"download":20.0}}]}\n'
+        '2017-10-23T00:00:14.200Z {"request_id":"r2","results":'
+        '[{"status":"pass","results":[],"s3wait":0.5}]}\n'
+    )
+    # WHEN: it's summarized
+    analyze_cloudwatch(["--json", "--summarize", str(log)])
+    out, _ = capsys.readouterr()
+    # THEN: the metric lines are skipped, and the stages reported
+    assert "3 processed" in out
+    lines = {line.split()[0]: line.split()[1:] for line in out.splitlines() if line}
+    assert lines["download"] == ["2", "10.0", "20.0", "20.0", "20.0"]
+    assert lines["verify"] == ["1", "30.0", "30.0", "30.0", "30.0"]
+    assert lines["wait"] == ["1", "500.0", "500.0", "500.0", "500.0"]
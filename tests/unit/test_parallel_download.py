@@ -0,0 +1,140 @@
+# Large objects are retrieved as concurrent ranged GETs, small ones by a
+# single request.
+
+import boto3
+from botocore.exceptions import ClientError
+from moto import mock_s3
+import pytest
+import tests.utils as u
+
+from fx_sig_verify import aws_clients
+from fx_sig_verify import validate_moz_signature as vms
+from fx_sig_verify.validate_moz_signature import (
+    MozSignedObjectViaLambda,
+    SigVerifyBadSignature,
+)
+
+FNAME = "2020-05-32bit.exe"  # 781648 bytes
+
+
+class CountingClient:
+    """S3 client which records the Range of each get_object."""
+
+    def __init__(self, client):
+        self.client = client
+        self.ranges = []
+
+    def get_object(self, **kwargs):
+        self.ranges.append(kwargs.get("Range"))
+        return self.client.get_object(**kwargs)
+
+
+@pytest.fixture
+def counting_s3():
+    with mock_s3():
+        bucket = u.create_bucket()
+        client = CountingClient(boto3.client("s3"))
+        aws_clients.set_client("s3", client)
+        yield bucket, client
+
+
+def expected_bytes(fname=FNAME):
+    with open("tests/data/" + fname, "rb") as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("part_size, parts", [(64 * 1024, 12), (400 * 1024, 2)])
+def test_parts_reassembled(part_size, parts, counting_s3, monkeypatch):
+    monkeypatch.setattr(vms, "DOWNLOAD_PART_SIZE", part_size)
+    monkeypatch.setenv("DOWNLOAD_CONCURRENCY", "4")
+    bucket, client = counting_s3
+    bucket_name, key_name = u.upload_file(bucket, FNAME)
+    artifact = MozSignedObjectViaLambda(bucket_name, key_name)
+    # GIVEN: an object larger than a part
+    # WHEN: it is retrieved
+    with artifact.get_flo() as flo:
+        # THEN: the parts are in the right places
+        assert flo.read() == expected_bytes()
+        #  and the digest is still checked
+        artifact.check_digest(flo)
+    assert artifact.download_parts == parts
+    assert len(client.ranges) == parts
+    assert client.ranges[0] == f"bytes=0-{part_size - 1}"
+
+
+def test_small_object_single_request(counting_s3):
+    bucket, client = counting_s3
+    bucket_name, key_name = u.upload_file(bucket, FNAME)
+    artifact = MozSignedObjectViaLambda(bucket_name, key_name)
+    # GIVEN: an object smaller than a part
+    # WHEN: it is retrieved
+    with artifact.get_flo() as flo:
+        # THEN: one request is made
+        assert flo.read() == expected_bytes()
+    assert len(client.ranges) == 1
+    #  and the digest was computed as it arrived
+    assert artifact.digester is not None
+
+
+def test_parts_digest_mismatch(counting_s3, monkeypatch):
+    monkeypatch.setattr(vms, "DOWNLOAD_PART_SIZE", 32 * 1024)
+    bucket, _ = counting_s3
+    bucket_name, key_name = u.upload_file(bucket, "bad_2.exe")
+    artifact = MozSignedObjectViaLambda(bucket_name, key_name)
+    # GIVEN: a modified file, retrieved in parts
+    with artifact.get_flo() as flo:
+        # WHEN: it is checked
+        # THEN: it fails
+        with pytest.raises(SigVerifyBadSignature):
+            artifact.check_digest(flo)
+
+
+def test_empty_object(counting_s3):
+    bucket, client = counting_s3
+    bucket.put_object(Body=b"", Key="empty.exe")
+    artifact = MozSignedObjectViaLambda(u.bucket_name, "empty.exe")
+    # GIVEN: an empty object, which can't be retrieved by range
+    # WHEN: it is retrieved
+    with artifact.get_flo() as flo:
+        # THEN: it's empty
+        assert flo.read() == b""
+
+
+def test_replaced_during_download(counting_s3, monkeypatch):
+    monkeypatch.setattr(vms, "DOWNLOAD_PART_SIZE", 64 * 1024)
+    monkeypatch.setenv("DOWNLOAD_CONCURRENCY", "1")
+    bucket, client = counting_s3
+    bucket_name, key_name = u.upload_file(bucket, FNAME)
+    first = boto3.client("s3").get_object(
+        Bucket=bucket_name, Key=key_name, Range="bytes=0-0"
+    )
+    if "ETag" not in first:
+        pytest.skip("this S3 stand-in has no conditional ranged GETs")
+    real_get = client.get_object
+
+    def replace_after_first(**kwargs):
+        result = real_get(**kwargs)
+        if len(client.ranges) == 1:
+            u.upload_file(bucket, "32bit.exe", key_name)
+        return result
+
+    client.get_object = replace_after_first
+    artifact = MozSignedObjectViaLambda(bucket_name, key_name)
+    # GIVEN: an object replaced after the first part is retrieved
+    # WHEN: the rest is retrieved
+    # THEN: it fails, as an S3 error
+    with pytest.raises(ClientError):
+        artifact.get_flo()
+    assert artifact.had_s3_error
+
+
+@pytest.mark.parametrize(
+    "setting, expected",
+    [(None, vms.DOWNLOAD_PART_SIZE), ("16", 16 * 1024 * 1024), ("x", 8 * 1024 * 1024)],
+)
+def test_part_size_setting(setting, expected, monkeypatch):
+    if setting is None:
+        monkeypatch.delenv("DOWNLOAD_PART_SIZE_MB", raising=False)
+    else:
+        monkeypatch.setenv("DOWNLOAD_PART_SIZE_MB", setting)
+    assert vms.download_part_size() == expected
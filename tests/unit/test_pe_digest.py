@@ -0,0 +1,121 @@
+# Check the in-process PE checksum & Authenticode digest agree with the values
+# stored in the test files.
+
+import io
+
+from moto import mock_s3
+import pytest
+import tests.utils as u
+
+from fx_sig_verify import authenticode
+from fx_sig_verify import pe_digest
+from fx_sig_verify.validate_moz_signature import (
+    MozSignedObject,
+    MozSignedObjectViaLambda,
+    SigVerifyBadSignature,
+)
+
+DATA_DIR = "tests/data/"
+
+
+def read_data(fname):
+    with open(DATA_DIR + fname, "rb") as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("fname", u.good_file_names_list)
+def test_good_checksum_and_digest(fname):
+    # GIVEN: a file signed by Mozilla
+    with open(DATA_DIR + fname, "rb") as f:
+        # WHEN: the checksum & digest are computed
+        digest = pe_digest.digest_file(f)
+        signed = pe_digest.signed_digests(
+            authenticode.read_cert_table(f, digest.header)
+        )
+    # THEN: they match the values in the file
+    assert digest.checksum == digest.stored_checksum
+    assert signed
+    for algorithm, expected in signed.items():
+        assert digest.digests[algorithm] == expected
+
+
+@pytest.mark.parametrize(
+    "fname, reason",
+    [
+        ("bad_1.exe", "Checksum Mismatch"),
+        ("bad_2.exe", "Checksum Mismatch"),
+    ],
+)
+def test_bad_files_rejected(fname, reason):
+    # GIVEN: a file which has been modified after signing
+    with open(DATA_DIR + fname, "rb") as f:
+        # WHEN: the digest is checked
+        # THEN: it fails
+        with pytest.raises(SigVerifyBadSignature, match=reason):
+            MozSignedObject().check_digest(f)
+
+
+@pytest.mark.parametrize("fname", ["README.rst", "SNS_event_template.json"])
+def test_not_pe_file(fname):
+    # GIVEN: a file which isn't a PE file
+    with open(DATA_DIR + fname, "rb") as f:
+        # WHEN: its digest is computed, from the mapped file
+        # THEN: it's rejected, and the mapping can still be closed
+        with pytest.raises(authenticode.NotPEFileError):
+            pe_digest.digest_file(f)
+
+
+def test_modified_content_rejected():
+    # GIVEN: a signed file with a byte changed, and the checksum fixed up
+    data = bytearray(read_data("32bit.exe"))
+    header = authenticode.parse_pe_header(data)
+    data[header.size_of_headers + 100] ^= 0xFF
+    offset = header.checksum_offset
+    data[offset : offset + 4] = pe_digest.pe_checksum(data, offset).to_bytes(
+        4, "little"
+    )
+    # WHEN: the digest is checked
+    # THEN: the digest mismatch is found
+    with pytest.raises(SigVerifyBadSignature, match="Digest Mismatch"):
+        MozSignedObject().check_digest(io.BytesIO(data))
+
+
+@pytest.mark.parametrize("chunk_size", [1, 4095, 4097, 65536])
+@pytest.mark.parametrize("threads", [True, False])
+def test_incremental_matches_whole(chunk_size, threads):
+    data = read_data("2021-05-signable-file.exe")
+    expected = pe_digest.digest_file(io.BytesIO(data))
+    # GIVEN: a file arriving in pieces
+    digester = pe_digest.PEDigester(threads=threads)
+    # WHEN: each is fed to the digester
+    for start in range(0, len(data), chunk_size):
+        digester.update(data[start : start + chunk_size])
+    # THEN: the result is the same as for the whole file
+    assert digester.finish() == expected
+
+
+def test_without_numpy(monkeypatch):
+    data = read_data("32bit.exe")
+    expected = pe_digest.digest_file(io.BytesIO(data))
+    # GIVEN: numpy is not available
+    monkeypatch.setattr(pe_digest, "numpy", None)
+    # WHEN: the checksum is computed
+    digest = pe_digest.digest_file(io.BytesIO(data))
+    # THEN: the result is the same
+    assert digest.checksum == expected.checksum == expected.stored_checksum
+
+
+@mock_s3
+def test_digest_computed_during_download():
+    bucket = u.create_bucket()
+    bucket_name, key_name = u.upload_file(bucket, "bad_2.exe")
+    artifact = MozSignedObjectViaLambda(bucket_name, key_name)
+    # GIVEN: an object retrieved from S3
+    with artifact.get_flo() as flo:
+        # THEN: its digest was computed as it arrived
+        assert artifact.digester is not None
+        # WHEN: it is checked
+        with pytest.raises(SigVerifyBadSignature):
+            artifact.check_digest(flo)
+    # THEN: the streamed result was used
+    assert artifact.digester is None
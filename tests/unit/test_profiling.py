@@ -0,0 +1,129 @@
+# Processing can be profiled on demand, for CPU and memory.
+
+import json
+import threading
+
+from moto import mock_s3, mock_sns, mock_sqs
+import pytest
+import tests.utils as u
+
+from fx_sig_verify import profiling
+from fx_sig_verify.cli import main
+from fx_sig_verify.validate_moz_signature import MozSignedObject, lambda_handler
+
+
+@pytest.fixture(autouse=True)
+def production_after_test():
+    yield
+    MozSignedObject.production_criteria = True
+
+
+def busy_work():
+    return sorted(str(i) for i in range(20000))
+
+
+def test_profile_logged(capsys):
+    # GIVEN: CPU & memory profiling
+    # WHEN: some work is done, on the profiled thread & another
+    with profiling.Profiler("r1", cpu=True, memory=True, top=5):
+        kept = busy_work()
+
+        def other():
+            with profiling.profiled_thread():
+                busy_work()
+
+        thread = threading.Thread(target=other)
+        thread.start()
+        thread.join()
+    # THEN: a summary is logged, covering both threads
+    out, _ = capsys.readouterr()
+    record = json.loads(out)
+    assert record["message"] == "profile of r1"
+    profile = record["profile"]
+    assert len(profile["functions"]) == 5
+    busy = [f for f in profile["functions"] if f["function"].endswith("(busy_work)")]
+    assert busy and busy[0]["calls"] == 2
+    assert profile["peak_memory"] > 0
+    assert profile["allocations"][0]["size"] > 0
+    assert kept
+
+
+def test_profile_saved(tmp_path):
+    with profiling.Profiler("r2", output=str(tmp_path)):
+        busy_work()
+    saved = json.loads((tmp_path / "fx-sig-verify-profile-r2.json").read_text())
+    assert saved["functions"]
+    assert (tmp_path / "fx-sig-verify-profile-r2.prof").exists()
+
+
+def test_profiled_thread_idle():
+    # without a profiler, it's a no-op
+    with profiling.profiled_thread():
+        busy_work()
+
+
+@pytest.mark.parametrize(
+    "env, roll, expected",
+    [
+        ({}, 0, None),
+        ({"PROFILE": "cpu"}, 0, (True, False)),
+        ({"PROFILE": "all", "PROFILE_SAMPLE": "10"}, 0, (True, True)),
+        ({"PROFILE": "memory", "PROFILE_SAMPLE": "10"}, 3, None),
+    ],
+)
+def test_profiler_from_environment(env, roll, expected, monkeypatch):
+    for name in ("PROFILE", "PROFILE_SAMPLE", "PROFILE_OUTPUT"):
+        monkeypatch.delenv(name, raising=False)
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+    monkeypatch.setattr(profiling.random, "randrange", lambda n: roll)
+    profiler = profiling.profiler_from_environment("r3")
+    if expected is None:
+        assert profiler is None
+    else:
+        assert (profiler.cpu, profiler.memory) == expected
+
+
+def test_cli_profile(tmp_path):
+    # GIVEN: a file to check
+    # WHEN: the CLI profiles checking it
+    with pytest.raises(SystemExit):
+        main(
+            [
+                "--profile",
+                "--profile-output",
+                str(tmp_path),
+                "tests/data/signtool.exe",
+            ]
+        )
+    # THEN: the profile is saved
+    [saved] = tmp_path.glob("*.json")
+    functions = json.loads(saved.read_text())["functions"]
+    assert any("check_signer" in f["function"] for f in functions)
+
+
+@mock_s3
+@mock_sns
+@mock_sqs
+def test_lambda_profile(monkeypatch, capsys):
+    u.setup_aws_mocks()
+    bucket = u.create_bucket()
+    u.zero_production()
+    monkeypatch.setenv("PROFILE", "cpu")
+    monkeypatch.setenv("RECORD_WORKERS", "2")
+    # GIVEN: profiling is on, and an event with two records
+    records = []
+    for name in ("1-firefox.exe", "2-firefox.exe"):
+        _, key_name = u.upload_file(bucket, "signtool.exe", name)
+        records.extend(u.build_event(u.bucket_name, key_name)["Records"])
+    # WHEN: it is processed
+    lambda_handler({"Records": records}, u.dummy_context)
+    # THEN: the profile covers both records' threads
+    out, _ = capsys.readouterr()
+    [profile] = [
+        json.loads(line)["profile"] for line in out.splitlines() if '"profile"' in line
+    ]
+    [check] = [
+        f for f in profile["functions"] if f["function"].endswith("(check_record)")
+    ]
+    assert check["calls"] == 2
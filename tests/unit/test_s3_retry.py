@@ -0,0 +1,114 @@
+# A missing object is retried briefly, with backoff, rather than waiting on
+# a fixed schedule.
+
+import time
+
+from botocore.exceptions import ClientError
+from moto import mock_s3
+import pytest
+import tests.utils as u
+
+from fx_sig_verify import validate_moz_signature as vms
+from fx_sig_verify.validate_moz_signature import MozSignedObjectViaLambda
+
+
+def client_error(code):
+    return ClientError({"Error": {"Code": code, "Message": code}}, "GetObject")
+
+
+class AppearsLater:
+    """S3 operation which fails with `code` the first `failures` times."""
+
+    def __init__(self, failures, code="NoSuchKey"):
+        self.failures = failures
+        self.code = code
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise client_error(self.code)
+        return "object"
+
+
+@pytest.fixture(autouse=True)
+def no_deadline():
+    yield
+    MozSignedObjectViaLambda.deadline = None
+
+
+def test_retry_until_found():
+    # GIVEN: an object which isn't visible for the first 3 attempts
+    artifact = MozSignedObjectViaLambda("bucket", "key")
+    operation = AppearsLater(3)
+    # WHEN: it is retrieved
+    result = artifact.s3_retry(operation)
+    # THEN: it is found, after 3 short, growing waits
+    assert result == "object"
+    assert len(artifact.s3_waits) == 3
+    assert artifact.s3_waits == sorted(artifact.s3_waits)
+    assert artifact.s3_waits[0] < 0.1
+    assert artifact.s3_wait_time >= sum(artifact.s3_waits)
+    artifact.set_status("pass")
+    assert artifact.summary()["s3waits"] == [round(d, 3) for d in artifact.s3_waits]
+
+
+def test_other_errors_not_retried():
+    # GIVEN: access is denied
+    artifact = MozSignedObjectViaLambda("bucket", "key")
+    operation = AppearsLater(1, code="AccessDenied")
+    # WHEN: the object is retrieved
+    # THEN: the error is raised at once
+    with pytest.raises(ClientError):
+        artifact.s3_retry(operation)
+    assert operation.calls == 1
+    assert artifact.s3_waits == []
+
+
+def test_give_up_before_deadline():
+    # GIVEN: the Lambda is about to time out
+    MozSignedObjectViaLambda.deadline = time.time() + vms.DEADLINE_RESERVE
+    artifact = MozSignedObjectViaLambda("bucket", "key")
+    # WHEN: the object is missing
+    # THEN: there's no waiting
+    with pytest.raises(ClientError):
+        artifact.s3_retry(AppearsLater(10))
+    assert artifact.s3_waits == []
+
+
+def test_bounded_wait(monkeypatch):
+    monkeypatch.setattr(vms, "S3_MAX_WAIT", 0.3)
+    # GIVEN: an object which never appears
+    artifact = MozSignedObjectViaLambda("bucket", "key")
+    # WHEN: it is retrieved
+    start = time.time()
+    with pytest.raises(ClientError):
+        artifact.s3_retry(AppearsLater(1000))
+    # THEN: we give up in time
+    assert time.time() - start < 0.3 + 0.1
+    assert artifact.s3_waits
+
+
+def test_deadline_from_context():
+    class Context:
+        def get_remaining_time_in_millis(self):
+            return 30000
+
+    MozSignedObjectViaLambda.set_deadline(Context())
+    assert 29 < MozSignedObjectViaLambda.deadline - time.time() <= 30
+    MozSignedObjectViaLambda.set_deadline(u.dummy_context)
+    assert MozSignedObjectViaLambda.deadline is None
+
+
+@mock_s3
+def test_present_object_no_wait():
+    bucket = u.create_bucket()
+    bucket_name, key_name = u.upload_file(bucket, "signtool.exe", "firefox.exe")
+    artifact = MozSignedObjectViaLambda(bucket_name, key_name)
+    # GIVEN: an object which exists
+    # WHEN: it is retrieved
+    with artifact.get_flo():
+        pass
+    # THEN: nothing was retried
+    assert artifact.s3_waits == []
+    assert artifact.object_exists
@@ -0,0 +1,65 @@
+# Check that S3 objects are streamed into an artifact buffer, placed by the
+# Lambda memory limit, rather than read into memory all at once.
+
+from moto import mock_s3
+import pytest
+import tests.utils as u
+
+from fx_sig_verify.validate_moz_signature import (
+    DEFAULT_SPOOL_MAX_SIZE,
+    MozSignedObject,
+    MozSignedObjectViaLambda,
+)
+
+
+@pytest.fixture(autouse=True)
+def reset_memory_limit():
+    yield
+    MozSignedObjectViaLambda.set_memory_limit(None)
+
+
+@pytest.mark.parametrize(
+    "limit, expected",
+    [
+        (None, DEFAULT_SPOOL_MAX_SIZE),
+        ("bogus", DEFAULT_SPOOL_MAX_SIZE),
+        (128, 32 * 1024 * 1024),
+        ("1024", 256 * 1024 * 1024),
+    ],
+)
+def test_spool_size_follows_memory_limit(limit, expected):
+    # GIVEN: a lambda memory limit from the invocation context
+    MozSignedObjectViaLambda.set_memory_limit(limit)
+    # WHEN: the spool size is computed
+    # THEN: it is a fraction of the limit
+    assert MozSignedObjectViaLambda.spool_max_size() == expected
+
+
+@mock_s3
+@pytest.mark.parametrize("memory_limit, in_memory", [(None, True), (1, False)])
+def test_get_flo_streams_body(memory_limit, in_memory):
+    bucket = u.create_bucket()
+    fname = "2020-05-32bit.exe"  # larger than 1/4 MiB
+    bucket_name, key_name = u.upload_file(bucket, fname)
+    with open("tests/data/" + fname, "rb") as f:
+        expected = f.read()
+    # GIVEN: a lambda with a memory limit
+    MozSignedObjectViaLambda.set_memory_limit(memory_limit)
+    artifact = MozSignedObjectViaLambda(bucket_name, key_name)
+    # WHEN: the object is retrieved
+    with artifact.get_flo() as flo:
+        # THEN: the contents are intact
+        assert flo.read() == expected
+        assert flo.original_name == key_name
+        #  and large objects were placed on disk
+        assert flo.in_memory == in_memory
+
+
+def test_verifier_input_reuses_real_file():
+    # GIVEN: a local file
+    with open("tests/data/" + u.good_file_names_list[0], "rb") as f:
+        # WHEN: a path for the verifier is needed
+        with MozSignedObject.verifier_input(f) as (path, pass_fds):
+            # THEN: no copy is made
+            assert path == f.name
+            assert pass_fds == ()
@@ -0,0 +1,188 @@
+# Notifications are batched, published in the background, and similar ones
+# collapsed into a digest.
+
+import json
+
+from botocore.exceptions import ClientError
+from moto import mock_s3, mock_sns, mock_sqs
+import pytest
+import tests.utils as u
+
+from fx_sig_verify import sns_dispatcher
+from fx_sig_verify.sns_dispatcher import SNSDispatcher
+from fx_sig_verify.validate_moz_signature import MozSignedObject, lambda_handler
+
+TOPIC = "arn:aws:sns:us-east-1:123456789012:some-topic"
+
+
+class RecordingClient:
+    """Stand-in SNS client, which can be told to fail entries."""
+
+    def __init__(self, fail_ids=(), raises=None):
+        self.batches = []
+        self.singles = []
+        self.fail_ids = set(fail_ids)
+        self.raises = raises
+
+    def publish_batch(self, TopicArn, PublishBatchRequestEntries):
+        if self.raises:
+            raise self.raises
+        self.batches.append(PublishBatchRequestEntries)
+        ids = [e["Id"] for e in PublishBatchRequestEntries]
+        return {
+            "Successful": [{"Id": i} for i in ids if i not in self.fail_ids],
+            "Failed": [
+                {"Id": i, "Code": "InternalError", "Message": "oops"}
+                for i in ids
+                if i in self.fail_ids
+            ],
+        }
+
+    def publish(self, TopicArn, Subject, Message):
+        self.singles.append(Subject)
+        return {"MessageId": str(len(self.singles))}
+
+    @property
+    def entries(self):
+        return [entry for batch in self.batches for entry in batch]
+
+
+@pytest.fixture(autouse=True)
+def production_after_test():
+    yield
+    MozSignedObject.production_criteria = True
+
+
+def test_batched():
+    client = RecordingClient()
+    # GIVEN: a dispatcher which waits long enough to fill a batch
+    dispatcher = SNSDispatcher(TOPIC, client=client, linger=1)
+    # WHEN: 25 distinct notifications are sent
+    for i in range(25):
+        dispatcher.submit(f"fail {i}", f"fail {i}\nmore")
+    dispatcher.flush()
+    # THEN: they all go, in batches of up to 10
+    assert [len(b) for b in client.batches] == [10, 10, 5]
+    assert [e["Subject"] for e in client.entries] == [f"fail {i}" for i in range(25)]
+    assert dispatcher.published == 25
+
+
+def test_collapsed_into_digest():
+    client = RecordingClient()
+    dispatcher = SNSDispatcher(TOPIC, client=client, collapse_after=3)
+    group = ("fail", "SigVerifyBadSignature", "s3://bucket/nightly/")
+    # GIVEN: fifty failures of the same kind, and one other
+    for i in range(50):
+        dispatcher.submit(
+            f"fail {i}", "msg", group=group, name=f"s3://bucket/nightly/{i}"
+        )
+    dispatcher.submit("pass", "msg", group=("pass", None, "s3://bucket/"))
+    # WHEN: they are delivered
+    dispatcher.flush()
+    # THEN: only the first few are sent individually
+    subjects = [e["Subject"] for e in client.entries]
+    assert subjects[:3] == ["fail 0", "fail 1", "fail 2"]
+    assert "pass" in subjects
+    #  and the rest are summarized
+    assert len(subjects) == 5
+    digest = client.entries[-1]
+    assert digest["Subject"].startswith("47 more: fail SigVerifyBadSignature")
+    assert "s3://bucket/nightly/49" in digest["Message"]
+    assert dispatcher.collapsed == 47
+
+
+def test_subject_truncated_per_entry():
+    long_subject = "fail for s3://" + "x/" * 60 + "firefox.exe"
+    # GIVEN: a message with a long first line
+    # WHEN: its subject is computed
+    subject = sns_dispatcher.subject_for(long_subject + "\nbody")
+    # THEN: it fits, keeping the file name
+    assert len(subject) < sns_dispatcher.MAX_SUBJECT_LENGTH
+    assert subject.endswith("firefox.exe")
+
+
+def test_large_messages_split():
+    client = RecordingClient()
+    dispatcher = SNSDispatcher(TOPIC, client=client, linger=1)
+    # GIVEN: notifications which together exceed the request size limit
+    for i in range(4):
+        dispatcher.submit(f"fail {i}", "x" * (100 * 1024))
+    dispatcher.flush()
+    # THEN: they're sent in more than one request
+    assert [len(b) for b in client.batches] == [2, 2]
+
+
+@pytest.mark.parametrize(
+    "client", [RecordingClient(fail_ids={"1"}), RecordingClient(raises=OSError("down"))]
+)
+def test_failures_reported(client):
+    dispatcher = SNSDispatcher(TOPIC, client=client, linger=1)
+    failed = []
+    # GIVEN: notifications which can't all be delivered
+    for i in range(3):
+        dispatcher.submit(f"fail {i}", "msg", on_failure=failed.append)
+    # WHEN: the dispatcher is flushed
+    dispatcher.flush()
+    # THEN: the failures are reported
+    assert failed
+    assert len(failed) == (1 if client.fail_ids else 3)
+
+
+class OlderClient:
+    """Stand-in SNS client from before PublishBatch."""
+
+    def __init__(self):
+        self.singles = []
+
+    publish = RecordingClient.publish
+
+
+@pytest.mark.parametrize(
+    "client",
+    [
+        OlderClient(),
+        RecordingClient(
+            raises=ClientError(
+                {"Error": {"Code": "InvalidAction", "Message": "unknown"}},
+                "PublishBatch",
+            )
+        ),
+    ],
+)
+def test_published_singly_without_batches(client):
+    dispatcher = SNSDispatcher(TOPIC, client=client, linger=1)
+    failed = []
+    # GIVEN: an SNS which doesn't have PublishBatch
+    # WHEN: notifications are sent
+    for i in range(12):
+        dispatcher.submit(f"fail {i}", "msg", on_failure=failed.append)
+    dispatcher.flush()
+    # THEN: they're published one at a time instead
+    assert client.singles == [f"fail {i}" for i in range(12)]
+    assert dispatcher.published == 12
+    assert not failed
+
+
+@mock_s3
+@mock_sns
+@mock_sqs
+def test_lambda_collapses_alerts(monkeypatch):
+    queue = u.setup_aws_mocks()
+    bucket = u.create_bucket()
+    u.zero_production()
+    monkeypatch.setenv("SNS_COLLAPSE_AFTER", "2")
+    # GIVEN: a push of many bad files
+    records = []
+    for i in range(6):
+        _, key_name = u.upload_file(bucket, "signtool.exe", f"nightly/{i}.exe")
+        records.extend(u.build_event(u.bucket_name, key_name)["Records"])
+    # WHEN: they're processed
+    response = lambda_handler({"Records": records}, u.dummy_context)
+    # THEN: every one fails
+    assert [r["status"] for r in response["results"]] == ["fail"] * 6
+    #  but there are only two alerts, plus a digest
+    messages = queue.receive_messages(MaxNumberOfMessages=10)
+    subjects = [json.loads(m.body)["Subject"] for m in messages]
+    assert len(subjects) == 3
+    digest = "4 more: fail SigVerifyNonMozSignature"
+    assert sum(s.startswith(digest) for s in subjects) == 1
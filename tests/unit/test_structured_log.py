@@ -0,0 +1,129 @@
+# Logging is one JSON line per record, and costs nothing when disabled.
+
+import json
+
+import pytest
+
+from analyze_cloudwatch import main as analyze_cloudwatch
+from fx_sig_verify import structured_log
+from fx_sig_verify import validate_moz_signature
+from fx_sig_verify.validate_moz_signature import MozSignedObject, debug, info
+
+
+class Unformattable:
+    def __str__(self):
+        raise AssertionError("formatted a disabled message")
+
+    __repr__ = __str__
+
+
+@pytest.fixture(autouse=True)
+def not_sampled():
+    structured_log.sample_invocation(0)
+    yield
+    structured_log.sample_invocation(0)
+
+
+def logged_lines(capsys):
+    out, _ = capsys.readouterr()
+    return [json.loads(line) for line in out.splitlines()]
+
+
+def test_disabled_not_formatted(monkeypatch, capsys):
+    # GIVEN: the default verbosity
+    monkeypatch.setattr(MozSignedObject, "verbose", 0)
+    # WHEN: messages are logged
+    debug("value %s", Unformattable())
+    info("value %r", Unformattable())
+    # THEN: nothing was formatted or output
+    assert capsys.readouterr().out == ""
+
+
+def test_one_json_line_per_record(monkeypatch, capsys):
+    # GIVEN: debugging
+    monkeypatch.setattr(MozSignedObject, "verbose", 2)
+    # WHEN: a multi-line message is logged
+    debug("exit %s\n-- stderr:\n'%s'", 1, "oops")
+    # THEN: it's a single line of JSON
+    [record] = logged_lines(capsys)
+    assert record["level"] == "debug"
+    assert record["message"] == "exit 1\n-- stderr:\n'oops'"
+
+
+def test_sampled_invocation_debugs(monkeypatch, capsys):
+    # GIVEN: an invocation chosen for sampling
+    monkeypatch.setattr(MozSignedObject, "verbose", 0)
+    monkeypatch.setenv("LOG_SAMPLE_RATE", "1")
+    assert structured_log.sample_invocation()
+    # WHEN: a debug message is logged
+    debug("probe used %s GETs", 2)
+    # THEN: it's output
+    [record] = logged_lines(capsys)
+    assert record["message"] == "probe used 2 GETs"
+
+
+@pytest.mark.parametrize("rate", ["0", "", "often"])
+def test_not_sampled(rate, monkeypatch):
+    monkeypatch.setenv("LOG_SAMPLE_RATE", rate)
+    assert not structured_log.sample_invocation()
+
+
+def test_dumps_without_orjson(monkeypatch):
+    monkeypatch.setattr(structured_log, "orjson", None)
+    assert structured_log.dumps({"a": [1, 2 ** 70], "b": object}) == (
+        '{"a":[1,1180591620717411303424],"b":"<class \'object\'>"}'
+    )
+
+
+@pytest.mark.parametrize(
+    "mode, expected",
+    [
+        ("full", {"Records": ["x" * 100]}),
+        ("omit", None),
+        ("truncate", '{"Records":["' + "x" * 34 + "..."),
+    ],
+)
+def test_input_event_to_log(mode, expected):
+    event = {"Records": ["x" * 100]}
+    assert structured_log.input_event_to_log(event, mode, limit=50) == expected
+
+
+def test_small_event_not_truncated(monkeypatch):
+    monkeypatch.delenv("LOG_INPUT_EVENT", raising=False)
+    event = {"Records": []}
+    assert structured_log.input_event_to_log(event) is event
+
+
+def test_response_omits_input_event(monkeypatch, capsys):
+    # GIVEN: the input event isn't wanted
+    monkeypatch.setenv("LOG_INPUT_EVENT", "omit")
+    response = {"input_event": {"Records": []}, "request_id": "r1", "results": []}
+    # WHEN: the response is logged
+    validate_moz_signature.log_response(response)
+    # THEN: it's left out of the log, but not the response
+    [logged] = logged_lines(capsys)
+    assert logged == {"request_id": "r1", "results": []}
+    assert "input_event" in response
+
+
+def test_analyze_skips_log_records(tmp_path, capsys):
+    # GIVEN: a log with structured log records among the usual lines
+    log = tmp_path / "log.txt"
+    log.write_text(
+        "2017-10-23T00:00:13.000Z START RequestId: r1 Version: $LATEST\n"
+        '2017-10-23T00:00:13.100Z {"level":"debug","time":"t","message":"hi"}\n'
+        '2017-10-23T00:00:13.200Z {"request_id":"r1","results":'
+        '[{"status":"pass","results":[]}]}\n'
+        "2017-10-23T00:00:13.300Z END RequestId: r1\n"
+        "2017-10-23T00:00:13.400Z REPORT RequestId: r1 Duration: 1.0 ms "
+        "Billed Duration: 100 ms Memory Size: 128 MB Max Memory Used: 30 MB\n"
+    )
+    # WHEN: it's checked and summarized
+    analyze_cloudwatch(["--consistency-check", str(log)])
+    checked, _ = capsys.readouterr()
+    analyze_cloudwatch(["--json", "--summarize", str(log)])
+    summary, _ = capsys.readouterr()
+    # THEN: the log records are ignored
+    assert checked == ""
+    assert "1 passed" in summary
+    assert "1 processed" in summary
@@ -0,0 +1,54 @@
+# Tracing backends: X-Ray, nothing at all, or spans recorded in memory.
+
+import pytest
+
+from fx_sig_verify import tracing
+
+
+def double(x):
+    return 2 * x
+
+
+def test_noop_adds_nothing():
+    # GIVEN: the no-op tracer
+    tracer = tracing.NoopTracer()
+    # WHEN: a function is traced
+    # THEN: it is left as is
+    assert tracer.traced()(double) is double
+
+
+def test_recorder_records_spans():
+    # GIVEN: the recording tracer
+    tracer = tracing.RecordingTracer()
+    traced_double = tracer.traced()(double)
+    # WHEN: traced functions & stages run, one failing
+    assert traced_double(2) == 4
+    with pytest.raises(KeyError):
+        with tracer.span("lookup"):
+            {}["missing"]
+    # THEN: each is recorded, with its outcome
+    [call] = tracer.recorder.spans("double")
+    assert call.duration >= 0 and not call.error
+    [lookup] = tracer.recorder.spans("lookup")
+    assert lookup.error
+    assert tracer.recorder.totals()["double"][0] == 1
+
+
+@pytest.mark.parametrize(
+    "tracing_env, xray_disable, expected",
+    [
+        ("record", None, "record"),
+        ("none", None, "none"),
+        ("XRay", "yes", "xray"),
+        (None, None, "xray"),
+        (None, "yes", "none"),
+        ("bogus", None, "xray"),
+    ],
+)
+def test_tracer_from_environment(tracing_env, xray_disable, expected, monkeypatch):
+    for name, value in (("TRACING", tracing_env), ("XRAY_DISABLE", xray_disable)):
+        if value is None:
+            monkeypatch.delenv(name, raising=False)
+        else:
+            monkeypatch.setenv(name, value)
+    assert tracing.tracer_from_environment().name == expected
@@ -0,0 +1,193 @@
+# Check the verdict cache backends, and that a cached verdict avoids
+# retrieving the object again.
+
+import time
+
+import boto3
+from moto import mock_s3
+import pytest
+import tests.utils as u
+
+try:
+    # moto before 3.0 (the pinned 1.3.0) has the current API as dynamodb2
+    from moto import mock_dynamodb2 as mock_dynamodb
+except ImportError:
+    from moto import mock_dynamodb
+
+from fx_sig_verify import verdict_cache as vc
+from fx_sig_verify.cli import main as cli_main
+from fx_sig_verify.validate_moz_signature import (
+    MozSignedObject,
+    MozSignedObjectViaLambda,
+    artifact_to_check_via_s3,
+)
+
+TABLE_NAME = "verdicts"
+
+
+@pytest.fixture(autouse=True)
+def no_cache_after_test():
+    yield
+    MozSignedObject.verdict_cache = None
+    MozSignedObject.production_criteria = True
+
+
+def memory_cache(tmp_path, **kwargs):
+    return vc.MemoryVerdictCache(**kwargs)
+
+
+def sqlite_cache(tmp_path, **kwargs):
+    return vc.SQLiteVerdictCache(str(tmp_path / "verdicts.db"), **kwargs)
+
+
+def dynamodb_cache(tmp_path, **kwargs):
+    client = boto3.client("dynamodb")
+    client.create_table(
+        TableName=TABLE_NAME,
+        KeySchema=[{"AttributeName": "cache_key", "KeyType": "HASH"}],
+        AttributeDefinitions=[{"AttributeName": "cache_key", "AttributeType": "S"}],
+        ProvisionedThroughput={"ReadCapacityUnits": 5, "WriteCapacityUnits": 5},
+    )
+    return vc.DynamoDBVerdictCache(TABLE_NAME, client=client, **kwargs)
+
+
+cache_factories = [memory_cache, sqlite_cache, dynamodb_cache]
+
+
+@mock_dynamodb
+@pytest.mark.parametrize("factory", cache_factories)
+def test_round_trip(factory, tmp_path):
+    # GIVEN: a cache with a verdict in it
+    cache = factory(tmp_path)
+    key = vc.s3_key('"abc123"', 42)
+    cache.put(key, "fail", ["Failure reason: SigVerifyBadSignature"])
+    # WHEN: it is looked up
+    verdict = cache.get(key)
+    # THEN: it is found intact
+    assert verdict.status == "fail"
+    assert verdict.results == ["Failure reason: SigVerifyBadSignature"]
+    #  and other keys aren't
+    assert cache.get(vc.s3_key("abc123", 43)) is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+@mock_dynamodb
+@pytest.mark.parametrize("factory", cache_factories)
+def test_expired(factory, tmp_path):
+    # GIVEN: a verdict older than the TTL
+    cache = factory(tmp_path, ttl=-1)
+    cache.put("k", "pass")
+    # WHEN: it is looked up
+    # THEN: it isn't used
+    assert cache.get("k") is None
+
+
+@mock_dynamodb
+@pytest.mark.parametrize("factory", cache_factories)
+def test_cert_rotation_invalidates(factory, tmp_path):
+    # GIVEN: a verdict made with one set of trusted certs
+    cache = factory(tmp_path, fingerprint=vc.trust_fingerprint([1, 2]))
+    cache.put("k", "fail")
+    # WHEN: the trusted certs change
+    cache.fingerprint = vc.trust_fingerprint([1, 2, 3])
+    # THEN: the verdict isn't used
+    assert cache.get("k") is None
+
+
+@pytest.mark.parametrize("factory", [memory_cache, sqlite_cache])
+def test_eviction(factory, tmp_path):
+    # GIVEN: a cache with limited space
+    cache = factory(tmp_path, max_entries=2)
+    # WHEN: more verdicts are added than fit
+    for key in "abc":
+        cache.put(key, "pass")
+        time.sleep(0.01)
+    # THEN: the oldest is gone
+    assert cache.get("a") is None
+    assert cache.get("c") is not None
+
+
+def test_cache_from_url(tmp_path):
+    assert isinstance(vc.cache_from_url("memory:"), vc.MemoryVerdictCache)
+    cache = vc.cache_from_url("sqlite://" + str(tmp_path / "x.db"))
+    assert isinstance(cache, vc.SQLiteVerdictCache)
+    with pytest.raises(ValueError):
+        vc.cache_from_url("redis://nope")
+
+
+@mock_s3
+def test_cache_hit_skips_download():
+    bucket = u.create_bucket()
+    bucket_name, key_name = u.upload_file(bucket, "signtool.exe", "firefox.exe")
+    MozSignedObject.set_production_criteria(False)
+    MozSignedObject.set_verdict_cache("memory:")
+    # GIVEN: an object which has been verified once
+    first = MozSignedObjectViaLambda(bucket_name, key_name)
+    assert not first.process_one_s3_file()
+    assert not first.summary()["cached"]
+    # WHEN: the same contents are verified again
+    second = MozSignedObjectViaLambda(bucket_name, key_name)
+
+    def no_check():
+        raise AssertionError("check_exe should not be called")
+
+    second.check_exe = no_check
+    valid = second.process_one_s3_file()
+    # THEN: the cached verdict is used
+    summary = second.summary()
+    assert not valid
+    assert summary["status"] == "fail"
+    assert summary["cached"]
+    assert "Failure reason: SigVerifyNonMozSignature" in summary["results"]
+
+
+@mock_s3
+def test_verifier_missing_not_cached(tmp_path, monkeypatch):
+    bucket = u.create_bucket()
+    bucket_name, key_name = u.upload_file(bucket, "32bit.exe", "firefox.exe")
+    MozSignedObject.set_production_criteria(False)
+    MozSignedObject.set_verdict_cache("memory:")
+    # GIVEN: no osslsigncode to be found
+    monkeypatch.setenv("PATH", str(tmp_path))
+    # WHEN: a good file is checked, twice
+    first = MozSignedObjectViaLambda(bucket_name, key_name)
+    second = MozSignedObjectViaLambda(bucket_name, key_name)
+    assert not first.process_one_s3_file()
+    assert not second.process_one_s3_file()
+    # THEN: it fails, but that's not remembered
+    summary = second.summary()
+    assert not summary["cached"]
+    assert "VerifierUnavailable" in summary["results"][0]
+
+
+def test_etag_from_event():
+    # GIVEN: an event record with the object's ETag
+    record = {
+        "s3": {
+            "bucket": {"name": "b"},
+            "object": {"key": "k", "eTag": "0123abcd", "size": 99},
+        }
+    }
+    # WHEN: the artifact is built
+    artifact = artifact_to_check_via_s3(record)
+    # THEN: the key comes from the event
+    assert artifact.cache_key() == "etag:0123abcd:99"
+
+
+def test_cli_cache(tmp_path):
+    db = str(tmp_path / "cli.db")
+    cmd_line = ["--cache", db, "tests/data/signtool.exe"]
+    # GIVEN: a file checked from the command line with a cache
+    with pytest.raises(SystemExit) as e:
+        cli_main(cmd_line)
+    assert e.value.code == 1
+    # WHEN: the cache is examined
+    cache = vc.SQLiteVerdictCache(db)
+    rows = cache._db.execute("SELECT status FROM verdicts").fetchall()
+    # THEN: the verdict was recorded
+    assert rows == [("fail",)]
+    # and is reused on the next run
+    with pytest.raises(SystemExit) as e:
+        cli_main(cmd_line)
+    assert e.value.code == 1
+    assert MozSignedObject.verdict_cache.hits == 1
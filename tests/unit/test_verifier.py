@@ -0,0 +1,85 @@
+# Verifiers keep their own configuration, so differently configured ones can
+# be used at once, from many threads, without touching the class settings.
+
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from moto import mock_s3
+
+from fx_sig_verify import verdict_cache as vc
+from fx_sig_verify.validate_moz_signature import MozSignedObject, VALID_CERTS
+from fx_sig_verify.verifier import Verifier
+
+MOZ_SIGNED = "tests/data/32bit.exe"
+MS_SIGNED = "tests/data/signtool.exe"
+
+
+def test_concurrent_configurations():
+    # GIVEN: one verifier trusting Mozilla, and one trusting nobody
+    trusting = Verifier(production_criteria=False)
+    distrusting = Verifier(valid_certs=[], production_criteria=False)
+    jobs = [(trusting, MOZ_SIGNED), (distrusting, MOZ_SIGNED)] * 8
+    # WHEN: they check the same file concurrently
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        artifacts = list(pool.map(lambda job: job[0].verify_path(job[1]), jobs))
+    # THEN: each applied its own trust
+    for (verifier, _), artifact in zip(jobs, artifacts):
+        rejected = artifact.failure_class() == "SigVerifyNonMozSignature"
+        assert rejected == (verifier is distrusting)
+
+
+def test_class_settings_untouched():
+    # GIVEN: the class defaults
+    before = (MozSignedObject.verbose, MozSignedObject.production_criteria)
+    # WHEN: a verifier with other settings is used
+    artifact = Verifier(verbose=0, production_criteria=False).verify_path(MS_SIGNED)
+    # THEN: only its artifact has them
+    assert artifact.production_criteria is False
+    assert (MozSignedObject.verbose, MozSignedObject.production_criteria) == before
+    assert artifact.failure_class() == "SigVerifyNonMozSignature"
+
+
+def test_verify_bytes_cached():
+    # GIVEN: a verifier with its own cache
+    verifier = Verifier(verdict_cache="memory:")
+    # WHEN: the same bytes are verified twice
+    first = verifier.verify_bytes(b"MZ not really", "junk.exe")
+    second = verifier.verify_bytes(b"MZ not really", "junk.exe")
+    # THEN: the verdict is reused
+    assert first.get_status() == second.get_status() == "fail"
+    assert second.failure_class() == "SigVerifyNoSignature"
+    assert not first.cache_hit and second.cache_hit
+    assert verifier.verdict_cache.fingerprint
+    assert verifier.valid_certs == frozenset(VALID_CERTS)
+
+
+def test_shared_cache_keeps_trust_apart():
+    # GIVEN: a cache shared by verifiers, with a pass trusting Mozilla
+    shared = vc.MemoryVerdictCache(fingerprint=vc.trust_fingerprint(VALID_CERTS))
+    with open(MOZ_SIGNED, "rb") as f:
+        shared.put(vc.sha256_key(vc.sha256_file(f)), "pass")
+    # WHEN: a verifier trusting nobody checks the file
+    artifact = Verifier(
+        valid_certs=[], production_criteria=False, verdict_cache=shared
+    ).verify_path(MOZ_SIGNED)
+    # THEN: it doesn't get that pass
+    assert not artifact.cache_hit
+    assert artifact.failure_class() == "SigVerifyNonMozSignature"
+    #  but a verifier trusting Mozilla does
+    trusting = Verifier(production_criteria=False, verdict_cache=shared)
+    assert trusting.verify_path(MOZ_SIGNED).cache_hit
+
+
+@mock_s3
+def test_verify_s3_with_own_client():
+    # GIVEN: an unsigned object, and a verifier with its own S3 client
+    s3 = boto3.client("s3", region_name="us-east-1")
+    s3.create_bucket(Bucket="bucket")
+    s3.put_object(Bucket="bucket", Key="Firefox Setup.exe", Body=b"MZ" + b"\0" * 200)
+    verifier = Verifier(clients={"s3": s3})
+    # WHEN: it's verified
+    artifact = verifier.verify_s3("bucket", "Firefox Setup.exe")
+    # THEN: it fails, without being retried or notified
+    assert artifact.get_status() == "fail"
+    assert not artifact.needs_retry
+    assert artifact.verifier.client("s3") is s3